@@ -1,14 +1,19 @@
-import boto3
 import os
 import json
+import threading
+import time
 import dotenv
 import pathlib
 from logging_config import logger
+from json_state import write_atomically
 
 
 class SecretsManager:
     def __init__(self, secret_name, region):
         logger.info(f"Initializing SecretsManager object for secret: {secret_name}")
+        # boto3 is slow to import, only do it when the secret is actually fetched.
+        import boto3
+
         self.secret_name = secret_name
         self.region = region
         self.session = boto3.Session()
@@ -76,22 +81,173 @@ class SecretsManager:
 
         return response
 
-    def get_secret(self) -> None:
+    def get_secret_values(self) -> dict:
         """
         This method fetches a secret from AWS Secrets Manager using the provided secret name.
-        It then sets the retrieved secret values as environment variables.
 
         Returns:
-            None
+            dict: The secret values.
         """
-        # Fetch the secret
         logger.info(f"Retrieving secret: {self.secret_name}")
         response = self.client.get_secret_value(SecretId=self.secret_name)
         secret_dict = json.loads(response["SecretString"])
-        # Set environment variables
-        for key, value in secret_dict.items():
-            os.environ[key] = value
         logger.info(f"Retrieved secret: {self.secret_name}")
+        return secret_dict
+
+    def get_secret(self) -> None:
+        """
+        This method fetches a secret from AWS Secrets Manager using the provided secret name.
+        It then sets the retrieved secret values as environment variables.
+        The lambda does not use this anymore, see SecretCache.
+
+        Returns:
+            None
+        """
+        for key, value in self.get_secret_values().items():
+            os.environ[key] = value
+
+
+class SecretCache:
+    """
+    In-memory cache of the secret values with a time to live.
+
+    The secret is fetched on first access, and fetched again on the first access after the
+    TTL has passed, so a warm invocation never runs on values older than the TTL. If that
+    fetch fails, the cached values are returned and the next access tries again.
+
+    With `background_refresh`, expired values are still returned while a thread fetches the
+    new ones. That is only for long-running processes such as the stream daemon: Lambda
+    freezes the process between invocations, a refresh thread would only run, if at all,
+    in the middle of a later invocation.
+
+    Optionally the values are also kept in a file in /tmp, encrypted with Fernet.
+    That file survives for the lifetime of the Lambda execution environment.
+    """
+
+    def __init__(
+        self,
+        secret_name: str,
+        region: str,
+        ttl_seconds: float = 900,
+        file_cache_path: str | None = None,
+        file_cache_key: str | None = None,
+        background_refresh: bool = False,
+    ):
+        """
+        Args:
+            secret_name (str): The name of the secret in AWS Secrets Manager.
+            region (str): The AWS region of the secret.
+            ttl_seconds (float, optional): How long fetched values are fresh. Defaults to 15 minutes.
+            file_cache_path (str, optional): Where to keep the encrypted file cache. Defaults to None (no file cache).
+            file_cache_key (str, optional): A Fernet key. The file cache is only used when this is set.
+            background_refresh (bool, optional): Refresh expired values in a background thread
+                instead of on access. Defaults to False.
+        """
+        self.secret_name = secret_name
+        self.region = region
+        self.ttl_seconds = ttl_seconds
+        self.file_cache_path = file_cache_path if file_cache_key else None
+        self.file_cache_key = file_cache_key
+        self.background_refresh = background_refresh
+        self._values = None
+        self._fetched_at = 0.0
+        self._lock = threading.Lock()
+        self._refresh_thread = None
+
+    def get(self) -> dict:
+        """
+        Return the secret values, fetching them on first access and once they expired.
+        """
+        if self._values is None:
+            with self._lock:
+                if self._values is None:
+                    self._load()
+        elif self._expired():
+            if self.background_refresh:
+                self._refresh_in_background()
+            else:
+                with self._lock:
+                    # Another thread may have refreshed the values while this one waited.
+                    if self._expired():
+                        logger.info(
+                            f"Secret cache expired, refreshing: {self.secret_name}"
+                        )
+                        self._refresh()
+        return self._values
+
+    def _expired(self) -> bool:
+        return time.time() - self._fetched_at > self.ttl_seconds
+
+    def _load(self) -> None:
+        """
+        First access: use the file cache if it is fresh, otherwise fetch from Secrets Manager.
+        """
+        start = time.perf_counter()
+        cached = self._read_file_cache()
+        if cached is not None:
+            self._fetched_at, self._values = cached
+            logger.info(
+                f"Loaded secret from file cache in {(time.perf_counter() - start) * 1000:.0f} ms"
+            )
+            return
+        self._fetch()
+        logger.info(
+            f"Loaded secret from Secrets Manager in {(time.perf_counter() - start) * 1000:.0f} ms"
+        )
+
+    def _fetch(self) -> None:
+        values = SecretsManager(self.secret_name, self.region).get_secret_values()
+        self._values = values
+        self._fetched_at = time.time()
+        self._write_file_cache()
+
+    def _refresh_in_background(self) -> None:
+        with self._lock:
+            if self._refresh_thread is not None and self._refresh_thread.is_alive():
+                return
+            logger.info(f"Secret cache expired, refreshing: {self.secret_name}")
+            self._refresh_thread = threading.Thread(
+                target=self._refresh, name="secret-refresh", daemon=True
+            )
+            self._refresh_thread.start()
+
+    def _refresh(self) -> None:
+        try:
+            self._fetch()
+        except Exception as e:
+            # Keep serving the cached values, the next access tries again.
+            logger.error(f"Could not refresh secret {self.secret_name}. Error: {e}")
+
+    def _read_file_cache(self) -> tuple[float, dict] | None:
+        if not self.file_cache_path or not os.path.exists(self.file_cache_path):
+            return None
+        from cryptography.fernet import Fernet, InvalidToken
+
+        try:
+            with open(self.file_cache_path, "rb") as file:
+                data = json.loads(Fernet(self.file_cache_key).decrypt(file.read()))
+        except (InvalidToken, ValueError, OSError) as e:
+            logger.error(f"Ignoring unreadable secret file cache. Error: {e}")
+            return None
+        if time.time() - data["fetched_at"] > self.ttl_seconds:
+            return None
+        return data["fetched_at"], data["values"]
+
+    def _write_file_cache(self) -> None:
+        if not self.file_cache_path:
+            return
+        from cryptography.fernet import Fernet
+
+        data = json.dumps({"fetched_at": self._fetched_at, "values": self._values})
+        try:
+            # Readable by the owner only, the file holds credentials even if encrypted.
+            write_atomically(
+                self.file_cache_path,
+                Fernet(self.file_cache_key).encrypt(data.encode()),
+                permissions=0o600,
+            )
+        except OSError as e:
+            logger.error(f"Could not write the secret file cache. Error: {e}")
 
 
 if __name__ == "__main__":
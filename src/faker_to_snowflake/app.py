@@ -1,33 +1,100 @@
-import importlib
 from logging_config import logger
 
 logger.info("Beginning app.py")
 
-from SecretsManager import SecretsManager
-import config
-from fake_data_to_snowflake import main
+import contextlib
+import os
+import uuid
 
-# Initialize the SecretsManager object and set the environment variables
-secret_manager = SecretsManager(secret_name=config.secret_name, region=config.region)
-secret_manager.get_secret()  # sets variables
-# after the env vars are set, to re-import the config.
-importlib.reload(config)
-# todo: ^ make config a class that handles this.
+# The settings are read on first access. The secret is cached between warm invocations.
+import config
+from fake_data_to_snowflake import main, clean_up_stages, spec_tables
+from connection_manager import connection_manager
+from token_provider import token_provider
+from metrics import profiled, PROFILE_DIRECTORY
+from parquet_writer import ParquetSettings
+from orchestrator import fan_out, run_sub_job, LambdaDispatcher, DEFAULT_ROWS_PER_JOB
 
 
-def lambda_handler(event, context):
-    logger.info("Lambda handler started")
-    rows = event.get("rows", 2000)
-    main(
-        rows,
+def snowflake_args() -> dict:
+    """
+    The Snowflake connection arguments from the config, without the warehouse.
+    """
+    return dict(
         user=config.user,
         password=config.password,
         account=config.account,
-        warehouse=config.warehouse,
         database=config.database,
         schema=config.schema,
         role=config.role,
         rsa_key=config.rsa_key,
     )
+
+
+def lambda_handler(event, context):
+    logger.info("Lambda handler started")
+    # The Snowflake session is kept between warm invocations, only the counters are reset.
+    connection_manager.reset_stats()
+    rows = event.get("rows", 2000)
+    spec = event.get("spec", "fake_sales_orders")
+    # A scheduled run with {"sweep_stages": true} only removes old files from the stages.
+    if event.get("sweep_stages"):
+        clean_up_stages(spec_tables(spec), sweep=True, **snowflake_args())
+        connection_manager.log_stats()
+        return {"statusCode": 200, "body": f"Stages of {spec} swept"}
+    # A worker of a fan-out stages its rows, and registers them too when invoked asynchronously.
+    if event.get("sub_job"):
+        result = run_sub_job(event["sub_job"], **snowflake_args())
+        connection_manager.log_stats()
+        return result
+    # {"fan_out": {"rows_per_job": 1000000, "concurrency": 20}} splits the rows over workers.
+    if event.get("fan_out"):
+        summary = fan_out(
+            rows,
+            LambdaDispatcher(concurrency=event["fan_out"].get("concurrency", 10)),
+            rows_per_job=event["fan_out"].get("rows_per_job", DEFAULT_ROWS_PER_JOB),
+            seed=event.get("seed"),
+            spec=spec,
+            file_count=event.get("file_count"),
+            parquet=event.get("parquet"),
+            stage_cleanup=event.get("stage_cleanup", True),
+            warehouse=config.warehouse,
+            **snowflake_args(),
+        )
+        connection_manager.log_stats()
+        return {
+            "statusCode": 200,
+            "body": f"{summary['rows']} Records queued for Snowflake in {summary['jobs']} sub-jobs",
+        }
+    # {"profile": true} writes a cProfile dump of the invocation to PROFILE_DIRECTORY.
+    profiler = contextlib.nullcontext()
+    if event.get("profile"):
+        request_id = getattr(context, "aws_request_id", None) or uuid.uuid4().hex
+        profiler = profiled(os.path.join(PROFILE_DIRECTORY, f"{request_id}.pstats"))
+    # e.g. {"parquet": {"compression": "zstd", "compression_level": 3}}, see parquet_writer.py.
+    parquet_settings = None
+    if event.get("parquet"):
+        parquet_settings = ParquetSettings(**event["parquet"])
+    with profiler:
+        main(
+            rows,
+            seed=event.get("seed"),
+            workers=event.get("workers", 1),
+            chunk_size=event.get("chunk_size"),
+            file_count=event.get("file_count"),
+            confirm_load=event.get("confirm_load", False),
+            spec=spec,
+            parquet_settings=parquet_settings,
+            stage_cleanup=event.get("stage_cleanup", True),
+            # Lambda retries a failed async invocation with the same request id, the retry
+            # resumes the batch from its checkpoint, see batch_checkpoints.py.
+            batch_id=event.get("batch_id") or getattr(context, "aws_request_id", None),
+            # Read in the background, so a cold secret fetch overlaps with data generation.
+            get_connection_args=lambda: dict(
+                warehouse=config.warehouse, **snowflake_args()
+            ),
+        )
+    connection_manager.log_stats()
+    token_provider.log_stats()
     logger.info("Lambda handler finished")
     return {"statusCode": 200, "body": f"{rows} Records loaded to Snowflake"}
@@ -0,0 +1,170 @@
+import contextlib
+import os
+import re
+import time
+from typing import Iterator
+import numpy as np
+import pyarrow as pa
+from logging_config import logger
+from json_state import locked_update, read_json
+
+# Where the batch checkpoints and the data of failed batches are kept.
+CHECKPOINT_DIRECTORY = os.getenv("CHECKPOINT_DIRECTORY", "/tmp/batch_checkpoints")
+# Checkpoints are dropped after this long. Lambda retries an async invocation for up to 6 hours.
+CHECKPOINT_RETENTION_SECONDS = float(
+    os.getenv("CHECKPOINT_RETENTION_SECONDS", 6 * 3600)
+)
+
+# The steps of a table's batch, in order.
+GENERATED = "generated"
+STAGED = "staged"
+LOADED = "loaded"
+
+
+class BatchCheckpoints:
+    """
+    The progress of every batch, per table, so that a retry of the same batch id resumes
+    where the failed attempt stopped instead of starting over:
+
+    - the seed is recorded when the batch starts, so a regenerated batch has the same rows
+    - GENERATED: the load failed before the data was staged, the data was saved in an Arrow
+      file and the retry reads it instead of generating it
+    - STAGED: the files are in the table stage, the retry registers those not registered yet
+    - LOADED: the retry skips the table
+
+    A streamed table is checkpointed per chunk instead, under `<table>-<chunk number>`.
+
+    One JSON file per batch, and an Arrow IPC file per table of a failed batch, in
+    CHECKPOINT_DIRECTORY. Like the stage manifest, the checkpoints live in the container's
+    /tmp: a retry that lands in another container starts over, unless the directory is
+    on shared storage such as EFS.
+    """
+
+    def __init__(self, directory: str):
+        """
+        Args:
+            directory (str): The directory the checkpoints are written to. Created on first use.
+        """
+        self.directory = directory
+
+    def start(self, batch_id: str, seed: int | None = None) -> int:
+        """
+        Start the batch `batch_id`, or resume it if an earlier attempt started it.
+        Drops checkpoints older than CHECKPOINT_RETENTION_SECONDS.
+
+        Args:
+            batch_id (str): Identifies the batch across attempts, e.g. the Lambda request id.
+            seed (int, optional): The seed requested for the batch. Defaults to None (random).
+
+        Returns:
+            int: The seed to generate the batch with, the one of the first attempt on a retry.
+        """
+        self.prune()
+        with self._update(batch_id) as checkpoint:
+            if checkpoint:
+                logger.info(f"Resuming batch {batch_id}: {checkpoint['tables']}")
+                return checkpoint["seed"]
+            seed = np.random.SeedSequence().entropy if seed is None else seed
+            checkpoint.update(seed=seed, tables={})
+            return seed
+
+    def get(self, batch_id: str, table: str) -> dict:
+        """
+        Return the checkpoint of `table` in the batch: step, and the staged and registered files.
+        Empty if the table has no checkpoint yet.
+        """
+        checkpoint = self._read(batch_id) or {"tables": {}}
+        return checkpoint["tables"].get(table, {})
+
+    def save_data(self, batch_id: str, table: str, data: pa.Table) -> None:
+        """
+        Save the data of a table whose load failed before it was staged.
+        Nothing is saved for a batch that was not started, no retry could find it.
+        """
+        if not self._read(batch_id):
+            return
+        path = self._data_path(batch_id, table)
+        with (
+            pa.OSFile(path, "wb") as sink,
+            pa.ipc.new_file(sink, data.schema) as writer,
+        ):
+            writer.write_table(data)
+        self._update_table(batch_id, table, step=GENERATED)
+        logger.info(f"Saved {data.num_rows} rows of {table} for a retry of {batch_id}")
+
+    def load_data(self, batch_id: str, table: str) -> pa.Table | None:
+        """
+        Return the data saved by `save_data`, memory-mapped, or None if there is none.
+        """
+        path = self._data_path(batch_id, table)
+        if not os.path.exists(path):
+            return None
+        return pa.ipc.open_file(pa.memory_map(path)).read_all()
+
+    def mark_staged(self, batch_id: str, table: str, file_names: list[str]) -> None:
+        self._update_table(
+            batch_id, table, step=STAGED, files=file_names, registered=[]
+        )
+
+    def mark_registered(self, batch_id: str, table: str, file_names: list[str]) -> None:
+        """
+        Record that `file_names` were registered with the pipe.
+        """
+        with self._update(batch_id) as checkpoint:
+            if checkpoint:
+                entry = checkpoint["tables"].setdefault(table, {})
+                entry["registered"] = entry.get("registered", []) + file_names
+
+    def mark_loaded(self, batch_id: str, table: str) -> None:
+        """
+        Record that the table's batch is loaded, and drop its saved data.
+        """
+        self._update_table(batch_id, table, step=LOADED)
+        path = self._data_path(batch_id, table)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def prune(self, now: float | None = None) -> None:
+        """
+        Remove the checkpoints and saved data older than CHECKPOINT_RETENTION_SECONDS.
+        """
+        if not os.path.isdir(self.directory):
+            return
+        cutoff = (time.time() if now is None else now) - CHECKPOINT_RETENTION_SECONDS
+        for entry in os.scandir(self.directory):
+            if entry.stat().st_mtime < cutoff:
+                # Another process may have pruned it already.
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(entry.path)
+
+    @contextlib.contextmanager
+    def _update(self, batch_id: str) -> Iterator[dict]:
+        """
+        Read-modify-write of the checkpoint of `batch_id` under a file lock, see json_state.py.
+        Yields {} if the batch was not started.
+        """
+        with locked_update(
+            f"{self._path(batch_id)}.json", f"checkpoint of {batch_id}"
+        ) as checkpoint:
+            yield checkpoint
+            if checkpoint:
+                checkpoint["updated_at"] = time.time()
+
+    def _update_table(self, batch_id: str, table: str, **values) -> None:
+        with self._update(batch_id) as checkpoint:
+            # Not started, e.g. the caller does not resume batches: nothing is recorded.
+            if checkpoint:
+                checkpoint["tables"].setdefault(table, {}).update(values)
+
+    def _path(self, batch_id: str) -> str:
+        # Batch ids come from the event, keep them to characters that are safe in a file name.
+        return os.path.join(self.directory, re.sub(r"[^\w.-]", "_", batch_id))
+
+    def _data_path(self, batch_id: str, table: str) -> str:
+        return f"{self._path(batch_id)}.{table}.arrow"
+
+    def _read(self, batch_id: str) -> dict:
+        return read_json(f"{self._path(batch_id)}.json", f"checkpoint of {batch_id}")
+
+
+batch_checkpoints = BatchCheckpoints(CHECKPOINT_DIRECTORY)
@@ -0,0 +1,230 @@
+# Local benchmarks. These are not part of the Lambda image, run them directly:
+#   python benchmark.py generate --rows 1000 10000 100000
+#   python benchmark.py parquet --rows 1000000
+#   python benchmark.py import-time --budget_ms 1500
+
+import argparse
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from fake_data_to_snowflake import generate_arrow, generate_data, generate_data_per_row
+from parquet_writer import ParquetSettings, write_parquet
+
+# Cold start budget for `import app`, in milliseconds.
+IMPORT_TIME_BUDGET_MS = 1500
+# Parquet writer settings compared by `benchmark.py parquet`.
+PARQUET_SETTINGS = [
+    ParquetSettings("snappy", use_dictionary=True),
+    ParquetSettings("snappy"),
+    ParquetSettings("snappy", use_dictionary=False),
+    ParquetSettings("zstd", 1),
+    ParquetSettings("zstd", 3),
+    ParquetSettings("zstd", 9),
+    ParquetSettings("gzip", 6),
+    ParquetSettings("lz4"),
+    ParquetSettings("none"),
+    ParquetSettings("zstd", 3, row_group_size=100_000),
+]
+# Heavy modules that must only be imported once a code path needs them.
+DEFERRED_IMPORTS = [
+    "pandas",
+    "boto3",
+    "snowflake.connector",
+    "snowflake.connector.pandas_tools",
+    "jwt",
+    "cryptography",
+    "requests",
+]
+
+
+def time_call(func, *args, **kwargs) -> tuple[float, object]:
+    """
+    Run `func` once and return the elapsed wall clock seconds and its result.
+    """
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def benchmark_generate(row_counts: list[int], per_row_limit: int) -> None:
+    """
+    Compare the throughput of the vectorized and the per-row implementation of generate_data.
+
+    Args:
+        row_counts (list[int]): The row counts to benchmark.
+        per_row_limit (int): The per-row implementation is skipped above this row count because it is too slow.
+    """
+    print(f"{'rows':>10} | {'implementation':>14} | {'seconds':>8} | {'rows/sec':>10}")
+    for rows in row_counts:
+        implementations = [("vectorized", generate_data)]
+        if rows <= per_row_limit:
+            implementations.append(("per-row", generate_data_per_row))
+        for label, func in implementations:
+            seconds, df = time_call(func, rows)
+            print(
+                f"{len(df):>10} | {label:>14} | {seconds:>8.3f} | {len(df) / seconds:>10.0f}"
+            )
+
+
+def serialize_via_tempfile(df) -> int:
+    """
+    The former staging path: write the parquet file to /tmp, read it back for the PUT, delete it.
+    """
+    with tempfile.NamedTemporaryFile(suffix=".parquet", delete=False) as temp_parquet:
+        df.to_parquet(temp_parquet.name, index=False)
+        temp_parquet_path = temp_parquet.name
+    with open(temp_parquet_path, "rb") as file:
+        size = len(file.read())
+    os.remove(temp_parquet_path)
+    return size
+
+
+def serialize_in_memory(df) -> int:
+    """
+    The current staging path: write the parquet file to a buffer that is streamed to the PUT.
+    """
+    buffer = io.BytesIO()
+    df.to_parquet(buffer, index=False)
+    return buffer.getbuffer().nbytes
+
+
+def benchmark_stage(row_counts: list[int]) -> None:
+    """
+    Compare building the staged parquet file through a temporary file and in memory.
+    The PUT itself is not included, both paths hand the same bytes to the connector.
+    """
+    print(f"{'rows':>10} | {'path':>10} | {'seconds':>8} | {'MB':>8}")
+    for rows in row_counts:
+        df = generate_data(rows)
+        for label, func in [
+            ("tempfile", serialize_via_tempfile),
+            ("in-memory", serialize_in_memory),
+        ]:
+            seconds, size = time_call(func, df)
+            print(f"{len(df):>10} | {label:>10} | {seconds:>8.3f} | {size / 1e6:>8.1f}")
+
+
+def benchmark_parquet(row_counts: list[int], spec: str) -> None:
+    """
+    Compare the parquet writer settings in PARQUET_SETTINGS: file size, wall clock and CPU time
+    of writing the Arrow table the loader stages. The pandas `to_parquet` of the same rows is
+    included as the former baseline.
+    """
+    print(
+        f"{'rows':>10} | {'writer':>50} | {'MB':>7} | {'seconds':>8} | {'CPU seconds':>11}"
+    )
+    for rows in row_counts:
+        table = generate_arrow(rows, spec=spec)
+        df = generate_data(rows, spec=spec)
+        writers = [("pandas to_parquet", lambda sink: df.to_parquet(sink, index=False))]
+        writers += [
+            (repr(settings), lambda sink, s=settings: write_parquet(table, sink, s))
+            for settings in PARQUET_SETTINGS
+        ]
+        for label, write in writers:
+            buffer = io.BytesIO()
+            cpu_start = time.process_time()
+            seconds, _ = time_call(write, buffer)
+            cpu_seconds = time.process_time() - cpu_start
+            size = buffer.getbuffer().nbytes
+            print(
+                f"{table.num_rows:>10} | {label:>50} | {size / 1e6:>7.2f} | {seconds:>8.3f} | {cpu_seconds:>11.3f}"
+            )
+
+
+def check_import_time(module: str, budget_ms: float) -> bool:
+    """
+    Import `module` in a fresh interpreter with `python -X importtime` and check that
+    the import stays within `budget_ms` and does not pull in any of DEFERRED_IMPORTS.
+
+    Returns:
+        bool: True if the check passed.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    if result.returncode != 0:
+        print(result.stderr)
+        return False
+
+    # Lines look like "import time:  self [us] | cumulative | imported package".
+    cumulative_us = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        cumulative_us[name.strip()] = int(cumulative)
+
+    total_ms = cumulative_us.get(module, 0) / 1000
+    print(f"import {module}: {total_ms:.0f} ms (budget {budget_ms:.0f} ms)")
+    slowest = sorted(cumulative_us.items(), key=lambda item: -item[1])[1:11]
+    for name, microseconds in slowest:
+        print(f"  {microseconds / 1000:>8.0f} ms  {name}")
+
+    passed = total_ms <= budget_ms
+    eager = [name for name in DEFERRED_IMPORTS if name in cumulative_us]
+    if eager:
+        print(f"Imported at startup but should be deferred: {', '.join(eager)}")
+        passed = False
+    return passed
+
+
+def main():
+    cli_parser = argparse.ArgumentParser()
+    subparsers = cli_parser.add_subparsers(dest="command", required=True)
+
+    generate_parser = subparsers.add_parser(
+        "generate", help="Throughput of generate_data, vectorized vs per-row."
+    )
+    generate_parser.add_argument(
+        "--rows", type=int, nargs="+", default=[1_000, 10_000, 100_000]
+    )
+    generate_parser.add_argument(
+        "--per_row_limit",
+        type=int,
+        default=100_000,
+        help="Skip the per-row implementation above this row count.",
+    )
+
+    stage_parser = subparsers.add_parser(
+        "stage", help="Parquet staging through a temporary file vs in memory."
+    )
+    stage_parser.add_argument(
+        "--rows", type=int, nargs="+", default=[100_000, 1_000_000]
+    )
+
+    parquet_parser = subparsers.add_parser(
+        "parquet", help="File size and CPU time of the parquet writer settings."
+    )
+    parquet_parser.add_argument("--rows", type=int, nargs="+", default=[1_000_000])
+    parquet_parser.add_argument("--spec", default="fake_sales_orders")
+
+    import_time_parser = subparsers.add_parser(
+        "import-time",
+        help="Fail if the cold start import exceeds the budget or loads deferred modules.",
+    )
+    import_time_parser.add_argument("--module", default="app")
+    import_time_parser.add_argument(
+        "--budget_ms", type=float, default=IMPORT_TIME_BUDGET_MS
+    )
+
+    args = cli_parser.parse_args()
+    if args.command == "generate":
+        benchmark_generate(args.rows, args.per_row_limit)
+    elif args.command == "stage":
+        benchmark_stage(args.rows)
+    elif args.command == "parquet":
+        benchmark_parquet(args.rows, args.spec)
+    elif args.command == "import-time":
+        if not check_import_time(args.module, args.budget_ms):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+from datetime import datetime
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+from faker import Faker
+
+# Only the providers used by the table specs are loaded, the full set is much slower to set up.
+FAKER_PROVIDERS = [
+    "faker.providers.person",
+    "faker.providers.internet",
+    "faker.providers.address",
+    "faker.providers.company",
+    "faker.providers.python",
+    "faker.providers.date_time",
+]
+# One Faker instance per process, shared by every batch instead of a new Faker() per call.
+# Seed it with `shared_faker.seed_instance` for reproducible output.
+shared_faker = Faker(providers=FAKER_PROVIDERS)
+
+# Distinct values generated per batch for a faker column when the value pools are disabled
+# (FAKER_POOL_SIZE=0). Rows sample from them instead of calling Faker once per row.
+DEFAULT_POOL_SIZE = 1000
+
+# Lookup table used to hex encode random bytes without a per-row Python loop.
+_HEX_DIGITS = np.frombuffer(b"0123456789abcdef", dtype=np.uint8)
+# Positions of the dashes in the canonical 8-4-4-4-12 UUID string.
+_UUID_DASH_POSITIONS = (8, 13, 18, 23)
+
+
+def random_uuid4_strings(number_of_rows: int, rng: np.random.Generator) -> np.ndarray:
+    """
+    Generate version 4 UUID strings in bulk.
+
+    The random bytes are drawn in a single call, the version and variant bits are set
+    on the whole byte matrix and the hex encoding is done with a lookup table,
+    so the cost per row is a few numpy operations instead of a `uuid.uuid4()` call.
+
+    Args:
+        number_of_rows (int): The number of UUIDs to generate.
+        rng (numpy.random.Generator): The random generator to draw bytes from.
+
+    Returns:
+        numpy.ndarray: A unicode array of canonical, lowercase UUID strings.
+    """
+    raw = np.frombuffer(rng.bytes(16 * number_of_rows), dtype=np.uint8)
+    raw = raw.reshape(number_of_rows, 16).copy()
+    # RFC 4122: version 4 in the high nibble of byte 6, variant 10xx in byte 8.
+    raw[:, 6] = (raw[:, 6] & 0x0F) | 0x40
+    raw[:, 8] = (raw[:, 8] & 0x3F) | 0x80
+
+    hex_chars = np.empty((number_of_rows, 32), dtype=np.uint8)
+    hex_chars[:, 0::2] = _HEX_DIGITS[raw >> 4]
+    hex_chars[:, 1::2] = _HEX_DIGITS[raw & 0x0F]
+
+    uuid_chars = np.full((number_of_rows, 36), ord("-"), dtype=np.uint8)
+    source = 0
+    target = 0
+    for dash in _UUID_DASH_POSITIONS + (36,):
+        width = dash - target
+        uuid_chars[:, target:dash] = hex_chars[:, source : source + width]
+        source += width
+        target = dash + 1
+
+    return uuid_chars.view("S36").ravel().astype(str)
+
+
+def random_timestamps_before(
+    now: datetime,
+    number_of_rows: int,
+    rng: np.random.Generator,
+    max_minutes: int = 120,
+) -> np.ndarray:
+    """
+    Generate timestamps between `max_minutes` minutes before `now` and `now`,
+    at whole-minute offsets.
+    """
+    offsets = rng.integers(0, max_minutes + 1, size=number_of_rows)
+    return np.datetime64(now, "ns") - offsets.astype("timedelta64[m]")
+
+
+# Crockford's base32 alphabet, used by ULIDs: no I, L, O or U.
+_CROCKFORD_DIGITS = np.frombuffer(b"0123456789ABCDEFGHJKMNPQRSTVWXYZ", dtype=np.uint8)
+
+
+def random_ulid_strings(
+    number_of_rows: int, rng: np.random.Generator, now: datetime
+) -> np.ndarray:
+    """
+    Generate ULIDs in bulk: a 48-bit millisecond timestamp followed by 80 random bits,
+    as 26 Crockford base32 characters. ULIDs sort by time, so rows loaded together are
+    stored close together, and they are 10 characters shorter than UUID strings.
+
+    Args:
+        number_of_rows (int): The number of ULIDs to generate.
+        rng (numpy.random.Generator): The random generator to draw the random bits from.
+        now (datetime): The timestamp of the ULIDs.
+
+    Returns:
+        numpy.ndarray: A unicode array of ULID strings.
+    """
+    timestamp = np.uint64(int(now.timestamp() * 1000) & (2**48 - 1))
+    random_bits = rng.integers(0, 2**64, size=(2, number_of_rows), dtype=np.uint64)
+    # The 128 bits as two words: timestamp and 16 random bits, then 64 random bits.
+    high = (timestamp << np.uint64(16)) | (random_bits[0] >> np.uint64(48))
+    low = random_bits[1]
+
+    chars = np.empty((number_of_rows, 26), dtype=np.uint8)
+    for position in range(26):
+        # The lowest bit of the 5 bits of this character, counted from the end of the 130 bits.
+        shift = 125 - 5 * position
+        if shift >= 64:
+            digits = high >> np.uint64(shift - 64)
+        elif shift <= 59:
+            digits = low >> np.uint64(shift)
+        else:
+            digits = (high << np.uint64(64 - shift)) | (low >> np.uint64(shift))
+        chars[:, position] = _CROCKFORD_DIGITS[digits & np.uint64(31)]
+    return chars.view("S26").ravel().astype(str)
+
+
+def with_random_tags(values: pa.Array, rng: np.random.Generator) -> pa.Array:
+    """
+    Make string values distinct by adding a random 8 character tag: before the @ of an
+    e-mail address, as in "jane.doe+K3F9QZ2M@example.org", otherwise at the end after a dash.
+    """
+    number_of_rows = len(values)
+    # The tags are built as one Arrow buffer, without a Python string per row.
+    tag_bytes = _CROCKFORD_DIGITS[rng.integers(0, 32, size=(number_of_rows, 8))]
+    tags = pa.Array.from_buffers(
+        pa.string(),
+        number_of_rows,
+        [
+            None,
+            pa.py_buffer(np.arange(0, 8 * number_of_rows + 1, 8, dtype=np.int32)),
+            pa.py_buffer(tag_bytes),
+        ],
+    )
+    # Split at the last @: [local part, domain], or [value] without an @.
+    parts = pc.split_pattern(values, "@", max_splits=1, reverse=True)
+    first_part = parts.offsets.to_numpy()[:-1]
+    has_domain = pc.list_value_length(parts).to_numpy(zero_copy_only=False) == 2
+    local = parts.values.take(first_part)
+    domain = parts.values.take(pa.array(first_part + 1, mask=~has_domain))
+    separator = pa.array(np.where(has_domain, "+", "-"))
+    tagged = pc.binary_join_element_wise(local, tags, separator)
+    return pc.binary_join_element_wise(tagged, domain, "@", null_handling="skip")
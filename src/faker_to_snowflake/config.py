@@ -5,11 +5,67 @@ dotenv.load_dotenv()
 
 secret_name = os.getenv("SECRET_NAME")
 region = os.getenv("REGION")
-user = os.getenv("SNOWFLAKE_USER")
-password = os.getenv("SNOWFLAKE_PASSWORD")
-account = os.getenv("SNOWFLAKE_ACCOUNT")
-warehouse = os.getenv("SNOWFLAKE_WAREHOUSE")
-database = os.getenv("SNOWFLAKE_DATABASE")
-schema = os.getenv("SNOWFLAKE_SCHEMA")
-role = os.getenv("SNOWFLAKE_ROLE")
-rsa_key = os.getenv("rsa_key")
+# How long secret values are cached before they are fetched again.
+secret_cache_ttl_seconds = float(os.getenv("SECRET_CACHE_TTL_SECONDS", 900))
+# Set SECRET_CACHE_KEY to a Fernet key to also cache the secret, encrypted, in /tmp.
+secret_cache_key = os.getenv("SECRET_CACHE_KEY")
+secret_cache_path = os.getenv("SECRET_CACHE_PATH", "/tmp/snowflake_secret.cache")
+
+
+class Config:
+    """
+    Snowflake settings, read on access.
+    Values come from the AWS secret when SECRET_NAME is set, falling back to environment variables.
+    The secret is fetched on first access and cached, see SecretsManager.SecretCache.
+    """
+
+    SETTINGS = {
+        "user": "SNOWFLAKE_USER",
+        "password": "SNOWFLAKE_PASSWORD",
+        "account": "SNOWFLAKE_ACCOUNT",
+        "warehouse": "SNOWFLAKE_WAREHOUSE",
+        "database": "SNOWFLAKE_DATABASE",
+        "schema": "SNOWFLAKE_SCHEMA",
+        "role": "SNOWFLAKE_ROLE",
+        "rsa_key": "rsa_key",
+    }
+
+    def __init__(self):
+        self._secret_cache = None
+        # Refresh the secret in a background thread, for long-running processes only, see SecretCache.
+        self.background_refresh = False
+
+    @property
+    def secret_cache(self):
+        if self._secret_cache is None and secret_name:
+            from SecretsManager import SecretCache
+
+            self._secret_cache = SecretCache(
+                secret_name=secret_name,
+                region=region,
+                ttl_seconds=secret_cache_ttl_seconds,
+                file_cache_path=secret_cache_path,
+                file_cache_key=secret_cache_key,
+                background_refresh=self.background_refresh,
+            )
+        return self._secret_cache
+
+    def __getattr__(self, name: str):
+        if name not in self.SETTINGS:
+            raise AttributeError(name)
+        key = self.SETTINGS[name]
+        if self.secret_cache is not None:
+            secret = self.secret_cache.get()
+            if key in secret:
+                return secret[key]
+        return os.getenv(key)
+
+
+config = Config()
+
+
+def __getattr__(name: str):
+    # Keeps `config.user` etc. working at module level, without reading anything at import time.
+    if name in Config.SETTINGS:
+        return getattr(config, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
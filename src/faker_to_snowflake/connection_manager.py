@@ -0,0 +1,121 @@
+import os
+import threading
+import time
+from typing import TYPE_CHECKING
+from logging_config import logger
+from metrics import metrics
+
+if TYPE_CHECKING:
+    from snowflake.connector import SnowflakeConnection
+
+# A session that was used within this many seconds is reused without a health check.
+HEALTH_CHECK_INTERVAL_SECONDS = 60
+
+
+class SnowflakeConnectionManager:
+    """
+    Keeps one authenticated Snowflake session per process.
+    The module level `connection_manager` lives as long as the Lambda container,
+    so warm invocations reuse the session instead of logging in again.
+    """
+
+    def __init__(self):
+        self._connection = None
+        self._connect_args = None
+        self._last_used = 0.0
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self) -> None:
+        """
+        Reset the connect / reuse counters, called at the start of every invocation.
+        """
+        self.connect_count = 0
+        self.connect_seconds = 0.0
+        self.reuse_count = 0
+
+    def log_stats(self) -> None:
+        logger.info(
+            f"Snowflake connections: {self.connect_count} new "
+            f"({self.connect_seconds:.2f}s spent connecting), {self.reuse_count} reused"
+        )
+
+    def get_connection(self, **connect_args) -> "SnowflakeConnection":
+        """
+        Return the cached connection if it was opened with the same arguments and is healthy,
+        otherwise open a new one.
+
+        Args:
+            **connect_args: Passed to snowflake.connector.connect.
+
+        Returns:
+            SnowflakeConnection: An open connection. Do not close it, it is shared.
+        """
+        with self._lock:
+            if (
+                self._connection is not None
+                and self._connect_args == connect_args
+                and self._is_healthy()
+            ):
+                self.reuse_count += 1
+                self._last_used = time.monotonic()
+                return self._connection
+
+            # Imported here rather than at module level to keep it off the cold start.
+            import snowflake.connector
+
+            self._close()
+            logger.info("Opening a new Snowflake connection")
+            start = time.perf_counter()
+            with metrics.span("connect"):
+                self._connection = snowflake.connector.connect(**connect_args)
+            self.connect_seconds += time.perf_counter() - start
+            self.connect_count += 1
+            self._connect_args = connect_args
+            self._last_used = time.monotonic()
+            return self._connection
+
+    def _is_healthy(self) -> bool:
+        """
+        Check that the cached session can still run queries.
+        A session that was used recently is assumed healthy, an idle one (e.g. after the
+        Lambda container was frozen) is checked with a query that needs no warehouse.
+        """
+        import snowflake.connector
+
+        if self._connection.is_closed():
+            return False
+        if time.monotonic() - self._last_used < HEALTH_CHECK_INTERVAL_SECONDS:
+            return True
+        try:
+            with self._connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            return True
+        except snowflake.connector.errors.Error as e:
+            logger.info(f"Cached Snowflake session is no longer usable: {e}")
+            return False
+
+    def _close(self) -> None:
+        if self._connection is not None:
+            import snowflake.connector
+
+            try:
+                self._connection.close()
+            except snowflake.connector.errors.Error as e:
+                logger.info(f"Error closing the Snowflake connection: {e}")
+        self._connection = None
+        self._connect_args = None
+
+    def close(self) -> None:
+        with self._lock:
+            self._close()
+
+    def _forget_after_fork(self) -> None:
+        # A forked worker must neither use nor close the parent's session, it opens its own.
+        self._connection = None
+        self._connect_args = None
+        self._lock = threading.Lock()
+
+
+connection_manager = SnowflakeConnectionManager()
+os.register_at_fork(after_in_child=connection_manager._forget_after_fork)
@@ -1,16 +1,164 @@
+import itertools
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from faker import Faker
-import pandas as pd
+import numpy as np
+import pyarrow as pa
 import uuid
 import random
 from datetime import datetime, timedelta
+from typing import Callable, Iterator, TYPE_CHECKING
 from logging_config import logger
-from snowflake_loader import SnowflakeDataLoader
+from metrics import metrics
+from parallel_generator import generate_table, iter_tables
+from parquet_writer import ParquetSettings, as_arrow, to_pandas
+from table_spec import get_plan, DEFAULT_SPEC
+from relational import get_dataset_plan, is_dataset
+from snowflake_loader import SnowflakeDataLoader, SNOWPIPE, WRITE_PANDAS
+from stage_manifest import STAGE_RETENTION_SECONDS
+from batch_checkpoints import batch_checkpoints, GENERATED, STAGED, LOADED
+from unique_keys import unique_keys
 
+if TYPE_CHECKING:
+    import pandas as pd
 
-def generate_data(number_of_rows: int) -> pd.DataFrame:
+
+def generate_arrow(
+    number_of_rows: int,
+    seed: int | None = None,
+    workers: int = 1,
+    spec: str = DEFAULT_SPEC,
+) -> pa.Table:
+    """
+    Generate fake data for testing purposes, as an Arrow table.
+    The columns are described by a table spec, see table_spec.py.
+    Low-cardinality columns are dictionary arrays.
+
+    Args:
+        number_of_rows (int): The number of rows of fake data to generate.
+        seed (int, optional): Makes the output reproducible. Defaults to None (random).
+        workers (int, optional): The number of processes to generate the data with. Defaults to 1.
+        spec (str, optional): The name of the table spec to generate. Defaults to "fake_sales_orders".
+
+    Returns:
+        pyarrow.Table: The generated fake data.
+    """
+    # randmize the number of rows
+    number_of_rows += random.Random(seed).randint(-100, 100)
+    number_of_rows = max(number_of_rows, 0)
+    logger.info(f"Generating {number_of_rows} rows of fake data")
+    with metrics.span("generate"):
+        table = generate_table(number_of_rows, seed=seed, workers=workers, spec=spec)
+    metrics.add("rows", table.num_rows)
+    logger.info(f"Generated {number_of_rows} rows of fake data")
+    return table
+
+
+def generate_dataset(
+    number_of_rows: int, seed: int | None = None, spec: str = "fake_sales"
+) -> dict[str, pa.Table]:
+    """
+    Generate one batch of a dataset spec: several tables whose foreign keys join
+    correctly, see relational.py.
+
+    Args:
+        number_of_rows (int): The batch size, each table gets its share of it.
+        seed (int, optional): Makes the output reproducible. Defaults to None (random).
+        spec (str, optional): The name of the dataset spec to generate. Defaults to "fake_sales".
+
+    Returns:
+        dict: Table name to pyarrow.Table, parents before the tables referencing them.
+    """
+    # randmize the number of rows
+    number_of_rows += random.Random(seed).randint(-100, 100)
+    number_of_rows = max(number_of_rows, 0)
+    with metrics.span("generate"):
+        tables = get_dataset_plan(spec).generate(
+            number_of_rows, rng=np.random.default_rng(seed)
+        )
+    metrics.add("rows", sum(table.num_rows for table in tables.values()))
+    return tables
+
+
+def generate_data(
+    number_of_rows: int,
+    seed: int | None = None,
+    workers: int = 1,
+    spec: str = DEFAULT_SPEC,
+) -> "pd.DataFrame":
+    """
+    Generate fake data for testing purposes, as a pandas DataFrame.
+    Takes the same arguments as `generate_arrow`.
+
+    Returns:
+        pandas.DataFrame: A DataFrame containing the generated fake data.
+    """
+    table = generate_arrow(number_of_rows, seed=seed, workers=workers, spec=spec)
+    with metrics.span("to_pandas"):
+        return to_pandas(table)
+
+
+def generate_arrow_chunks(
+    number_of_rows: int,
+    chunk_size: int,
+    seed: int | None = None,
+    spec: str = DEFAULT_SPEC,
+) -> Iterator[pa.Table]:
+    """
+    Generate fake data lazily, in Arrow tables of at most `chunk_size` rows.
+    Only one chunk is held in memory at a time, as long as the caller drops its
+    reference to a chunk before asking for the next one.
+
+    Args:
+        number_of_rows (int): The number of rows of fake data to generate.
+        chunk_size (int): The maximum number of rows per chunk.
+        seed (int, optional): Makes the output reproducible. Defaults to None (random).
+        spec (str, optional): The name of the table spec to generate. Defaults to "fake_sales_orders".
+
+    Yields:
+        pyarrow.Table: The next chunk of fake data.
+    """
+    # randmize the number of rows
+    number_of_rows += random.Random(seed).randint(-100, 100)
+    number_of_rows = max(number_of_rows, 0)
+    logger.info(
+        f"Generating {number_of_rows} rows of fake data in chunks of {chunk_size}"
+    )
+    tables = iter_tables(number_of_rows, chunk_size, seed=seed, spec=spec)
+    while True:
+        # Only the generation is timed, not the time the caller spends loading the chunk.
+        with metrics.span("generate"):
+            table = next(tables, None)
+        if table is None:
+            break
+        metrics.add("rows", table.num_rows)
+        yield table
+        del table
+    logger.info(f"Generated {number_of_rows} rows of fake data")
+
+
+def generate_data_chunks(
+    number_of_rows: int,
+    chunk_size: int,
+    seed: int | None = None,
+    spec: str = DEFAULT_SPEC,
+) -> "Iterator[pd.DataFrame]":
+    """
+    Like `generate_arrow_chunks`, but yields pandas DataFrames.
     """
-    Generate fake data for testing purposes.
+    for table in generate_arrow_chunks(number_of_rows, chunk_size, seed, spec):
+        with metrics.span("to_pandas"):
+            df = to_pandas(table)
+        del table
+        yield df
+        del df
+
+
+def generate_data_per_row(number_of_rows: int) -> "pd.DataFrame":
+    """
+    Generate fake data for testing purposes, one Faker call per row per column.
+    This is the original implementation, kept as a reference for benchmarks.
 
     Args:
         number_of_rows (int): The number of rows of fake data to generate.
@@ -35,13 +183,15 @@ def generate_data(number_of_rows: int) -> pd.DataFrame:
         "sales_order_id": [str(uuid.uuid4()) for _ in range(number_of_rows)],
     }
 
+    import pandas as pd
+
     df = pd.DataFrame(data)
     logger.info(f"Generated {number_of_rows} rows of fake data")
     return df
 
 
 def data_to_snowflake(
-    df: pd.DataFrame,
+    df: "pa.Table | pd.DataFrame",
     database: str,
     schema: str,
     user: str,
@@ -51,12 +201,17 @@ def data_to_snowflake(
     warehouse: str,
     rsa_key: str,
     table: str = "fake_sales_orders",
+    pipe: str | None = None,
+    file_count: int | None = None,
+    confirm_load: bool = False,
+    parquet_settings: ParquetSettings | None = None,
+    batch_id: str | None = None,
 ) -> None:
     """
-    Load data from a pandas DataFrame to Snowflake using SnowpipeLoader or SnowflakeDfLoader.
+    Load data from an Arrow table or pandas DataFrame to Snowflake using SnowpipeLoader or SnowflakeDfLoader.
 
     Args:
-        df (pd.DataFrame): The pandas DataFrame containing the data to be loaded.
+        df (pa.Table | pd.DataFrame): The data to be loaded. A DataFrame is only built from a table if write_pandas is used.
         database (str, optional): The name of the Snowflake database. Defaults to the value of the `database` variable.
         schema (str, optional): The name of the Snowflake schema. Defaults to the value of the `schema` variable.
         user (str, optional): The Snowflake user name. Defaults to the value of the `user` variable.
@@ -65,20 +220,36 @@ def data_to_snowflake(
         role (str, optional): The Snowflake role name. Defaults to the value of the `role` variable.
         warehouse (str, optional): The Snowflake warehouse name. Defaults to the value of the `warehouse` variable.
         table (str, optional): The name of the Snowflake table to load the data into. Defaults to "fake_sales_orders".
+        pipe (str, optional): The name of the pipe that loads the table. Defaults to "pipe_<table>".
+        file_count (int, optional): The number of files the data is split into for Snowpipe.
+            Defaults to None: as many as needed to stage files of about TARGET_FILE_MB, see file_sizing.py.
+        confirm_load (bool, optional): Wait for Snowpipe to report the files as loaded and remove them
+            from the stage right away, instead of in the next cleanup. Defaults to False.
+        parquet_settings (ParquetSettings, optional): Codec, row groups and dictionary encoding of the staged files.
+        batch_id (str, optional): Checkpoints the load's progress under this id, see batch_checkpoints.py.
+            Defaults to None, a new id. `df` may be None if the checkpoint says the files are staged.
 
     Returns:
         None
 
     Raises:
-        Exception: If an error occurs during the data loading process.
+        Exception: If write_pandas fails too. The data is saved for a retry of the batch first,
+            unless its files are staged already.
 
     Notes:
-        This function first tries to load the data using the SnowpipeLoader, which does not require a warehouse.
-        If the SnowpipeLoader fails, it falls back to using the SnowflakeDfLoader, which uses a warehouse.
-        The function does not check if the table exists because the purpose is to avoid using a warehouse.
-        TODO: Instead of the current try-except block, use the "show tables" command to check if the table exists.
+        The strategy is chosen up front from cached metadata (SHOW TABLES / SHOW PIPES, no warehouse needed):
+        Snowpipe, which does not require a warehouse, when the table and pipe exist,
+        otherwise write_pandas, which uses a warehouse and creates the table. After write_pandas
+        the pipe is created, so the next runs take the Snowpipe path.
+        If Snowpipe fails anyway, the metadata is dropped and the data is loaded with write_pandas.
+        A batch id that is loaded already is skipped, one whose files are staged is registered.
 
     """
+    batch_id = batch_id or uuid.uuid4().hex
+    step = batch_checkpoints.get(batch_id, table).get("step")
+    if step == LOADED:
+        logger.info(f"Batch {batch_id} of {table} is loaded already, skipping it")
+        return
     loader = SnowflakeDataLoader(
         df,
         database=database,
@@ -88,41 +259,424 @@ def data_to_snowflake(
         account=account,
         role=role,
         table=table,
+        pipe=pipe,
         rsa_key=rsa_key,
+        file_count=file_count,
+        parquet_settings=parquet_settings,
     )
+    if step == STAGED or choose_load_strategy(loader) == SNOWPIPE:
+        try:
+            loader.load_using_snowpipe(confirm_load=confirm_load, batch_id=batch_id)
+            return
+        except Exception as e:
+            logger.error(f"Error: {e}")
+            loader.forget_load_metadata()
+            if df is None:
+                # Resumed from the staged files, there is no data to fall back with.
+                raise
+            metrics.add("write_pandas_fallbacks", 1)
     try:
-        loader.load_using_snowpipe()
+        loader.load_using_write_pandas(warehouse=warehouse)
     except Exception as e:
         logger.error(f"Error: {e}")
+        # Once staged, a retry registers the staged files, the data is not needed anymore.
+        # Data resumed from a checkpoint (GENERATED) is saved already.
+        if batch_checkpoints.get(batch_id, table).get("step") is None:
+            batch_checkpoints.save_data(batch_id, table, as_arrow(df))
+        raise
+    batch_checkpoints.mark_loaded(batch_id, table)
+    try:
+        loader.ensure_pipe()
+    except Exception as e:
+        logger.error(f"Error: {e}")
+
+
+def choose_load_strategy(loader: SnowflakeDataLoader) -> str:
+    """
+    Return the loader's strategy. If the metadata cannot be read, try Snowpipe first,
+    its failure falls back to write_pandas.
+    """
+    try:
+        return loader.choose_load_strategy()
+    except Exception as e:
+        logger.error(f"Could not check the table and pipe. Error: {e}")
+        return SNOWPIPE
+
+
+def data_chunks_to_snowflake(
+    chunks: "Iterator[pa.Table | pd.DataFrame]",
+    database: str,
+    schema: str,
+    user: str,
+    password: str,
+    account: str,
+    role: str,
+    warehouse: str,
+    rsa_key: str,
+    table: str = "fake_sales_orders",
+    pipe: str | None = None,
+    parquet_settings: ParquetSettings | None = None,
+    batch_id: str | None = None,
+) -> None:
+    """
+    Streaming version of `data_to_snowflake`: each chunk is staged as its own file and
+    registered with Snowpipe before the next chunk is generated.
+
+    Args:
+        chunks (Iterator[pa.Table | pd.DataFrame]): The chunks to load, usually from `generate_arrow_chunks`.
+        batch_id (str, optional): The chunks are recorded in the stage manifest as `<batch_id>-<chunk number>`.
+            Defaults to None, a new id.
+        The other arguments are the same as for `data_to_snowflake`.
+
+    Raises:
+        Exception: If a chunk could be loaded neither with Snowpipe nor with write_pandas, see `load_chunk`.
+
+    Notes:
+        If the table does not exist yet, the first chunk is loaded with write_pandas, which creates it,
+        and the pipe is created for the remaining chunks. Only if the pipe cannot be created are all
+        chunks loaded with write_pandas.
+    """
+    batch_id = batch_id or uuid.uuid4().hex
+    # Chunks are numbered the same in every attempt, whichever way the first one is loaded.
+    chunks = enumerate(chunks, start=1)
+    loader = SnowflakeDataLoader(
+        None,
+        database=database,
+        schema=schema,
+        user=user,
+        password=password,
+        account=account,
+        role=role,
+        table=table,
+        pipe=pipe,
+        rsa_key=rsa_key,
+        parquet_settings=parquet_settings,
+    )
+    snowpipe = True
+    if choose_load_strategy(loader) == WRITE_PANDAS:
+        for chunk_number, chunk in itertools.islice(chunks, 1):
+            load_chunk(loader, chunk, chunk_number, batch_id, warehouse, snowpipe=False)
+            del chunk
+        snowpipe = loader.ensure_pipe()
+    for chunk_number, chunk in chunks:
+        load_chunk(loader, chunk, chunk_number, batch_id, warehouse, snowpipe=snowpipe)
+        del chunk
+
+
+def load_chunk(
+    loader: SnowflakeDataLoader,
+    chunk: "pa.Table | pd.DataFrame",
+    chunk_number: int,
+    batch_id: str,
+    warehouse: str,
+    snowpipe: bool = True,
+) -> None:
+    """
+    Load one chunk of a stream with Snowpipe, retrying with back-off, see
+    SnowflakeDataLoader.load_chunk_using_snowpipe. If Snowpipe still fails, only this chunk
+    is loaded with write_pandas: the next chunk tries Snowpipe again, so a stream does not
+    end up running a warehouse for good after one failure.
+
+    If the batch was started, see batch_checkpoints.py, the chunk's progress is checkpointed
+    under `<table>-<chunk number>`: a retry of the batch skips the chunks that were loaded
+    and registers the files of those that were staged, instead of loading them twice.
+
+    Args:
+        chunk_number (int): The chunk's number in the stream, from 1.
+        batch_id (str): The batch of the stream. The chunk's files are recorded in the stage
+            manifest as `<batch_id>-<chunk number>`.
+        snowpipe (bool, optional): False to load the chunk with write_pandas right away. Defaults to True.
+
+    Raises:
+        Exception: If write_pandas fails too. The chunk is counted in `failed_chunks`, and
+            the stream stops instead of dropping data.
+    """
+    checkpoint = (batch_id, f"{loader.table}-{chunk_number}")
+    if batch_checkpoints.get(*checkpoint).get("step") == LOADED:
+        logger.info(
+            f"Chunk {chunk_number} of batch {batch_id} is loaded already, skipping it"
+        )
+        return
+    if snowpipe:
         try:
-            loader.load_using_write_pandas(warehouse=warehouse)
+            loader.load_chunk_using_snowpipe(
+                chunk, f"{batch_id}-{chunk_number}", checkpoint=checkpoint
+            )
+            batch_checkpoints.mark_loaded(*checkpoint)
+            return
         except Exception as e:
             logger.error(f"Error: {e}")
+            loader.forget_load_metadata()
+            metrics.add("write_pandas_fallbacks", 1)
+    try:
+        loader.load_using_write_pandas(warehouse=warehouse, df=chunk)
+    except Exception:
+        metrics.add("failed_chunks", 1)
+        raise
+    batch_checkpoints.mark_loaded(*checkpoint)
 
 
-def main(
-    number_of_rows: int,
+def dataset_to_snowflake(
+    tables: dict[str, pa.Table],
+    spec: str = "fake_sales",
+    file_count: int | None = None,
+    confirm_load: bool = False,
+    batch_id: str | None = None,
+    **connection_args,
+) -> None:
+    """
+    Load every table of a dataset batch to its own table stage and pipe, one
+    `data_to_snowflake` per table, all in the same session.
+
+    Args:
+        tables (dict): Table name to data, as returned by `generate_dataset`.
+        spec (str, optional): The dataset spec the tables were generated from, for their pipe names.
+        file_count (int, optional): The number of files each table is split into.
+            Defaults to None, sized from the measured bytes per row.
+        confirm_load (bool, optional): Wait for Snowpipe to confirm each table's load. Defaults to False.
+        batch_id (str, optional): Checkpoints every table's load under this id. Defaults to None, a new id.
+        **connection_args: Snowflake connection arguments and parquet settings, as for `data_to_snowflake`.
+
+    Notes:
+        The tables are uploaded concurrently, the session is shared just like for the parallel
+        uploads of one table. Snowpipe loads each table on its own, so for a short while after
+        a batch a child table can hold rows whose parent rows are not visible yet.
+    """
+    pipes = spec_tables(spec)
+    with ThreadPoolExecutor(
+        max_workers=len(tables), thread_name_prefix="dataset-load"
+    ) as executor:
+        loads = [
+            executor.submit(
+                data_to_snowflake,
+                data,
+                table=name,
+                pipe=pipes[name],
+                file_count=file_count,
+                confirm_load=confirm_load,
+                batch_id=batch_id,
+                **connection_args,
+            )
+            for name, data in tables.items()
+        ]
+        for load in loads:
+            load.result()
+
+
+def spec_tables(spec: str) -> dict[str, str]:
+    """
+    Return table name to pipe name for every table the spec `spec` loads.
+    """
+    if is_dataset(spec):
+        return {
+            table_plan.name: table_plan.plan.pipe
+            for table_plan in get_dataset_plan(spec).tables
+        }
+    plan = get_plan(spec)
+    return {plan.table: plan.pipe}
+
+
+def saved_batch(
+    batch_id: str, tables: dict[str, str]
+) -> dict[str, pa.Table | None] | None:
+    """
+    Return what failed attempts of a batch left behind, by table: the saved data of tables
+    whose load failed before staging, None for tables whose files are staged or loaded.
+
+    Returns:
+        dict | None: None if a table has no checkpoint or lost its saved data, the batch is
+            then generated again, from the seed of its first attempt.
+    """
+    saved = {}
+    for table in tables:
+        step = batch_checkpoints.get(batch_id, table).get("step")
+        if step is None:
+            return None
+        saved[table] = (
+            batch_checkpoints.load_data(batch_id, table) if step == GENERATED else None
+        )
+        if step == GENERATED and saved[table] is None:
+            return None
+    logger.info(f"Resuming batch {batch_id} without generating it again")
+    metrics.add("resumed_batches", 1)
+    return saved
+
+
+def clean_up_stages(
+    tables: dict[str, str],
     database: str,
     schema: str,
     user: str,
     password: str,
     account: str,
     role: str,
-    warehouse: str,
     rsa_key: str,
+    warehouse: str | None = None,
+    parquet_settings: ParquetSettings | None = None,
+    sweep: bool = False,
+    retention_seconds: float = STAGE_RETENTION_SECONDS,
+) -> None:
+    """
+    Remove staged files that are loaded or past the retention window, see SnowflakeDataLoader.cleanup_stage.
+    Run after the data is registered with Snowpipe, so it is not on the load's critical path.
+
+    Args:
+        tables (dict): Table name to pipe name of the stages to clean up.
+        The connection arguments are the same as for `data_to_snowflake`; `warehouse` and
+            `parquet_settings` are not used, they are accepted so the same arguments can be passed.
+        sweep (bool, optional): Also remove every file older than `retention_seconds` found by
+            listing the stage, including files staged by other containers. Defaults to False.
+        retention_seconds (float, optional): Files not confirmed as loaded are kept this long.
+    """
+    for table, pipe in tables.items():
+        try:
+            loader = SnowflakeDataLoader(
+                None,
+                database=database,
+                schema=schema,
+                user=user,
+                password=password,
+                account=account,
+                role=role,
+                table=table,
+                pipe=pipe,
+                rsa_key=rsa_key,
+            )
+            loader.cleanup_stage(retention_seconds)
+            if sweep:
+                loader.sweep_stage(retention_seconds)
+        except Exception as e:
+            logger.error(f"Could not clean up the stage of {table}. Error: {e}")
+
+
+class LoadSetup:
+    """
+    The setup of a load that does not depend on the data: the connection arguments (which may
+    fetch the secret), the JWT, the Snowflake login and the table / pipe lookup.
+    It runs in a background thread while the data is generated, and warms the process-wide
+    caches (secret, token_provider, connection_manager, metadata_cache), so the load that
+    follows finds everything ready.
+    """
+
+    def __init__(
+        self,
+        tables: dict[str, str],
+        get_connection_args: Callable[[], dict],
+    ):
+        """
+        Args:
+            tables (dict): Table name to pipe name of the tables about to be loaded.
+            get_connection_args (Callable): Returns the connection arguments of `data_to_snowflake`.
+        """
+        self.tables = tables
+        self.get_connection_args = get_connection_args
+        self.seconds = None
+        self._started = time.perf_counter()
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="load-setup")
+        self._future = executor.submit(self._prepare)
+        # The thread ends with the setup, nothing waits for the executor itself.
+        executor.shutdown(wait=False)
+
+    def _prepare(self) -> dict:
+        try:
+            connection_args = self.get_connection_args()
+            for table, pipe in self.tables.items():
+                loader = SnowflakeDataLoader(
+                    None, table=table, pipe=pipe, **connection_args
+                )
+                # Logs in and looks up the table and pipe; errors are logged, the load decides.
+                choose_load_strategy(loader)
+            return connection_args
+        finally:
+            self.seconds = time.perf_counter() - self._started
+
+    def result(self) -> dict:
+        """
+        Wait for the setup to finish and return the connection arguments.
+        Logs and records how much of the setup was hidden behind the work done meanwhile.
+
+        Raises:
+            Exception: What the setup raised, e.g. when the secret or the private key cannot be read.
+        """
+        with metrics.span("wait_for_setup"):
+            wait_start = time.perf_counter()
+            try:
+                return self._future.result()
+            finally:
+                waited = time.perf_counter() - wait_start
+                overlapped = max(0.0, self.seconds - waited)
+                metrics.add("setup_seconds", round(self.seconds, 6))
+                metrics.add("overlapped_setup_seconds", round(overlapped, 6))
+                logger.info(
+                    f"Setup took {self.seconds:.2f}s, {waited:.2f}s of it on the critical path, "
+                    f"{overlapped:.2f}s overlapped with data generation"
+                )
+
+
+def main(
+    number_of_rows: int,
+    database: str | None = None,
+    schema: str | None = None,
+    user: str | None = None,
+    password: str | None = None,
+    account: str | None = None,
+    role: str | None = None,
+    warehouse: str | None = None,
+    rsa_key: str | None = None,
+    seed: int | None = None,
+    workers: int = 1,
+    chunk_size: int | None = None,
+    file_count: int | None = None,
+    confirm_load: bool = False,
+    spec: str = DEFAULT_SPEC,
+    parquet_settings: ParquetSettings | None = None,
+    stage_cleanup: bool = True,
+    get_connection_args: Callable[[], dict] | None = None,
+    batch_id: str | None = None,
 ) -> None:
     """
     Entry point of the script.
 
     Args:
         number_of_rows (int): The number of rows to generate in the fake data.
-    """
-    df = generate_data(number_of_rows)
-    # upload_to_snowflake(df)
+        seed (int, optional): Makes the generated data reproducible. Defaults to None (random).
+        workers (int, optional): The number of processes to generate the data with. Defaults to 1.
+        chunk_size (int, optional): If set, stream the data in chunks of this many rows
+            instead of generating it all at once. Memory then stays flat regardless of `number_of_rows`.
+            `workers` is not used in streaming mode.
+        file_count (int, optional): The number of files each batch is split into for Snowpipe.
+            Defaults to None: as many as needed to stage files of about TARGET_FILE_MB, see file_sizing.py.
+            Not used in streaming mode, where every chunk is one file unless it is larger than the target.
+        confirm_load (bool, optional): Wait for Snowpipe to confirm the load before removing the staged files.
+            Not used in streaming mode.
+        spec (str, optional): The name of the table spec to generate. The data is loaded to the
+            table and pipe named in the spec. Defaults to "fake_sales_orders".
+            A dataset spec such as "fake_sales" generates and loads all of its related tables;
+            `workers` and `chunk_size` are not used for it.
+        parquet_settings (ParquetSettings, optional): How the staged parquet files are written.
+            Defaults to snappy compression with dictionary encoding of the low-cardinality columns.
+        stage_cleanup (bool, optional): After the load, remove the staged files Snowpipe loaded
+            and those past the retention window. Turn off to leave it to a scheduled run. Defaults to True.
+        get_connection_args (Callable, optional): Returns the connection arguments (database to rsa_key
+            and warehouse) instead of passing them, so that reading them, e.g. fetching the secret,
+            overlaps with data generation too. Defaults to None, using the arguments passed.
+        batch_id (str, optional): Identifies the batch across retries, e.g. the Lambda request id.
+            Its progress is checkpointed, see batch_checkpoints.py. Run again with the same id,
+            loaded tables are skipped, staged files are registered instead of uploaded again and
+            data saved by a failed load is reused instead of generated. Otherwise the batch is
+            generated again with the seed of the first attempt. In streaming mode the chunks are
+            generated again, and those loaded or staged by the failed attempt are skipped or
+            registered, see load_chunk.
+            Defaults to None, a new id.
 
-    try:
-        data_to_snowflake(
-            df,
+    The authentication, login and table / pipe lookup run in the background while the data is
+    generated, see LoadSetup. The load starts once both are done.
+    The timings of every stage, the row and byte counts and the peak memory are emitted
+    as one metrics document at the end, see metrics.py.
+    """
+    metrics.reset(spec=spec)
+    if get_connection_args is None:
+        passed_args = dict(
             database=database,
             schema=schema,
             user=user,
@@ -130,43 +684,94 @@ def main(
             account=account,
             role=role,
             warehouse=warehouse,
-            table="fake_sales_orders",
             rsa_key=rsa_key,
         )
+        get_connection_args = lambda: passed_args
+
+    batch_id = batch_id or uuid.uuid4().hex
+    loaded = False
+    try:
+        seed = batch_checkpoints.start(batch_id, seed)
+        saved = None if chunk_size else saved_batch(batch_id, spec_tables(spec))
+        if not saved:
+            # A regenerated batch gets the unique values of its failed attempts again.
+            unique_keys.start_batch(batch_id)
+        setup = LoadSetup(
+            spec_tables(spec),
+            lambda: dict(get_connection_args(), parquet_settings=parquet_settings),
+        )
+        if is_dataset(spec):
+            tables = saved or generate_dataset(number_of_rows, seed=seed, spec=spec)
+            connection_args = setup.result()
+            dataset_to_snowflake(
+                tables,
+                spec=spec,
+                file_count=file_count,
+                confirm_load=confirm_load,
+                batch_id=batch_id,
+                **connection_args,
+            )
+        elif chunk_size:
+            plan = get_plan(spec)
+            chunks = generate_arrow_chunks(
+                number_of_rows, chunk_size, seed=seed, spec=spec
+            )
+            # The first chunk is generated while the setup runs, the others while loading.
+            first_chunk = next(chunks, None)
+            if first_chunk is not None:
+                chunks = itertools.chain([first_chunk], chunks)
+                del first_chunk
+            connection_args = setup.result()
+            data_chunks_to_snowflake(
+                chunks,
+                table=plan.table,
+                pipe=plan.pipe,
+                batch_id=batch_id,
+                **connection_args,
+            )
+        else:
+            plan = get_plan(spec)
+            if saved:
+                df = saved[plan.table]
+            else:
+                df = generate_arrow(
+                    number_of_rows, seed=seed, workers=workers, spec=spec
+                )
+            connection_args = setup.result()
+            data_to_snowflake(
+                df,
+                table=plan.table,
+                pipe=plan.pipe,
+                file_count=file_count,
+                confirm_load=confirm_load,
+                batch_id=batch_id,
+                **connection_args,
+            )
+        loaded = True
+        if stage_cleanup:
+            clean_up_stages(spec_tables(spec), **connection_args)
         logger.info("Process complete")
     except Exception as e:
         logger.error(f"Error: {e}")
         logger.error("Process failed")
         raise e
+    finally:
+        unique_keys.finish_batch(batch_id, loaded)
+        metrics.emit()
 
 
 if __name__ == "__main__":
     # for testing locally
-    from config import (
-        user,
-        password,
-        account,
-        warehouse,
-        database,
-        schema,
-        role,
-        region,
-        secret_name,
-    )
-    from SecretsManager import SecretsManager
-
-    secrets_manager = SecretsManager(secret_name=secret_name, region=region)
-    secret = secrets_manager.get_secret()
-    rsa_key = os.getenv("rsa_key")
+    from config import config
 
     main(
         number_of_rows=1000,
-        user=user,
-        password=password,
-        account=account,
-        warehouse=warehouse,
-        database=database,
-        schema=schema,
-        role=role,
-        rsa_key=rsa_key,
+        user=config.user,
+        password=config.password,
+        account=config.account,
+        warehouse=config.warehouse,
+        database=config.database,
+        schema=config.schema,
+        role=config.role,
+        rsa_key=config.rsa_key,
     )
@@ -0,0 +1,72 @@
+import math
+import os
+import threading
+from logging_config import logger
+
+# Snowflake recommends staged files of roughly 100-250 MB compressed for Snowpipe.
+TARGET_FILE_MB = float(os.getenv("TARGET_FILE_MB", 100))
+# Rows written to measure bytes per row when a table has no estimate yet.
+FILE_SIZE_SAMPLE_ROWS = int(os.getenv("FILE_SIZE_SAMPLE_ROWS", 10_000))
+# Weight of the newest file in the bytes per row estimate.
+FILE_SIZE_SMOOTHING = float(os.getenv("FILE_SIZE_SMOOTHING", 0.3))
+
+
+class FileSizer:
+    """
+    Chooses how many files a batch is split into, so that staged files come close to a
+    target size whatever the row count, spec or parquet settings.
+
+    Bytes per row are measured per table: on a sample of the first batch, then on every
+    staged file, as an exponentially weighted average so the estimate follows changing data.
+    The estimates live as long as the process, warm invocations reuse them.
+    """
+
+    def __init__(self, target_bytes: float, smoothing: float = 0.3):
+        """
+        Args:
+            target_bytes (float): The compressed size to aim for per staged file.
+            smoothing (float, optional): Weight of the newest measurement. Defaults to 0.3.
+        """
+        self.target_bytes = target_bytes
+        self.smoothing = smoothing
+        self._bytes_per_row = {}
+        self._lock = threading.Lock()
+
+    def bytes_per_row(self, key: str) -> float | None:
+        with self._lock:
+            return self._bytes_per_row.get(key)
+
+    def observe(self, key: str, rows: int, size: int) -> None:
+        """
+        Record that `rows` rows of table `key` made a file of `size` bytes.
+        """
+        if rows <= 0:
+            return
+        measured = size / rows
+        with self._lock:
+            previous = self._bytes_per_row.get(key)
+            self._bytes_per_row[key] = (
+                measured
+                if previous is None
+                else previous + self.smoothing * (measured - previous)
+            )
+
+    def file_count(self, key: str, rows: int) -> int:
+        """
+        Return the number of files `rows` rows of table `key` should be split into.
+        Call observe first, without an estimate every batch is one file.
+        """
+        bytes_per_row = self.bytes_per_row(key)
+        if not bytes_per_row or rows <= 0:
+            return 1
+        file_count = max(
+            1, min(rows, math.ceil(rows * bytes_per_row / self.target_bytes))
+        )
+        logger.info(
+            f"Splitting {rows} rows into {file_count} files of ~{math.ceil(rows / file_count)} rows: "
+            f"{bytes_per_row:.1f} bytes/row, target {self.target_bytes / 2**20:g} MB"
+        )
+        return file_count
+
+
+file_sizer = FileSizer(TARGET_FILE_MB * 2**20, FILE_SIZE_SMOOTHING)
@@ -0,0 +1,95 @@
+import contextlib
+import fcntl
+import json
+import os
+from typing import IO, Iterator
+from logging_config import logger
+
+# State kept in JSON files in /tmp (the metadata cache, the stage manifest, the batch
+# checkpoints) is shared by the worker processes and the warm invocations of a container.
+
+
+def write_atomically(path: str, data: bytes, permissions: int = 0o644) -> None:
+    """
+    Write `data` to `path` through a temporary file that is then renamed,
+    so a reader never sees a partial file.
+
+    Raises:
+        OSError: If the file could not be written.
+    """
+    temp_path = f"{path}.tmp"
+    with open(
+        os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, permissions), "wb"
+    ) as file:
+        file.write(data)
+    os.replace(temp_path, path)
+
+
+def open_lock(path: str) -> IO:
+    """
+    Open `<path>.lock` and take an exclusive lock on it, held until the returned file is closed.
+
+    Args:
+        path (str): The file the lock guards. Its directory is created if needed.
+
+    Raises:
+        OSError: If the lock file could not be opened.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    lock = open(f"{path}.lock", "a")
+    fcntl.flock(lock, fcntl.LOCK_EX)
+    return lock
+
+
+def read_json(path: str, description: str) -> dict:
+    """
+    Return the contents of the JSON file `path`, {} if there is none or it is unreadable.
+    No lock is needed to read, files are only ever replaced as a whole.
+
+    Args:
+        path (str): The file.
+        description (str): What the file holds, for the log, e.g. "stage manifest".
+    """
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r") as file:
+            return json.load(file)
+    except (ValueError, OSError) as e:
+        logger.error(f"Ignoring unreadable {description}. Error: {e}")
+        return {}
+
+
+@contextlib.contextmanager
+def locked_update(path: str, description: str) -> Iterator[dict]:
+    """
+    Read-modify-write of the JSON file `path`: yields its contents (see read_json) to be
+    changed in place, and writes them back when the block ends without an error.
+    An empty dict removes the file.
+
+    The lock of open_lock is held from the read to the write, so processes
+    updating the same file do not overwrite each other's changes. If the state cannot be
+    written, e.g. on a full disk, the error is logged and the change is only seen by the block.
+
+    Args:
+        path (str): The file. Its directory is created if needed.
+        description (str): What the file holds, for the log, e.g. "stage manifest".
+    """
+    try:
+        lock = open_lock(path)
+    except OSError as e:
+        logger.error(
+            f"Could not lock the {description}, changes are not saved. Error: {e}"
+        )
+        yield read_json(path, description)
+        return
+    with lock:
+        data = read_json(path, description)
+        yield data
+        try:
+            if data:
+                write_atomically(path, json.dumps(data).encode())
+            elif os.path.exists(path):
+                os.remove(path)
+        except OSError as e:
+            logger.error(f"Could not write the {description}. Error: {e}")
@@ -0,0 +1,62 @@
+import os
+import time
+from json_state import locked_update, read_json
+
+# Where the metadata is kept between warm invocations, and how long an entry is trusted.
+METADATA_CACHE_PATH = os.getenv("METADATA_CACHE_PATH", "/tmp/snowflake_metadata.json")
+METADATA_CACHE_TTL_SECONDS = float(os.getenv("METADATA_CACHE_TTL_SECONDS", 3600))
+
+
+class MetadataCache:
+    """
+    Remembers whether a table and its pipe exist, so the loader can choose between Snowpipe
+    and write_pandas up front instead of trying Snowpipe and falling back on the error.
+
+    Entries expire after `ttl_seconds`. They are kept in a JSON file in /tmp, which lives as
+    long as the Lambda execution environment and is shared by its processes, see json_state.py.
+    """
+
+    def __init__(self, path: str, ttl_seconds: float = 3600):
+        """
+        Args:
+            path (str): The JSON file the entries are persisted in.
+            ttl_seconds (float, optional): How long an entry is trusted. Defaults to one hour.
+        """
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+
+    def get(self, key: str) -> dict | None:
+        """
+        Return the entry for `key`, or None if there is none or it expired.
+        """
+        entry = read_json(self.path, "metadata cache").get(key)
+        if entry is None or time.time() - entry["checked_at"] > self.ttl_seconds:
+            return None
+        return entry
+
+    def set(self, key: str, **values) -> dict:
+        """
+        Record fresh values for `key`, e.g. set(key, table_exists=True, pipe_exists=False).
+        Values not given are kept from the previous entry.
+
+        Returns:
+            dict: The updated entry.
+        """
+        with locked_update(self.path, "metadata cache") as entries:
+            entry = {**entries.get(key, {}), **values, "checked_at": time.time()}
+            entries[key] = entry
+        return entry
+
+    def invalidate(self, key: str) -> None:
+        """
+        Forget `key`, e.g. after Snowpipe failed although the pipe was believed to exist.
+        """
+        with locked_update(self.path, "metadata cache") as entries:
+            entries.pop(key, None)
+
+    def clear(self) -> None:
+        with locked_update(self.path, "metadata cache") as entries:
+            entries.clear()
+
+
+metadata_cache = MetadataCache(METADATA_CACHE_PATH, METADATA_CACHE_TTL_SECONDS)
@@ -0,0 +1,177 @@
+import contextlib
+import json
+import os
+import resource
+import sys
+import threading
+import time
+from typing import Iterator
+from logging_config import logger
+
+# CloudWatch namespace of the emitted metrics.
+METRICS_NAMESPACE = os.getenv("METRICS_NAMESPACE", "FakerToSnowflake")
+# Outside Lambda, the metric documents are appended to this file if set, otherwise logged.
+METRICS_FILE = os.getenv("METRICS_FILE")
+# Directory the `{"profile": true}` dumps are written to.
+PROFILE_DIRECTORY = os.getenv("PROFILE_DIRECTORY", "/tmp")
+
+# CloudWatch unit of a metric, by name suffix. Anything else is a Count.
+_UNITS = {
+    "_seconds": "Seconds",
+    "_bytes": "Bytes",
+    "_per_second": "Count/Second",
+    "_mb": "Megabytes",
+}
+
+
+def peak_rss_mb() -> float:
+    """
+    Peak resident set size of this process or any of its finished worker processes, in MB.
+    In a warm Lambda container this is the peak over all invocations so far.
+    """
+    peak_kb = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+    # ru_maxrss is in kilobytes on Linux, in bytes on macOS.
+    return peak_kb / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+class InvocationMetrics:
+    """
+    Timing spans and counters of one invocation, emitted as one CloudWatch
+    Embedded Metric Format (EMF) document. In Lambda the document is printed to stdout,
+    CloudWatch Logs turns it into metrics. Elsewhere it goes to METRICS_FILE or the log.
+
+    Spans with the same name add up. Spans opened in several threads at once (the PUTs)
+    therefore sum to more than the wall clock time they took.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self, **dimensions: str) -> None:
+        """
+        Start a new invocation. `dimensions` (e.g. spec="fake_sales_orders") become the
+        CloudWatch dimensions of every metric.
+        """
+        with self._lock:
+            self.dimensions = dimensions
+            self.seconds = {}
+            self.calls = {}
+            self.counters = {}
+            self.started = time.perf_counter()
+
+    @contextlib.contextmanager
+    def span(self, stage: str) -> Iterator[None]:
+        """
+        Time the body of the `with` block as `<stage>_seconds`.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.seconds[stage] = self.seconds.get(stage, 0.0) + elapsed
+                self.calls[stage] = self.calls.get(stage, 0) + 1
+
+    def add(self, counter: str, value: float) -> None:
+        """
+        Add `value` to a counter, e.g. add("staged_bytes", 1024).
+        """
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def summary(self) -> dict:
+        """
+        Return the metrics of the invocation so far, by metric name.
+        """
+        total_seconds = time.perf_counter() - self.started
+        with self._lock:
+            values = {
+                f"{stage}_seconds": round(seconds, 6)
+                for stage, seconds in self.seconds.items()
+            }
+            values.update(self.counters)
+        values["total_seconds"] = round(total_seconds, 6)
+        values["rows_per_second"] = round(
+            values.get("rows", 0) / total_seconds if total_seconds else 0.0, 1
+        )
+        values["peak_rss_mb"] = round(peak_rss_mb(), 1)
+        return values
+
+    def to_emf(self) -> dict:
+        """
+        Return the summary as an EMF document: the metric values and dimensions at the top level,
+        their names and units under `_aws`. The span call counts are added as a plain property.
+        """
+        values = self.summary()
+        metric_definitions = [
+            {
+                "Name": name,
+                "Unit": next(
+                    (unit for suffix, unit in _UNITS.items() if name.endswith(suffix)),
+                    "Count",
+                ),
+            }
+            for name in values
+        ]
+        return {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [
+                    {
+                        "Namespace": METRICS_NAMESPACE,
+                        "Dimensions": [list(self.dimensions)],
+                        "Metrics": metric_definitions,
+                    }
+                ],
+            },
+            **self.dimensions,
+            **values,
+            "span_calls": dict(self.calls),
+        }
+
+    def emit(self) -> dict:
+        """
+        Write the EMF document of the invocation to its sink and return it.
+        """
+        document = self.to_emf()
+        line = json.dumps(document, default=str)
+        if os.getenv("AWS_LAMBDA_FUNCTION_NAME"):
+            # Lambda forwards stdout to CloudWatch Logs, which extracts the metrics.
+            print(line, flush=True)
+        elif METRICS_FILE:
+            with open(METRICS_FILE, "a") as file:
+                file.write(line + "\n")
+        else:
+            logger.info(f"Metrics: {line}")
+        return document
+
+
+@contextlib.contextmanager
+def profiled(path: str, top: int = 25) -> Iterator[None]:
+    """
+    Profile the body of the `with` block with cProfile, write the pstats dump to `path`
+    and log the `top` functions by cumulative time, since /tmp does not outlive the container.
+    Only the calling thread is profiled, not the PUT threads or the generator processes.
+    """
+    import cProfile
+    import io
+    import pstats
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+        report = io.StringIO()
+        pstats.Stats(profiler, stream=report).sort_stats("cumulative").print_stats(top)
+        logger.info(f"Profile written to {path}\n{report.getvalue()}")
+
+
+metrics = InvocationMetrics()
@@ -0,0 +1,424 @@
+# Fan-out of requests too large for one invocation. In Lambda, a coordinator invocation
+#   {"rows": 20000000, "fan_out": {"rows_per_job": 1000000, "concurrency": 20}}
+# invokes the function asynchronously once per sub-job with {"sub_job": {...}}, and each worker
+# registers its own files with Snowpipe. Offline, with a process pool, the coordinator registers them:
+#   python orchestrator.py --rows 2000000 --rows_per_job 500000 --processes 4
+
+import argparse
+import json
+import multiprocessing
+import os
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+import numpy as np
+from logging_config import logger
+from metrics import metrics
+from parallel_generator import generate_shards, plan_shards, DEFAULT_SHARD_SIZE
+from parquet_writer import ParquetSettings
+from relational import is_dataset
+from table_spec import get_plan, DEFAULT_SPEC
+from snowflake_loader import SnowflakeDataLoader, WRITE_PANDAS
+from batch_checkpoints import batch_checkpoints, STAGED, LOADED
+from unique_keys import unique_keys
+from fake_data_to_snowflake import choose_load_strategy, clean_up_stages
+
+# The function sub-jobs are sent to. Defaults to the running function, which handles both roles.
+WORKER_FUNCTION_NAME = os.getenv(
+    "WORKER_FUNCTION_NAME", os.getenv("AWS_LAMBDA_FUNCTION_NAME")
+)
+DEFAULT_ROWS_PER_JOB = int(os.getenv("ROWS_PER_JOB", 1_000_000))
+
+
+def plan_sub_jobs(
+    number_of_rows: int,
+    rows_per_job: int,
+    seed: int,
+    now: datetime,
+    spec: str = DEFAULT_SPEC,
+    file_count: int | None = None,
+    parquet: dict | None = None,
+    stage_cleanup: bool = True,
+) -> list[dict]:
+    """
+    Split a request into sub-jobs of consecutive shards. Shards are seeded from (seed, shard index),
+    so the rows do not depend on how many sub-jobs there are. The sub-jobs are plain dicts,
+    they are sent to the workers as JSON.
+
+    Returns:
+        list[dict]: Sub-jobs with job_id, shards, seed, now, spec, file_count, parquet and stage_cleanup.
+    """
+    shard_size = min(DEFAULT_SHARD_SIZE, rows_per_job)
+    shards = plan_shards(number_of_rows, shard_size)
+    shards_per_job = max(1, rows_per_job // shard_size)
+    run_id = uuid.uuid4().hex
+    return [
+        {
+            "job_id": f"{run_id}-{job_index}",
+            "shards": shards[start : start + shards_per_job],
+            "seed": seed,
+            "now": now.isoformat(),
+            "spec": spec,
+            "file_count": file_count,
+            "parquet": parquet,
+            "stage_cleanup": stage_cleanup,
+        }
+        for job_index, start in enumerate(range(0, len(shards), shards_per_job))
+    ]
+
+
+def run_sub_job(
+    job: dict,
+    database: str,
+    schema: str,
+    user: str,
+    password: str,
+    account: str,
+    role: str,
+    rsa_key: str,
+) -> dict:
+    """
+    Worker side: generate the rows of `job` and stage them to the table stage.
+    The files are registered with Snowpipe by the coordinator, for all workers at once,
+    unless the job has "register" set: workers invoked asynchronously register their own,
+    under a checkpoint of the job id, so a retry of the job resumes instead of staging it again,
+    and clean up the stage after, as only they know when their files are registered.
+
+    Returns:
+        dict: job_id, rows and the staged file names.
+    """
+    spec = job["spec"]
+    plan = get_plan(spec)
+    rows = sum(shard_rows for _, shard_rows in job["shards"])
+    metrics.reset(spec=spec)
+    loaded = False
+    try:
+        checkpoint = {}
+        if job.get("register"):
+            batch_checkpoints.start(job["job_id"], job["seed"])
+            checkpoint = batch_checkpoints.get(job["job_id"], plan.table)
+        if checkpoint.get("step") == LOADED:
+            loaded = True
+            logger.info(f"Sub-job {job['job_id']}: already loaded")
+            return {"job_id": job["job_id"], "rows": rows, "files": checkpoint["files"]}
+        table = None
+        if checkpoint.get("step") != STAGED:
+            if job.get("register"):
+                unique_keys.start_batch(job["job_id"])
+            shards = [tuple(shard) for shard in job["shards"]]
+            with metrics.span("generate"):
+                table = generate_shards(
+                    shards, job["seed"], datetime.fromisoformat(job["now"]), spec=spec
+                )
+            metrics.add("rows", table.num_rows)
+        loader = SnowflakeDataLoader(
+            table,
+            database=database,
+            schema=schema,
+            user=user,
+            password=password,
+            account=account,
+            role=role,
+            table=plan.table,
+            pipe=plan.pipe,
+            rsa_key=rsa_key,
+            file_count=job.get("file_count"),
+            parquet_settings=(
+                ParquetSettings(**job["parquet"]) if job.get("parquet") else None
+            ),
+        )
+        if job.get("register"):
+            loader.load_using_snowpipe(batch_id=job["job_id"])
+            loaded = True
+            files = batch_checkpoints.get(job["job_id"], plan.table)["files"]
+            logger.info(f"Sub-job {job['job_id']}: loaded {rows} rows")
+            if job.get("stage_cleanup", True):
+                clean_up_stages(
+                    {plan.table: plan.pipe},
+                    database=database,
+                    schema=schema,
+                    user=user,
+                    password=password,
+                    account=account,
+                    role=role,
+                    rsa_key=rsa_key,
+                )
+        else:
+            files = loader.upload_files_to_stage()
+            logger.info(f"Sub-job {job['job_id']}: staged {rows} rows")
+        return {"job_id": job["job_id"], "rows": rows, "files": files}
+    finally:
+        if job.get("register"):
+            unique_keys.finish_batch(job["job_id"], loaded)
+        metrics.emit()
+
+
+def _run_sub_job_safely(job: dict, connection_args: dict) -> dict:
+    try:
+        return run_sub_job(job, **connection_args)
+    except Exception as e:
+        return {"job_id": job["job_id"], "error": f"{type(e).__name__}: {e}"}
+
+
+class LocalDispatcher:
+    """
+    Runs sub-jobs in a local pool of processes, to run and test the fan-out offline.
+    Not usable in Lambda, which has no /dev/shm for the pool's semaphores.
+    """
+
+    # The results carry the staged files, the coordinator registers them.
+    asynchronous = False
+
+    def __init__(self, processes: int | None = None):
+        self.processes = processes or os.cpu_count()
+
+    def __repr__(self) -> str:
+        return f"{self.processes} local processes"
+
+    def dispatch(self, jobs: list[dict], connection_args: dict) -> list[dict]:
+        """
+        Run `jobs` and return their results in job order. A failed job's result has an "error".
+        """
+        # Forked workers inherit the compiled specs and Faker pools of the coordinator.
+        with ProcessPoolExecutor(
+            max_workers=max(1, min(self.processes, len(jobs))),
+            mp_context=multiprocessing.get_context("fork"),
+        ) as executor:
+            futures = [
+                executor.submit(_run_sub_job_safely, job, connection_args)
+                for job in jobs
+            ]
+            return [future.result() for future in futures]
+
+
+class LambdaDispatcher:
+    """
+    Invokes a Lambda function per sub-job, asynchronously: the coordinator returns once every
+    sub-job is queued, instead of holding a connection open for up to 15 minutes per worker.
+    The workers read the Snowflake credentials from their own configuration, only the
+    sub-job is sent, and they register their own files with Snowpipe, see run_sub_job.
+
+    A failed worker is retried by Lambda and resumes from its checkpoint. A sub-job that
+    still fails is not seen by the coordinator: configure an on-failure destination or
+    dead-letter queue on the worker function. `concurrency` bounds the invocations sent
+    at once, bound the workers running at once with the function's reserved concurrency.
+    """
+
+    # The workers register their files and clean up the stage, not the coordinator.
+    asynchronous = True
+
+    def __init__(self, function_name: str | None = None, concurrency: int = 10):
+        self.function_name = function_name or WORKER_FUNCTION_NAME
+        self.concurrency = concurrency
+        if not self.function_name:
+            raise ValueError("Set WORKER_FUNCTION_NAME to fan out to Lambda workers")
+
+    def __repr__(self) -> str:
+        return f"{self.concurrency} concurrent invocations of {self.function_name}"
+
+    def dispatch(
+        self, jobs: list[dict], connection_args: dict | None = None
+    ) -> list[dict]:
+        """
+        Queue `jobs` and return their results in job order: the rows of the job and no files,
+        the worker registers them. A job that could not be queued has an "error".
+        """
+        # boto3 is slow to import, only do it when sub-jobs are actually dispatched.
+        import boto3
+        from botocore.config import Config
+
+        client = boto3.Session().client(
+            "lambda",
+            config=Config(
+                connect_timeout=10,
+                # A retried invocation could run the sub-job twice, failed jobs are reported instead.
+                retries={"max_attempts": 0},
+                max_pool_connections=self.concurrency,
+            ),
+        )
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            return list(executor.map(lambda job: self._invoke(client, job), jobs))
+
+    def _invoke(self, client, job: dict) -> dict:
+        try:
+            response = client.invoke(
+                FunctionName=self.function_name,
+                InvocationType="Event",
+                Payload=json.dumps({"sub_job": {**job, "register": True}}).encode(),
+            )
+            if response["StatusCode"] != 202:
+                return {
+                    "job_id": job["job_id"],
+                    "error": f"Invocation returned status {response['StatusCode']}",
+                }
+            rows = sum(shard_rows for _, shard_rows in job["shards"])
+            return {"job_id": job["job_id"], "rows": rows, "files": []}
+        except Exception as e:
+            return {"job_id": job["job_id"], "error": f"{type(e).__name__}: {e}"}
+
+
+def fan_out(
+    number_of_rows: int,
+    dispatcher: LocalDispatcher | LambdaDispatcher,
+    database: str,
+    schema: str,
+    user: str,
+    password: str,
+    account: str,
+    role: str,
+    warehouse: str,
+    rsa_key: str,
+    rows_per_job: int = DEFAULT_ROWS_PER_JOB,
+    seed: int | None = None,
+    spec: str = DEFAULT_SPEC,
+    file_count: int | None = None,
+    parquet: dict | None = None,
+    stage_cleanup: bool = True,
+) -> dict:
+    """
+    Coordinator side: split `number_of_rows` into sub-jobs, have `dispatcher` generate and
+    stage them in parallel, then register all staged files with Snowpipe in one go.
+    If the table does not exist yet, the coordinator loads the first sub-job itself with
+    write_pandas, which creates it.
+
+    With an asynchronous dispatcher (LambdaDispatcher) the coordinator returns once the
+    sub-jobs are queued: each worker registers its own files with Snowpipe and cleans up
+    the stage after, the coordinator neither registers files nor cleans up.
+
+    Args:
+        number_of_rows (int): The number of rows to load.
+        dispatcher (LocalDispatcher | LambdaDispatcher): Where the sub-jobs run.
+        rows_per_job (int, optional): The number of rows per sub-job. Defaults to ROWS_PER_JOB.
+        seed (int, optional): Makes the generated data reproducible. Defaults to None (random).
+        spec (str, optional): The name of the table spec to generate. Dataset specs are not
+            supported, their tables reference each other and are generated as a whole.
+        file_count (int, optional): The number of files per sub-job. Defaults to sizing them, see file_sizing.py.
+        parquet (dict, optional): ParquetSettings arguments, e.g. {"compression": "zstd"}.
+        stage_cleanup (bool, optional): Remove loaded and expired staged files at the end, in the
+            workers if they are asynchronous. Defaults to True.
+        The connection arguments are the same as for `data_to_snowflake`.
+
+    Returns:
+        dict: The number of jobs, the rows loaded or queued, and the files the coordinator registered.
+
+    Raises:
+        RuntimeError: If a sub-job failed. The files of the other sub-jobs are registered first.
+    """
+    if is_dataset(spec):
+        raise ValueError(f"{spec} is a dataset spec, fan-out only supports table specs")
+    metrics.reset(spec=spec)
+    snowflake_args = dict(
+        database=database,
+        schema=schema,
+        user=user,
+        password=password,
+        account=account,
+        role=role,
+        rsa_key=rsa_key,
+    )
+    try:
+        seed = np.random.SeedSequence().entropy if seed is None else seed
+        jobs = plan_sub_jobs(
+            number_of_rows,
+            rows_per_job,
+            seed,
+            datetime.now(),
+            spec=spec,
+            file_count=file_count,
+            parquet=parquet,
+            stage_cleanup=stage_cleanup,
+        )
+        if not jobs:
+            logger.info("No rows to load")
+            return {"jobs": 0, "rows": 0, "files": 0}
+        plan = get_plan(spec)
+        loader = SnowflakeDataLoader(
+            None,
+            table=plan.table,
+            pipe=plan.pipe,
+            parquet_settings=ParquetSettings(**parquet) if parquet else None,
+            **snowflake_args,
+        )
+        rows = 0
+        job_count = len(jobs)
+        if choose_load_strategy(loader) == WRITE_PANDAS:
+            # Workers can only stage files once the table and pipe exist.
+            first_job = jobs.pop(0)
+            with metrics.span("generate"):
+                table = generate_shards(
+                    [tuple(shard) for shard in first_job["shards"]],
+                    seed,
+                    datetime.fromisoformat(first_job["now"]),
+                    spec=spec,
+                )
+            loader.load_using_write_pandas(warehouse=warehouse, df=table)
+            rows += table.num_rows
+            del table
+            if not loader.ensure_pipe():
+                raise RuntimeError(f"Could not create the pipe {plan.pipe}")
+
+        logger.info(
+            f"Dispatching {len(jobs)} sub-jobs of up to {rows_per_job} rows to {dispatcher}"
+        )
+        with metrics.span("workers"):
+            results = dispatcher.dispatch(jobs, snowflake_args)
+        staged = [result for result in results if "error" not in result]
+        files = []
+        for result in staged:
+            loader.record_staged_files(result["files"], result["job_id"])
+            files.extend(result["files"])
+        if files:
+            loader.trigger_snowpipe(files)
+        rows += sum(result["rows"] for result in staged)
+        metrics.add("rows", rows)
+        metrics.add("registered_files", len(files))
+
+        failed = [result for result in results if "error" in result]
+        for result in failed:
+            logger.error(f"Sub-job {result['job_id']} failed. Error: {result['error']}")
+        if stage_cleanup and not dispatcher.asynchronous:
+            clean_up_stages({plan.table: plan.pipe}, **snowflake_args)
+        if failed:
+            raise RuntimeError(f"{len(failed)} of {len(results)} sub-jobs failed")
+        logger.info(
+            f"{rows} rows from {job_count} sub-jobs, {len(files)} files registered by the coordinator"
+        )
+        return {"jobs": job_count, "rows": rows, "files": len(files)}
+    finally:
+        metrics.emit()
+
+
+def main():
+    cli_parser = argparse.ArgumentParser(
+        description="Load a large number of rows with a local pool of worker processes."
+    )
+    cli_parser.add_argument("--rows", type=int, required=True)
+    cli_parser.add_argument("--rows_per_job", type=int, default=DEFAULT_ROWS_PER_JOB)
+    cli_parser.add_argument("--processes", type=int, default=os.cpu_count())
+    cli_parser.add_argument("--seed", type=int)
+    cli_parser.add_argument("--spec", default=DEFAULT_SPEC)
+    cli_parser.add_argument("--file_count", type=int)
+    args = cli_parser.parse_args()
+
+    from config import config
+
+    fan_out(
+        args.rows,
+        LocalDispatcher(args.processes),
+        rows_per_job=args.rows_per_job,
+        seed=args.seed,
+        spec=args.spec,
+        file_count=args.file_count,
+        user=config.user,
+        password=config.password,
+        account=config.account,
+        warehouse=config.warehouse,
+        database=config.database,
+        schema=config.schema,
+        role=config.role,
+        rsa_key=config.rsa_key,
+    )
+
+
+if __name__ == "__main__":
+    main()
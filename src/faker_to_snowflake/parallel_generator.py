@@ -0,0 +1,223 @@
+from datetime import datetime
+from typing import Iterator
+import multiprocessing
+from multiprocessing.connection import wait
+import traceback
+import numpy as np
+import pyarrow as pa
+from logging_config import logger
+from column_generators import shared_faker
+from table_spec import get_plan, DEFAULT_SPEC
+
+# Rows are always split into shards of this size, regardless of the number of workers.
+# Each shard is seeded from (seed, shard index), so the output for a given seed
+# does not depend on how the shards are distributed over processes.
+DEFAULT_SHARD_SIZE = 50_000
+
+
+def shard_seed(seed: int, shard_index: int) -> int:
+    """
+    Derive the seed of a shard from the run seed and the shard index.
+    """
+    return int(
+        np.random.SeedSequence([seed, shard_index]).generate_state(1, np.uint64)[0]
+    )
+
+
+def plan_shards(number_of_rows: int, shard_size: int) -> list[tuple[int, int]]:
+    """
+    Split `number_of_rows` into shards.
+
+    Returns:
+        list: (shard index, number of rows) tuples. Every shard but the last has `shard_size` rows.
+    """
+    return [
+        (shard_index, min(shard_size, number_of_rows - start))
+        for shard_index, start in enumerate(range(0, number_of_rows, shard_size))
+    ]
+
+
+def generate_shard(
+    shard_index: int,
+    number_of_rows: int,
+    seed: int,
+    now: datetime,
+    spec: str = DEFAULT_SPEC,
+) -> pa.Table:
+    """
+    Generate one shard of fake data for the table spec `spec`, with the shared Faker
+    instance and a numpy generator both seeded from (seed, shard_index).
+
+    Returns:
+        pyarrow.Table: The generated rows.
+    """
+    seed_for_shard = shard_seed(seed, shard_index)
+    fake = shared_faker
+    fake.seed_instance(seed_for_shard)
+    rng = np.random.default_rng(seed_for_shard)
+    return get_plan(spec).generate(number_of_rows, fake=fake, rng=rng, now=now)
+
+
+def _shard_worker(
+    conn,
+    shards: list[tuple[int, int]],
+    seed: int,
+    now: datetime,
+    spec: str,
+) -> None:
+    """
+    Generate the given shards in a child process and send each one back to the parent
+    as an Arrow IPC stream, followed by a None sentinel.
+    """
+    try:
+        for shard_index, number_of_rows in shards:
+            table = generate_shard(shard_index, number_of_rows, seed, now, spec)
+            sink = pa.BufferOutputStream()
+            with pa.ipc.new_stream(sink, table.schema) as writer:
+                writer.write_table(table)
+            conn.send(shard_index)
+            conn.send_bytes(sink.getvalue())
+        conn.send(None)
+    except Exception:
+        conn.send(traceback.format_exc())
+    finally:
+        conn.close()
+
+
+def _generate_shards_in_processes(
+    shards: list[tuple[int, int]],
+    workers: int,
+    seed: int,
+    now: datetime,
+    spec: str,
+) -> dict[int, pa.Table]:
+    """
+    Distribute shards round-robin over `workers` processes and collect the results.
+
+    Processes and pipes are used directly rather than multiprocessing.Pool,
+    because AWS Lambda has no /dev/shm and Pool/Queue need it for their semaphores.
+    """
+    connections = []
+    processes = []
+    for worker_index in range(workers):
+        parent_conn, child_conn = multiprocessing.Pipe(duplex=False)
+        process = multiprocessing.Process(
+            target=_shard_worker,
+            args=(child_conn, shards[worker_index::workers], seed, now, spec),
+        )
+        process.start()
+        child_conn.close()
+        connections.append(parent_conn)
+        processes.append(process)
+
+    tables = {}
+    try:
+        pending = list(connections)
+        while pending:
+            for conn in wait(pending):
+                message = conn.recv()
+                if message is None:
+                    pending.remove(conn)
+                elif isinstance(message, str):
+                    raise RuntimeError(f"Shard worker failed:\n{message}")
+                else:
+                    # The table references the received buffer, no further copy is made.
+                    buffer = pa.py_buffer(conn.recv_bytes())
+                    tables[message] = pa.ipc.open_stream(buffer).read_all()
+    finally:
+        for process in processes:
+            process.join(timeout=1)
+            if process.is_alive():
+                process.terminate()
+    return tables
+
+
+def generate_table(
+    number_of_rows: int,
+    seed: int | None = None,
+    workers: int = 1,
+    now: datetime | None = None,
+    shard_size: int = DEFAULT_SHARD_SIZE,
+    spec: str = DEFAULT_SPEC,
+) -> pa.Table:
+    """
+    Generate fake data in shards, optionally spread over a pool of processes.
+
+    Args:
+        number_of_rows (int): The number of rows to generate.
+        seed (int, optional): The run seed. Given a seed, the output is the same for any number of workers. Defaults to a random seed.
+        workers (int, optional): The number of processes to generate shards in. Defaults to 1, which generates in-process.
+        now (datetime, optional): The extraction timestamp shared by all shards. Defaults to the current time.
+        shard_size (int, optional): The number of rows per shard. Defaults to DEFAULT_SHARD_SIZE.
+        spec (str, optional): The name of the table spec to generate. Defaults to DEFAULT_SPEC.
+
+    Returns:
+        pyarrow.Table: The generated rows, in shard order, see generate_shards.
+    """
+    if seed is None:
+        seed = np.random.SeedSequence().entropy
+    now = now or datetime.now()
+    # An empty batch still gets one (empty) shard, so the schema is kept.
+    shards = plan_shards(number_of_rows, shard_size) or [(0, 0)]
+    logger.info(f"Generating {number_of_rows} rows in {len(shards)} shards")
+    return generate_shards(shards, seed, now, workers=workers, spec=spec)
+
+
+def generate_shards(
+    shards: list[tuple[int, int]],
+    seed: int,
+    now: datetime,
+    workers: int = 1,
+    spec: str = DEFAULT_SPEC,
+) -> pa.Table:
+    """
+    Generate the given shards, e.g. a slice of `plan_shards`, as one table.
+
+    Args:
+        shards (list): (shard index, number of rows) tuples.
+        seed (int): The run seed, each shard is seeded from (seed, shard index).
+        now (datetime): The extraction timestamp shared by all shards.
+        workers (int, optional): The number of processes to generate shards in. Defaults to 1, which generates in-process.
+        spec (str, optional): The name of the table spec to generate. Defaults to DEFAULT_SPEC.
+
+    Returns:
+        pyarrow.Table: The generated rows, in shard order. Shards are concatenated without copying,
+            only the dictionaries of the dictionary columns are merged into one per column.
+    """
+    workers = max(1, min(workers, len(shards)))
+    if workers == 1:
+        tables = {
+            shard_index: generate_shard(shard_index, rows, seed, now, spec)
+            for shard_index, rows in shards
+        }
+    else:
+        logger.info(f"Generating {len(shards)} shards with {workers} workers")
+        tables = _generate_shards_in_processes(shards, workers, seed, now, spec)
+
+    table = pa.concat_tables([tables[shard_index] for shard_index, _ in shards])
+    # Every shard has its own dictionaries. The parquet writer falls back to plain encoding
+    # when the dictionary changes between chunks, which doubles the file size.
+    return table.unify_dictionaries()
+
+
+def iter_tables(
+    number_of_rows: int,
+    chunk_size: int,
+    seed: int | None = None,
+    now: datetime | None = None,
+    spec: str = DEFAULT_SPEC,
+) -> Iterator[pa.Table]:
+    """
+    Generate fake data lazily, one chunk of `chunk_size` rows at a time.
+    Chunks are seeded like shards, so for a given seed the concatenated chunks are
+    the same as `generate_table` with `shard_size=chunk_size`.
+
+    Yields:
+        pyarrow.Table: The next chunk. Nothing is kept once the chunk is yielded.
+    """
+    if seed is None:
+        seed = np.random.SeedSequence().entropy
+    now = now or datetime.now()
+    for shard_index, rows in plan_shards(number_of_rows, chunk_size):
+        logger.info(f"Generating chunk {shard_index} with {rows} rows")
+        yield generate_shard(shard_index, rows, seed, now, spec)
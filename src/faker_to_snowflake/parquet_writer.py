@@ -0,0 +1,124 @@
+from typing import IO, TYPE_CHECKING
+import pyarrow as pa
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Codecs the parquet writer accepts. Snowflake detects the codec of a staged parquet file itself.
+SUPPORTED_CODECS = ("snappy", "zstd", "gzip", "brotli", "lz4", "none")
+
+
+class ParquetSettings:
+    """
+    How the staged parquet files are written.
+
+    Args:
+        compression (str, optional): One of SUPPORTED_CODECS. Defaults to "snappy", the pandas default.
+        compression_level (int, optional): The codec's level, for zstd, gzip and brotli. Defaults to the codec default.
+        row_group_size (int, optional): The maximum number of rows per row group. Defaults to the pyarrow default.
+        use_dictionary (bool | list[str] | str, optional): Which columns are dictionary encoded.
+            "auto" (the default) skips the plain string columns of a generated table: its low-cardinality
+            strings are dictionary arrays, so the plain ones are the unique ids, whose dictionary
+            would only overflow. Numbers and timestamps are encoded, repeated values compress well.
+            A table without dictionary arrays, e.g. one converted from pandas, has every column encoded.
+    """
+
+    def __init__(
+        self,
+        compression: str = "snappy",
+        compression_level: int | None = None,
+        row_group_size: int | None = None,
+        use_dictionary: bool | list[str] | str = "auto",
+    ):
+        if compression not in SUPPORTED_CODECS:
+            raise ValueError(
+                f"Unsupported parquet compression {compression}, use one of {SUPPORTED_CODECS}"
+            )
+        self.compression = compression
+        self.compression_level = compression_level
+        self.row_group_size = row_group_size
+        self.use_dictionary = use_dictionary
+
+    def __repr__(self) -> str:
+        level = f"-{self.compression_level}" if self.compression_level else ""
+        row_groups = (
+            f", row groups of {self.row_group_size}" if self.row_group_size else ""
+        )
+        return (
+            f"{self.compression}{level}, dictionary={self.use_dictionary}{row_groups}"
+        )
+
+    def dictionary_columns(self, table: pa.Table) -> bool | list[str]:
+        """
+        Resolve `use_dictionary` for `table`.
+        """
+        if self.use_dictionary != "auto":
+            return self.use_dictionary
+        if not any(pa.types.is_dictionary(field.type) for field in table.schema):
+            return True
+        return [
+            field.name
+            for field in table.schema
+            if not (
+                pa.types.is_string(field.type) or pa.types.is_large_string(field.type)
+            )
+        ]
+
+
+DEFAULT_PARQUET_SETTINGS = ParquetSettings()
+
+
+def write_parquet(
+    table: pa.Table, sink: IO[bytes], settings: ParquetSettings | None = None
+) -> None:
+    """
+    Write `table` as one parquet file to `sink`, e.g. a BytesIO.
+    """
+    # Imported here rather than at module level to keep it off the cold start.
+    import pyarrow.parquet as pq
+
+    settings = settings or DEFAULT_PARQUET_SETTINGS
+    with pq.ParquetWriter(
+        sink,
+        table.schema,
+        compression=settings.compression,
+        compression_level=settings.compression_level,
+        use_dictionary=settings.dictionary_columns(table),
+    ) as writer:
+        writer.write_table(table, row_group_size=settings.row_group_size)
+
+
+def as_arrow(data: "pa.Table | pd.DataFrame") -> pa.Table:
+    """
+    Return `data` as an Arrow table, converting a pandas DataFrame without its index.
+    """
+    if isinstance(data, pa.Table):
+        return data
+    return pa.Table.from_pandas(data, preserve_index=False)
+
+
+def decode_dictionaries(table: pa.Table) -> pa.Table:
+    """
+    Return `table` with its dictionary columns cast to their value type.
+    """
+    plain_schema = pa.schema(
+        [
+            (
+                field.with_type(field.type.value_type)
+                if pa.types.is_dictionary(field.type)
+                else field
+            )
+            for field in table.schema
+        ]
+    )
+    return table.cast(plain_schema)
+
+
+def to_pandas(data: "pa.Table | pd.DataFrame") -> "pd.DataFrame":
+    """
+    Return `data` as a pandas DataFrame. Dictionary columns are decoded to their
+    value type first, so they become plain columns instead of pandas categoricals.
+    """
+    if not isinstance(data, pa.Table):
+        return data
+    return decode_dictionaries(data).to_pandas()
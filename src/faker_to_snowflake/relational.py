@@ -0,0 +1,177 @@
+from datetime import datetime
+import functools
+import numpy as np
+import pyarrow as pa
+from faker import Faker
+from logging_config import logger
+from column_generators import shared_faker
+from table_spec import compile_spec, load_spec, TablePlan
+
+
+class ForeignKey:
+    """
+    A column that holds the key of a row in an earlier table of the dataset.
+    """
+
+    def __init__(self, column: str, parent_table: str, parent_column: str):
+        self.column = column
+        self.parent_table = parent_table
+        self.parent_column = parent_column
+
+
+class RelationalTablePlan:
+    """
+    One table of a dataset: its compiled TablePlan, how many rows it gets and its foreign keys.
+
+    A table has either `rows_per_batch`, a fraction of the batch's row count, or a `parent`
+    and `rows_per_parent`, in which case every parent row fans out into min..max child rows.
+    """
+
+    def __init__(
+        self,
+        plan: TablePlan,
+        foreign_keys: list[ForeignKey],
+        rows_per_batch: float | None = None,
+        parent: str | None = None,
+        rows_per_parent: tuple[int, int] = (1, 1),
+    ):
+        self.plan = plan
+        self.foreign_keys = foreign_keys
+        self.rows_per_batch = rows_per_batch
+        self.parent = parent
+        self.rows_per_parent = rows_per_parent
+
+    @property
+    def name(self) -> str:
+        return self.plan.table
+
+
+class DatasetPlan:
+    """
+    A compiled dataset spec: tables that reference each other, in dependency order.
+    """
+
+    def __init__(self, name: str, tables: list[RelationalTablePlan]):
+        self.name = name
+        self.tables = tables
+
+    def generate(
+        self,
+        number_of_rows: int,
+        fake: Faker | None = None,
+        rng: np.random.Generator | None = None,
+        now: datetime | None = None,
+    ) -> dict[str, pa.Table]:
+        """
+        Generate one batch of every table. Parent tables are generated once, child rows point
+        at parent rows by integer index, and the key columns are gathered with a single take.
+
+        Args:
+            number_of_rows (int): The batch size, tables with `rows_per_batch` get that fraction of it.
+            fake (Faker, optional): The Faker instance for faker columns. Defaults to the shared instance.
+            rng (numpy.random.Generator, optional): The random generator. Defaults to an unseeded generator.
+            now (datetime, optional): The extraction timestamp. Defaults to the current time.
+
+        Returns:
+            dict: Table name to pyarrow.Table, in dependency order.
+        """
+        fake = shared_faker if fake is None else fake
+        rng = rng or np.random.default_rng()
+        now = now or datetime.now()
+        tables = {}
+        for table_plan in self.tables:
+            parent_index = None
+            if table_plan.parent:
+                # Fan-out: parent row i gets counts[i] children, in parent order.
+                low, high = table_plan.rows_per_parent
+                counts = rng.integers(
+                    low, high + 1, size=tables[table_plan.parent].num_rows
+                )
+                parent_index = np.repeat(np.arange(len(counts)), counts)
+                rows = len(parent_index)
+            else:
+                rows = round(number_of_rows * table_plan.rows_per_batch)
+                # A table that is referenced must not be empty in a non-empty batch.
+                rows = max(rows, 1) if number_of_rows else 0
+
+            table = table_plan.plan.generate(rows, fake=fake, rng=rng, now=now)
+            for foreign_key in table_plan.foreign_keys:
+                parent = tables[foreign_key.parent_table]
+                if foreign_key.parent_table == table_plan.parent:
+                    indices = parent_index
+                else:
+                    indices = rng.integers(0, parent.num_rows, size=rows)
+                keys = parent.column(foreign_key.parent_column).take(indices)
+                table = table.append_column(foreign_key.column, keys)
+            tables[table_plan.name] = table
+        logger.info(
+            "Generated "
+            + ", ".join(f"{len(table)} {name}" for name, table in tables.items())
+        )
+        return tables
+
+
+def compile_dataset(spec: dict) -> DatasetPlan:
+    """
+    Compile a dataset spec into a DatasetPlan. Every entry of `tables` is a table spec
+    (see table_spec.py) plus `rows_per_batch` or `parent` and `rows_per_parent`, and
+    `foreign_keys` of the form {"column": ..., "references": "<table>.<column>"}.
+    A table may only reference tables listed before it.
+    """
+    tables = []
+    seen = {}
+    for table_spec in spec["tables"]:
+        plan = compile_spec(table_spec)
+        parent = table_spec.get("parent")
+        if parent is None and "rows_per_batch" not in table_spec:
+            raise ValueError(
+                f"Table {plan.table}: set either rows_per_batch or parent and rows_per_parent"
+            )
+        foreign_keys = []
+        for foreign_key in table_spec.get("foreign_keys", []):
+            parent_table, parent_column = foreign_key["references"].split(".")
+            if parent_table not in seen:
+                raise ValueError(
+                    f"Table {plan.table}: {parent_table} must be listed before the tables referencing it"
+                )
+            if parent_column not in {column.name for column in seen[parent_table]}:
+                raise ValueError(
+                    f"Table {plan.table}: {parent_table} has no column {parent_column}"
+                )
+            foreign_keys.append(
+                ForeignKey(foreign_key["column"], parent_table, parent_column)
+            )
+        if parent is not None and parent not in seen:
+            raise ValueError(f"Table {plan.table}: unknown parent {parent}")
+        rows_per_parent = table_spec.get("rows_per_parent", {})
+        tables.append(
+            RelationalTablePlan(
+                plan=plan,
+                foreign_keys=foreign_keys,
+                rows_per_batch=table_spec.get("rows_per_batch"),
+                parent=parent,
+                rows_per_parent=(
+                    rows_per_parent.get("min", 1),
+                    rows_per_parent.get("max", 1),
+                ),
+            )
+        )
+        seen[plan.table] = plan.columns
+    return DatasetPlan(name=spec["dataset"], tables=tables)
+
+
+@functools.lru_cache(maxsize=None)
+def is_dataset(name: str) -> bool:
+    """
+    Return True if the spec `name` describes several related tables rather than one table.
+    """
+    return "tables" in load_spec(name)
+
+
+@functools.lru_cache(maxsize=None)
+def get_dataset_plan(name: str) -> DatasetPlan:
+    """
+    Return the compiled plan for the dataset spec `name`, compiling it on first use.
+    """
+    logger.info(f"Compiling dataset spec: {name}")
+    return compile_dataset(load_spec(name))
@@ -0,0 +1,354 @@
+# Generate without Snowflake, e.g. to measure generator throughput or pre-generate data at disk speed:
+#   python sinks.py generate --rows 10000000 --sink parquet --directory out --workers 4 --chunk_size 1000000
+#   python sinks.py generate --rows 10000000 --sink null --workers 4
+# and stage the parquet files later:
+#   python sinks.py stage --directory out
+
+import abc
+import argparse
+import pathlib
+import time
+import uuid
+from datetime import datetime
+from typing import Callable, Iterator
+import numpy as np
+import pyarrow as pa
+from logging_config import logger
+from metrics import metrics
+from parquet_writer import (
+    ParquetSettings,
+    decode_dictionaries,
+    to_pandas,
+    write_parquet,
+)
+
+
+class Sink(abc.ABC):
+    """
+    Where generated batches go. `write` is called once per batch of one table, `close` once at the end.
+    SnowflakeDataLoader is the Snowflake sink, the others below work offline.
+    """
+
+    @abc.abstractmethod
+    def write(self, table: pa.Table) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+    def __enter__(self) -> "Sink":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+class NullSink(Sink):
+    """
+    Counts the batches and drops them, to benchmark generation alone.
+    """
+
+    def __init__(self):
+        self.rows = 0
+        self.bytes = 0
+
+    def write(self, table: pa.Table) -> None:
+        self.rows += table.num_rows
+        self.bytes += table.nbytes
+
+
+class DirectorySink(Sink):
+    """
+    Writes every batch as its own file in `directory`, named <run id>-<batch number>.<suffix>.
+    Names are unique across runs, because Snowpipe skips a file name it has loaded before.
+    """
+
+    suffix = None
+
+    def __init__(self, directory: str | pathlib.Path):
+        self.directory = pathlib.Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.run_id = uuid.uuid4().hex[:12]
+        self.files = 0
+        self.bytes = 0
+
+    def write(self, table: pa.Table) -> None:
+        path = self.directory / f"{self.run_id}-{self.files:05d}.{self.suffix}"
+        with metrics.span("write"):
+            self._write(table, path)
+        self.files += 1
+        self.bytes += path.stat().st_size
+
+    @abc.abstractmethod
+    def _write(self, table: pa.Table, path: pathlib.Path) -> None:
+        pass
+
+
+class ParquetDirectorySink(DirectorySink):
+    suffix = "parquet"
+
+    def __init__(
+        self,
+        directory: str | pathlib.Path,
+        parquet_settings: ParquetSettings | None = None,
+    ):
+        super().__init__(directory)
+        self.parquet_settings = parquet_settings
+
+    def _write(self, table: pa.Table, path: pathlib.Path) -> None:
+        with open(path, "wb") as file:
+            write_parquet(table, file, self.parquet_settings)
+
+
+class CsvDirectorySink(DirectorySink):
+    suffix = "csv"
+
+    def _write(self, table: pa.Table, path: pathlib.Path) -> None:
+        import pyarrow.csv
+
+        pyarrow.csv.write_csv(decode_dictionaries(table), str(path))
+
+
+class NdjsonDirectorySink(DirectorySink):
+    suffix = "ndjson"
+
+    def _write(self, table: pa.Table, path: pathlib.Path) -> None:
+        # pyarrow has no JSON writer, pandas writes one record per line.
+        to_pandas(table).to_json(path, orient="records", lines=True, date_format="iso")
+
+
+LOCAL_SINKS = {
+    "parquet": ParquetDirectorySink,
+    "csv": CsvDirectorySink,
+    "ndjson": NdjsonDirectorySink,
+    "null": NullSink,
+}
+
+
+def open_local_sink(
+    kind: str,
+    table: str,
+    directory: str | pathlib.Path | None = None,
+    parquet_settings: ParquetSettings | None = None,
+) -> Sink:
+    """
+    Return a local sink of `kind` (see LOCAL_SINKS) for `table`, writing to `directory`/`table`.
+    """
+    if kind not in LOCAL_SINKS:
+        raise ValueError(f"Unknown sink {kind}, use one of {list(LOCAL_SINKS)}")
+    if kind == "null":
+        return NullSink()
+    if directory is None:
+        raise ValueError(f"The {kind} sink needs a directory")
+    path = pathlib.Path(directory) / table
+    if kind == "parquet":
+        return ParquetDirectorySink(path, parquet_settings)
+    return LOCAL_SINKS[kind](path)
+
+
+def generate_batches(
+    number_of_rows: int,
+    chunk_size: int,
+    seed: int | None = None,
+    workers: int = 1,
+    spec: str = "fake_sales_orders",
+) -> Iterator[dict[str, pa.Table]]:
+    """
+    Generate `number_of_rows` rows in batches of `chunk_size` rows.
+    A table spec's batch is generated in shards over `workers` processes; a dataset spec's
+    batch is generated as a whole, with its tables referencing each other within the batch.
+
+    Yields:
+        dict: Table name to the batch's rows.
+    """
+    from parallel_generator import (
+        generate_shards,
+        plan_shards,
+        shard_seed,
+        DEFAULT_SHARD_SIZE,
+    )
+    from relational import get_dataset_plan, is_dataset
+    from table_spec import get_plan
+
+    seed = np.random.SeedSequence().entropy if seed is None else seed
+    now = datetime.now()
+    if is_dataset(spec):
+        dataset = get_dataset_plan(spec)
+        for batch_index, rows in plan_shards(number_of_rows, chunk_size):
+            rng = np.random.default_rng(shard_seed(seed, batch_index))
+            yield dataset.generate(rows, rng=rng, now=now)
+        return
+
+    table = get_plan(spec).table
+    shard_size = min(DEFAULT_SHARD_SIZE, chunk_size)
+    shards = plan_shards(number_of_rows, shard_size)
+    shards_per_batch = max(1, chunk_size // shard_size)
+    for start in range(0, len(shards), shards_per_batch):
+        batch = shards[start : start + shards_per_batch]
+        yield {table: generate_shards(batch, seed, now, workers=workers, spec=spec)}
+
+
+def generate_to_sinks(
+    number_of_rows: int,
+    open_sink: Callable[[str], Sink],
+    chunk_size: int = 1_000_000,
+    seed: int | None = None,
+    workers: int = 1,
+    spec: str = "fake_sales_orders",
+) -> dict:
+    """
+    Generate rows in batches and write every table's batches to its own sink.
+
+    Args:
+        number_of_rows (int): The number of rows to generate.
+        open_sink (Callable): Returns the sink for a table name, called once per table.
+        chunk_size (int, optional): Rows per batch. Memory use is bounded by one batch. Defaults to 1,000,000.
+        seed (int, optional): Makes the output reproducible. Defaults to None (random).
+        workers (int, optional): Processes to generate each batch of a table spec with. Defaults to 1.
+        spec (str, optional): The table or dataset spec to generate. Defaults to "fake_sales_orders".
+
+    Returns:
+        dict: rows, seconds and rows_per_second over all tables.
+    """
+    metrics.reset(spec=spec)
+    sinks = {}
+    rows = 0
+    start = time.perf_counter()
+    try:
+        batches = generate_batches(
+            number_of_rows, chunk_size, seed=seed, workers=workers, spec=spec
+        )
+        while True:
+            with metrics.span("generate"):
+                batch = next(batches, None)
+            if batch is None:
+                break
+            for table, data in batch.items():
+                if table not in sinks:
+                    sinks[table] = open_sink(table)
+                sinks[table].write(data)
+                rows += data.num_rows
+            metrics.add("rows", sum(data.num_rows for data in batch.values()))
+            del batch
+    finally:
+        for sink in sinks.values():
+            sink.close()
+        metrics.emit()
+    seconds = time.perf_counter() - start
+    summary = {
+        "rows": rows,
+        "seconds": round(seconds, 3),
+        "rows_per_second": round(rows / seconds, 1) if seconds else 0.0,
+    }
+    logger.info(
+        f"Generated {rows} rows in {seconds:.2f}s: {summary['rows_per_second']:.0f} rows/sec"
+    )
+    return summary
+
+
+def stage_directory(directory: str | pathlib.Path, spec: str, **connection_args) -> int:
+    """
+    Stage the parquet files a ParquetDirectorySink wrote for `spec` and register them with Snowpipe.
+    The table and pipe must exist.
+
+    Returns:
+        int: The number of files staged.
+    """
+    from fake_data_to_snowflake import spec_tables
+    from snowflake_loader import SnowflakeDataLoader
+
+    staged = 0
+    for table, pipe in spec_tables(spec).items():
+        paths = sorted(
+            str(path) for path in (pathlib.Path(directory) / table).glob("*.parquet")
+        )
+        if not paths:
+            continue
+        loader = SnowflakeDataLoader(None, table=table, pipe=pipe, **connection_args)
+        file_names = loader.upload_local_files_to_stage(paths)
+        loader.record_staged_files(file_names, uuid.uuid4().hex)
+        loader.trigger_snowpipe(file_names)
+        staged += len(file_names)
+    return staged
+
+
+def main():
+    cli_parser = argparse.ArgumentParser(
+        description="Generate fake data to local files or Snowflake, or stage generated files."
+    )
+    subparsers = cli_parser.add_subparsers(dest="command", required=True)
+
+    generate_parser = subparsers.add_parser(
+        "generate", help="Generate rows and write them to a sink."
+    )
+    generate_parser.add_argument("--rows", type=int, required=True)
+    generate_parser.add_argument(
+        "--sink", choices=[*LOCAL_SINKS, "snowflake"], default="parquet"
+    )
+    generate_parser.add_argument("--directory", default="fake_data")
+    generate_parser.add_argument("--workers", type=int, default=1)
+    generate_parser.add_argument("--chunk_size", type=int, default=1_000_000)
+    generate_parser.add_argument("--seed", type=int)
+    generate_parser.add_argument("--spec", default="fake_sales_orders")
+    generate_parser.add_argument("--compression", default="snappy")
+    generate_parser.add_argument("--compression_level", type=int)
+
+    stage_parser = subparsers.add_parser(
+        "stage",
+        help="Stage the parquet files of a directory and register them with Snowpipe.",
+    )
+    stage_parser.add_argument("--directory", default="fake_data")
+    stage_parser.add_argument("--spec", default="fake_sales_orders")
+
+    args = cli_parser.parse_args()
+    if args.command == "stage" or args.sink == "snowflake":
+        from config import config
+
+        connection_args = dict(
+            user=config.user,
+            password=config.password,
+            account=config.account,
+            database=config.database,
+            schema=config.schema,
+            role=config.role,
+            rsa_key=config.rsa_key,
+        )
+
+    if args.command == "stage":
+        staged = stage_directory(args.directory, args.spec, **connection_args)
+        print(f"Staged {staged} files")
+        return
+
+    parquet_settings = ParquetSettings(args.compression, args.compression_level)
+    if args.sink == "snowflake":
+        from fake_data_to_snowflake import spec_tables
+        from snowflake_loader import SnowflakeDataLoader
+
+        pipes = spec_tables(args.spec)
+        open_sink = lambda table: SnowflakeDataLoader(
+            None,
+            table=table,
+            pipe=pipes[table],
+            parquet_settings=parquet_settings,
+            warehouse=config.warehouse,
+            **connection_args,
+        )
+    else:
+        open_sink = lambda table: open_local_sink(
+            args.sink, table, args.directory, parquet_settings
+        )
+    summary = generate_to_sinks(
+        args.rows,
+        open_sink,
+        chunk_size=args.chunk_size,
+        seed=args.seed,
+        workers=args.workers,
+        spec=args.spec,
+    )
+    print(
+        f"{summary['rows']} rows in {summary['seconds']}s: {summary['rows_per_second']:.0f} rows/sec"
+    )
+
+
+if __name__ == "__main__":
+    main()
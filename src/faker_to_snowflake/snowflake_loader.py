@@ -1,21 +1,55 @@
-from datetime import timedelta, timezone, datetime
-import jwt
+import pyarrow as pa
+import io
 import os
-import pandas as pd
-import snowflake.connector
-import requests
-import json
-import tempfile
-from sql_api_generate_jwt import JWTGenerator
+import re
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
+import numpy as np
+from typing import Iterator, TYPE_CHECKING
+from token_provider import token_provider
 from logging_config import logger
-from snowflake.connector import connect
-from snowflake.connector.pandas_tools import write_pandas
+from metrics import metrics
+from connection_manager import connection_manager
+from metadata_cache import metadata_cache
+from stage_manifest import stage_manifest, STAGE_RETENTION_SECONDS
+from batch_checkpoints import batch_checkpoints, STAGED
+from snowpipe_client import SnowpipeClient
+from parquet_writer import (
+    ParquetSettings,
+    DEFAULT_PARQUET_SETTINGS,
+    as_arrow,
+    to_pandas,
+    write_parquet,
+)
+from file_sizing import file_sizer, FILE_SIZE_SAMPLE_ROWS
+from sinks import Sink
 
+if TYPE_CHECKING:
+    import pandas as pd
+    from snowflake.connector import SnowflakeConnection
 
-class SnowflakeDataLoader:
+# The insertFiles endpoint accepts at most 5000 files per request.
+SNOWPIPE_MAX_FILES_PER_REQUEST = 5000
+# Upper bound on concurrent PUTs, they share one Snowflake session.
+MAX_PARALLEL_PUTS = 8
+# Number of file names combined into one REMOVE ... PATTERN statement.
+REMOVE_FILES_PER_PATTERN = 500
+# Attempts to load a chunk of a stream with Snowpipe, and the wait before the first retry.
+CHUNK_LOAD_ATTEMPTS = 3
+CHUNK_RETRY_SECONDS = 1.0
+
+# Load strategies, see SnowflakeDataLoader.choose_load_strategy.
+SNOWPIPE = "snowpipe"
+WRITE_PANDAS = "write_pandas"
+
+
+class SnowflakeDataLoader(Sink):
     def __init__(
         self,
-        df: pd.DataFrame,
+        df: "pa.Table | pd.DataFrame | None",
         database: str,
         schema: str,
         user: str,
@@ -24,8 +58,18 @@ class SnowflakeDataLoader:
         role: str,
         table: str,
         rsa_key: str,
+        file_count: int | None = None,
+        snowpipe_base_url: str | None = None,
+        pipe: str | None = None,
+        parquet_settings: ParquetSettings | None = None,
+        warehouse: str | None = None,
     ):
+        # The data to load, an Arrow table or a pandas DataFrame.
+        # A table is only converted to pandas when write_pandas needs it.
         self.df = df
+        # Snowpipe loads files in parallel, so a batch is split over this many staged files.
+        # None sizes the files from the measured bytes per row, see file_sizing.py.
+        self.file_count = file_count
         self.database = database
         self.schema = schema
         self.user = user
@@ -33,29 +77,40 @@ class SnowflakeDataLoader:
         self.account = account
         self.role = role
         self.table = table
+        self.pipe = pipe or f"pipe_{table}"
+        self.parquet_settings = parquet_settings
+        # Only needed when the loader is used as a Sink, see write.
+        self.warehouse = warehouse
+        self._sink_strategy = None
         self.rsa_key = rsa_key
-        self.jwt_token = self.generate_jwt_token()
+        with metrics.span("jwt"):
+            self.jwt_token = self.generate_jwt_token()
+        self.snowpipe_client = SnowpipeClient(
+            account=self.account,
+            pipe=f"{self.database}.{self.schema}.{self.pipe.upper()}",
+            get_token=self.generate_jwt_token,
+            base_url=snowpipe_base_url,
+        )
 
     def generate_jwt_token(self):
-        logger.info("Generating JWT token")
-        jwt_generator = JWTGenerator(self.account, self.user, self.rsa_key)
-        jwt_token = jwt_generator.get_token()
+        """
+        Return a JWT for the Snowpipe API from the process-wide token cache,
+        which only re-signs the token when it is due for renewal.
+        """
+        jwt_token = token_provider.get_token(self.account, self.user, self.rsa_key)
         if not jwt_token:
             raise ValueError(
                 "The JWT token could not be generated. Please check the private key and payload details."
             )
         return jwt_token
 
-    def upload_dataframe_to_stage(self):
-        stage_name = f"%{self.table}"
-        logger.info(f"Uploading data to Snowflake stage: {stage_name}")
-        with tempfile.NamedTemporaryFile(
-            suffix=".parquet", delete=False
-        ) as temp_parquet:
-            self.df.to_parquet(temp_parquet.name, index=False)
-            temp_parquet_path = temp_parquet.name
-
-        conn = snowflake.connector.connect(
+    def get_connection(self) -> "SnowflakeConnection":
+        """
+        Return the process-wide Snowflake session, see connection_manager.py.
+        The warehouse is not part of the session, so the same session serves the
+        Snowpipe path (no warehouse) and write_pandas (USE WAREHOUSE first).
+        """
+        return connection_manager.get_connection(
             account=self.account,
             user=self.user,
             password=self.password,
@@ -64,72 +119,447 @@ class SnowflakeDataLoader:
             role=self.role,
         )
 
+    @property
+    def metadata_key(self) -> str:
+        return f"{self.account}/{self.database}.{self.schema}.{self.table}".upper()
+
+    def get_load_metadata(self) -> dict:
+        """
+        Return whether the table and its pipe exist, as {"table_exists": bool, "pipe_exists": bool}.
+        The answer comes from the metadata cache when it is fresh, otherwise from
+        SHOW TABLES and SHOW PIPES, which need no warehouse.
+        """
+        metadata = metadata_cache.get(self.metadata_key)
+        if metadata is not None:
+            return metadata
+        scope = f"IN SCHEMA {self.database}.{self.schema}"
+        conn = self.get_connection()
+        with metrics.span("show_metadata"), conn.cursor() as cursor:
+            tables = cursor.execute(f"SHOW TABLES LIKE '{self.table}' {scope}")
+            table_exists = bool(tables.fetchall())
+            pipes = cursor.execute(f"SHOW PIPES LIKE '{self.pipe}' {scope}")
+            pipe_exists = bool(pipes.fetchall())
+        logger.info(
+            f"Table {self.table} exists: {table_exists}, pipe {self.pipe} exists: {pipe_exists}"
+        )
+        return metadata_cache.set(
+            self.metadata_key, table_exists=table_exists, pipe_exists=pipe_exists
+        )
+
+    def forget_load_metadata(self) -> None:
+        """
+        Drop the cached metadata, so the next run checks the table and pipe again.
+        """
+        metadata_cache.invalidate(self.metadata_key)
+
+    def create_pipe(self) -> None:
+        """
+        Create the pipe that copies the table stage's parquet files into the table.
+        """
+        qualified_table = f"{self.database}.{self.schema}.{self.table}"
+        logger.info(f"Creating pipe {self.pipe}")
+        conn = self.get_connection()
+        with metrics.span("create_pipe"), conn.cursor() as cursor:
+            cursor.execute(
+                f"CREATE PIPE IF NOT EXISTS {self.database}.{self.schema}.{self.pipe} AS "
+                f"COPY INTO {qualified_table} FROM @{self.database}.{self.schema}.%{self.table} "
+                f"FILE_FORMAT = (TYPE = PARQUET) MATCH_BY_COLUMN_NAME = CASE_INSENSITIVE"
+            )
+
+    def ensure_pipe(self) -> bool:
+        """
+        Make sure the pipe exists, creating it if the table exists and the pipe does not.
+        A failed CREATE PIPE (e.g. missing privileges) is remembered, and not retried until
+        the metadata expires.
+
+        Returns:
+            bool: True if the pipe exists.
+        """
+        metadata = self.get_load_metadata()
+        if metadata.get("pipe_exists"):
+            return True
+        if not metadata.get("table_exists") or not metadata.get(
+            "can_create_pipe", True
+        ):
+            return False
         try:
-            cursor = conn.cursor()
-            cursor.execute(f"PUT file://{temp_parquet_path} @{stage_name}")
+            self.create_pipe()
+        except Exception as e:
+            logger.error(f"Could not create pipe {self.pipe}. Error: {e}")
+            metadata_cache.set(self.metadata_key, can_create_pipe=False)
+            return False
+        metadata_cache.set(self.metadata_key, pipe_exists=True)
+        return True
+
+    def choose_load_strategy(self) -> str:
+        """
+        Return SNOWPIPE if the table and its pipe exist (creating the pipe if only the table does),
+        otherwise WRITE_PANDAS, which creates the table.
+        """
+        metadata = self.get_load_metadata()
+        strategy = (
+            SNOWPIPE
+            if metadata.get("table_exists") and self.ensure_pipe()
+            else WRITE_PANDAS
+        )
+        logger.info(f"Load strategy: {strategy}")
+        return strategy
+
+    def upload_dataframe_to_stage(self, df: "pa.Table | pd.DataFrame | None" = None):
+        df = self.df if df is None else df
+        stage_name = f"%{self.table}"
+        logger.info(f"Uploading data to Snowflake stage: {stage_name}")
+        # The parquet file is built in memory and streamed to the stage,
+        # so nothing is written to the Lambda's ephemeral storage.
+        buffer = io.BytesIO()
+        with metrics.span("to_parquet"):
+            write_parquet(as_arrow(df), buffer, self.parquet_settings)
+        size = buffer.getbuffer().nbytes
+        metrics.add("staged_bytes", size)
+        file_sizer.observe(self.file_size_key, len(df), size)
+        buffer.seek(0)
+        file_name = f"{uuid.uuid4().hex}.parquet"
+        logger.info(f"Staging {file_name}: {len(df)} rows, {size / 2**20:.2f} MB")
+
+        # The connection is fetched first, so a reconnect is timed as connect, not as put.
+        conn = self.get_connection()
+        with metrics.span("put"), conn.cursor() as cursor:
+            cursor.execute(f"PUT file://{file_name} @{stage_name}", file_stream=buffer)
             logger.info(f"File successfully uploaded to stage: {stage_name}")
-        finally:
-            cursor.close()
-            conn.close()
+        metrics.add("staged_files", 1)
 
-        file_name = os.path.basename(temp_parquet_path)
-        os.remove(temp_parquet_path)
         return file_name
 
-    def trigger_snowpipe(self, file_name: str):
-        snowpipe_name = f"pipe_{self.table}".upper()
-        url = f"https://{self.account}.snowflakecomputing.com/v1/data/pipes/{self.database}.{self.schema}.{snowpipe_name}/insertFiles"
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {self.jwt_token}",
-            "X-Snowflake-Authorization-Token-Type": "KEYPAIR_JWT",
-        }
-        payload = {"files": [{"path": file_name}]}
-        logger.info(f"Triggering Snowpipe: {url}")
-        logger.info(f"Payload: {payload}")
-
-        response = requests.post(url, headers=headers, data=json.dumps(payload))
-        if response.status_code == 200:
-            logger.info(f"response: {response.text}")
-            logger.info("Data successfully loaded to table using Snowpipe.")
-        else:
-            logger.info(
-                f"Failed to trigger Snowpipe. Status code: {response.status_code}, Response: {response.text}"
+    @property
+    def file_size_key(self) -> str:
+        # Bytes per row depend on the table and on how the parquet files are written.
+        return (
+            f"{self.metadata_key}/{self.parquet_settings or DEFAULT_PARQUET_SETTINGS}"
+        )
+
+    def choose_file_count(self, df: "pa.Table | pd.DataFrame") -> int:
+        """
+        Return the number of files that brings the staged files closest to the target size.
+        Without an estimate for the table yet, the first FILE_SIZE_SAMPLE_ROWS rows are
+        written to memory once to measure bytes per row.
+        """
+        if file_sizer.bytes_per_row(self.file_size_key) is None and len(df):
+            sample = as_arrow(df).slice(0, FILE_SIZE_SAMPLE_ROWS)
+            buffer = io.BytesIO()
+            with metrics.span("to_parquet"):
+                write_parquet(sample, buffer, self.parquet_settings)
+            file_sizer.observe(
+                self.file_size_key, len(sample), buffer.getbuffer().nbytes
             )
-            raise ValueError("Failed to trigger Snowpipe.")
+        return file_sizer.file_count(self.file_size_key, len(df))
 
-    def clean_table_stage(self):
+    def upload_files_to_stage(
+        self, df: "pa.Table | pd.DataFrame | None" = None, file_count: int | None = None
+    ) -> list[str]:
+        """
+        Split the data into `file_count` parquet files of roughly equal row counts
+        and PUT them to the table stage concurrently.
+
+        Args:
+            df (pyarrow.Table or pandas.DataFrame, optional): The data to stage. Defaults to self.df.
+            file_count (int, optional): The number of files. Defaults to self.file_count,
+                or if that is None, to the count that hits the target file size.
+
+        Returns:
+            list[str]: The staged file names, in row order.
+        """
+        df = self.df if df is None else df
+        file_count = file_count or self.file_count or self.choose_file_count(df)
+        file_count = max(1, min(file_count, len(df)))
+        if file_count == 1:
+            return [self.upload_dataframe_to_stage(df)]
+
+        # Slices of an Arrow table share its buffers, nothing is copied.
+        df = as_arrow(df)
+        bounds = np.linspace(0, len(df), file_count + 1, dtype=int)
+        parts = [
+            df.slice(start, stop - start)
+            for start, stop in zip(bounds[:-1], bounds[1:])
+        ]
+        logger.info(f"Uploading {len(df)} rows as {file_count} files")
+        # to_parquet and put add up over the threads, stage_files is the wall clock time.
+        with (
+            metrics.span("stage_files"),
+            ThreadPoolExecutor(
+                max_workers=min(file_count, MAX_PARALLEL_PUTS)
+            ) as executor,
+        ):
+            return list(executor.map(self.upload_dataframe_to_stage, parts))
+
+    def upload_local_files_to_stage(self, paths: list[str]) -> list[str]:
+        """
+        PUT parquet files from local disk, e.g. written by a ParquetDirectorySink, to the table stage.
+
+        Returns:
+            list[str]: The staged file names.
+        """
         stage_name = f"%{self.table}"
-        logger.info(f"Removing files from stage: {stage_name}")
-        conn = snowflake.connector.connect(
-            account=self.account,
-            user=self.user,
-            password=self.password,
-            database=self.database,
-            schema=self.schema,
-            role=self.role,
+        logger.info(f"Uploading {len(paths)} local files to stage: {stage_name}")
+        conn = self.get_connection()
+        with metrics.span("put"), conn.cursor() as cursor:
+            for path in paths:
+                cursor.execute(
+                    f"PUT file://{path} @{stage_name} PARALLEL={MAX_PARALLEL_PUTS}"
+                )
+        metrics.add("staged_files", len(paths))
+        metrics.add("staged_bytes", sum(os.path.getsize(path) for path in paths))
+        return [os.path.basename(path) for path in paths]
+
+    def trigger_snowpipe(self, file_names: str | list[str]):
+        """
+        Register staged files with the table's pipe.
+        All files are sent in as few insertFiles requests as the per-request file limit allows.
+        """
+        if isinstance(file_names, str):
+            file_names = [file_names]
+        for start in range(0, len(file_names), SNOWPIPE_MAX_FILES_PER_REQUEST):
+            with metrics.span("insert_files"):
+                self.snowpipe_client.insert_files(
+                    file_names[start : start + SNOWPIPE_MAX_FILES_PER_REQUEST]
+                )
+        logger.info("Data successfully loaded to table using Snowpipe.")
+
+    def register_staged_files(self, file_names: list[str], batch_id: str) -> None:
+        """
+        Register the files of a batch with the pipe, skipping those its checkpoint lists as
+        registered, and checkpoint every insertFiles request that succeeds.
+        Sending a file twice is harmless too: Snowpipe skips files it has loaded before.
+        """
+        registered = set(
+            batch_checkpoints.get(batch_id, self.table).get("registered", [])
         )
+        pending = [name for name in file_names if name not in registered]
+        for start in range(0, len(pending), SNOWPIPE_MAX_FILES_PER_REQUEST):
+            names = pending[start : start + SNOWPIPE_MAX_FILES_PER_REQUEST]
+            self.trigger_snowpipe(names)
+            batch_checkpoints.mark_registered(batch_id, self.table, names)
+
+    def remove_staged_files(self, file_names: list[str]) -> None:
+        """
+        Remove only the given files from the table stage, using REMOVE with a PATTERN.
+        """
+        stage_name = f"%{self.table}"
+        logger.info(f"Removing {len(file_names)} files from stage: {stage_name}")
+        conn = self.get_connection()
+        with metrics.span("remove"), conn.cursor() as cursor:
+            for start in range(0, len(file_names), REMOVE_FILES_PER_PATTERN):
+                names = file_names[start : start + REMOVE_FILES_PER_PATTERN]
+                pattern = "|".join(re.escape(name) for name in names)
+                # PATTERN is a string literal, in which a backslash escapes the next
+                # character: double them, or \. would reach the regex engine as any character.
+                pattern = pattern.replace("\\", "\\\\").replace("'", "\\'")
+                cursor.execute(f"REMOVE @{stage_name} PATTERN='.*({pattern})'")
+        metrics.add("removed_files", len(file_names))
+
+    def record_staged_files(self, file_names: list[str], batch_id: str) -> None:
+        stage_manifest.record(self.metadata_key, file_names, batch_id)
+
+    def confirm_loaded_files(self) -> None:
+        """
+        Mark the files of the manifest that Snowpipe's load history reports as loaded.
+        One loadHistoryScan request, from the time the oldest pending file was staged.
+        """
+        pending = {
+            name: entry
+            for name, entry in stage_manifest.files(self.metadata_key).items()
+            if not entry["loaded"]
+        }
+        if not pending:
+            return
+        start_time = datetime.fromtimestamp(
+            min(entry["staged_at"] for entry in pending.values()), tz=timezone.utc
+        )
+        with metrics.span("load_history"):
+            history = self.snowpipe_client.load_history_scan(start_time)
+        loaded = [
+            file["path"]
+            for file in history.get("files", [])
+            if file.get("path") in pending and file.get("status") == "LOADED"
+        ]
+        stage_manifest.mark_loaded(self.metadata_key, loaded)
+
+    def cleanup_stage(
+        self, retention_seconds: float = STAGE_RETENTION_SECONDS
+    ) -> list[str]:
+        """
+        Remove the staged files of the manifest that Snowpipe loaded or that are older than
+        `retention_seconds`. Files still waiting to be loaded are left alone, and files this
+        process did not stage are not touched, see sweep_stage for those.
+
+        Returns:
+            list[str]: The removed file names.
+        """
         try:
-            cursor = conn.cursor()
-            cursor.execute(f"REMOVE @{stage_name}")
-            logger.info(f"Stage {stage_name} cleaned.")
-        finally:
-            cursor.close()
-            conn.close()
+            self.confirm_loaded_files()
+        except Exception as e:
+            logger.error(
+                f"Could not read the load history, only expired files are removed. Error: {e}"
+            )
+        file_names = stage_manifest.due_for_removal(
+            self.metadata_key, retention_seconds
+        )
+        if file_names:
+            self.remove_staged_files(file_names)
+            stage_manifest.forget(self.metadata_key, file_names)
+        return file_names
 
-    def load_using_snowpipe(self):
+    def sweep_stage(
+        self, retention_seconds: float = STAGE_RETENTION_SECONDS
+    ) -> list[str]:
         """
-        Step 1: clean up old files in the stage
-          unfortunately, we cannot do this as the last step because it is possible to delete a file before snowpipe processes it
-          I do not want to add "wait" or checking logic.
-        Step 2: upload the dataframe to the stage
-        Step 3: trigger the snowpipe
+        Remove every file in the table stage older than `retention_seconds`, whoever staged it.
+        Lambda containers each have their own manifest, so files of containers that were
+        shut down are only found by listing the stage. Meant for a scheduled run.
+
+        Returns:
+            list[str]: The removed file names.
         """
-        self.clean_table_stage()
-        file_name = self.upload_dataframe_to_stage()
-        self.trigger_snowpipe(file_name)
+        stage_name = f"%{self.table}"
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=retention_seconds)
+        conn = self.get_connection()
+        with metrics.span("list_stage"), conn.cursor() as cursor:
+            cursor.execute(f"LIST @{stage_name}")
+            # Rows are (name, size, md5, last_modified).
+            rows = cursor.fetchall()
+        file_names = [
+            row[0].rsplit("/", 1)[-1]
+            for row in rows
+            if parsedate_to_datetime(row[3]) < cutoff
+        ]
+        if file_names:
+            self.remove_staged_files(file_names)
+            stage_manifest.forget(self.metadata_key, file_names)
+        logger.info(
+            f"Swept {len(file_names)} of {len(rows)} files from stage: {stage_name}"
+        )
+        return file_names
+
+    def load_using_snowpipe(
+        self, confirm_load: bool = False, batch_id: str | None = None
+    ):
+        """
+        Step 1: upload the dataframe to the stage, split into self.file_count files,
+          and record the files in the stage manifest
+        Step 2: trigger the snowpipe, with one request for all files
+
+        Both steps are checkpointed under `batch_id`, see batch_checkpoints.py. Run again with
+        the same batch id after a failed registration, the staged files are reused and only
+        the files not registered yet are sent.
+
+        The stage is not emptied first: a REMOVE of the whole stage gets slower as the stage
+        fills up and can delete files Snowpipe has not ingested yet. Staged files are removed
+        by cleanup_stage once they are loaded, after the load or in a scheduled run.
+
+        With confirm_load, the loader waits for the insertReport and then removes the files
+        that finished loading right away.
+        """
+        batch_id = batch_id or uuid.uuid4().hex
+        checkpoint = batch_checkpoints.get(batch_id, self.table)
+        if checkpoint.get("step") == STAGED:
+            # An earlier attempt of the batch staged the files, only the registration is left.
+            file_names = checkpoint["files"]
+            logger.info(f"Batch {batch_id}: reusing {len(file_names)} staged files")
+            metrics.add("reused_files", len(file_names))
+        else:
+            file_names = self.upload_files_to_stage()
+            self.record_staged_files(file_names, batch_id)
+            batch_checkpoints.mark_staged(batch_id, self.table, file_names)
+        self.register_staged_files(file_names, batch_id)
+        batch_checkpoints.mark_loaded(batch_id, self.table)
+        if confirm_load:
+            with metrics.span("wait_for_load"):
+                statuses = self.snowpipe_client.wait_for_load(file_names)
+            loaded = [name for name, status in statuses.items() if status == "LOADED"]
+            if loaded:
+                stage_manifest.mark_loaded(self.metadata_key, loaded)
+                self.remove_staged_files(loaded)
+                stage_manifest.forget(self.metadata_key, loaded)
+            if len(loaded) < len(file_names):
+                # Files still loading are left in the stage, a later cleanup removes them.
+                logger.error(
+                    f"Snowpipe did not confirm {len(file_names) - len(loaded)} of {len(file_names)} files."
+                )
+
+    def load_chunk_using_snowpipe(
+        self,
+        chunk: "pa.Table | pd.DataFrame",
+        batch_id: str,
+        attempts: int | None = None,
+        retry_seconds: float | None = None,
+        checkpoint: tuple[str, str] | None = None,
+    ) -> None:
+        """
+        Streaming version of load_using_snowpipe, for one chunk: upload it as its own file,
+        or several if it is larger than the target file size, record the files with `batch_id`
+        and register them with the pipe.
+        A failed attempt is retried after `retry_seconds`, doubling every time. Files staged
+        by a failed attempt are registered by the next one, not uploaded again.
+
+        Args:
+            chunk (pyarrow.Table or pandas.DataFrame): The chunk to load.
+            batch_id (str): The chunk's batch id in the stage manifest.
+            attempts (int, optional): Defaults to CHUNK_LOAD_ATTEMPTS.
+            retry_seconds (float, optional): Defaults to CHUNK_RETRY_SECONDS.
+            checkpoint (tuple, optional): The batch id and table entry the staged files are
+                checkpointed under, see batch_checkpoints.py. Files a failed run of the batch
+                staged are registered instead of uploaded again. Defaults to None, not checkpointed.
 
-    def load_using_write_pandas(self, warehouse: str) -> None:
+        Raises:
+            Exception: What the last attempt raised.
+        """
+        attempts = attempts or CHUNK_LOAD_ATTEMPTS
+        retry_seconds = CHUNK_RETRY_SECONDS if retry_seconds is None else retry_seconds
+        file_names = None
+        staged = batch_checkpoints.get(*checkpoint) if checkpoint else {}
+        if staged.get("step") == STAGED:
+            file_names = staged["files"]
+            logger.info(f"Chunk {batch_id}: reusing {len(file_names)} staged files")
+            metrics.add("reused_files", len(file_names))
+        for attempt in range(1, attempts + 1):
+            try:
+                if file_names is None:
+                    file_names = self.upload_files_to_stage(chunk)
+                    self.record_staged_files(file_names, batch_id)
+                    if checkpoint:
+                        batch_checkpoints.mark_staged(*checkpoint, file_names)
+                self.trigger_snowpipe(file_names)
+                logger.info(f"Chunk {batch_id} ({len(chunk)} rows) loaded")
+                return
+            except Exception as e:
+                if attempt == attempts:
+                    raise
+                delay = retry_seconds * 2 ** (attempt - 1)
+                logger.error(
+                    f"Attempt {attempt} of {attempts} to load chunk {batch_id} failed, "
+                    f"retrying in {delay:g}s. Error: {e}"
+                )
+                metrics.add("chunk_retries", 1)
+                time.sleep(delay)
+
+    def write(self, table: "pa.Table | pd.DataFrame") -> None:
+        """
+        Sink interface: load one batch. The first batch chooses the strategy: Snowpipe if
+        the table and pipe exist, otherwise write_pandas, which creates the table, after
+        which the pipe is created and the following batches use Snowpipe.
+        """
+        if self._sink_strategy is None:
+            self._sink_strategy = self.choose_load_strategy()
+        if self._sink_strategy == WRITE_PANDAS:
+            self.load_using_write_pandas(warehouse=self.warehouse, df=table)
+            self._sink_strategy = SNOWPIPE if self.ensure_pipe() else WRITE_PANDAS
+            return
+        file_names = self.upload_files_to_stage(table)
+        self.record_staged_files(file_names, uuid.uuid4().hex)
+        self.trigger_snowpipe(file_names)
+
+    def load_using_write_pandas(
+        self, warehouse: str, df: "pa.Table | pd.DataFrame | None" = None
+    ) -> None:
         """
         Uploads the given DataFrame to Snowflake.
         This is an extremely simple way to load data so Snowflake, but it can be expensive if you run it frequently.
@@ -138,30 +568,33 @@ class SnowflakeDataLoader:
         In our scenario, if the table does not exist (snowpipe fails), we run this one.
 
         Args:
-            df (pandas.DataFrame): The DataFrame to be uploaded.
+            warehouse (str): The warehouse used by the COPY command.
+            df (pyarrow.Table or pandas.DataFrame, optional): The data to be uploaded. Defaults to self.df.
+                An Arrow table is converted to pandas here, the only place a DataFrame is needed.
 
         Returns:
             None
         """
+        df = self.df if df is None else df
+        with metrics.span("to_pandas"):
+            df = to_pandas(df)
         # Load the environment variables from dotenv file if it exists
         logger.info("Uploading DateFrame to Snowflake using write_pandas")
+        # Only imported when the fallback actually runs.
+        from snowflake.connector.pandas_tools import write_pandas
 
-        conn = connect(
-            user=self.user,
-            password=self.password,
-            account=self.account,
-            warehouse=warehouse,
-            database=self.database,
-            schema=self.schema,
-            role=self.role,
-        )
-        # Use the write_pandas method for efficient data upload
-        write_pandas(
-            conn,
-            self.df,
-            "fake_sales_orders",
-            auto_create_table=True,
-            quote_identifiers=False,
-        )
-        conn.close()
+        conn = self.get_connection()
+        with metrics.span("write_pandas"):
+            with conn.cursor() as cursor:
+                cursor.execute(f"USE WAREHOUSE {warehouse}")
+            # Use the write_pandas method for efficient data upload
+            write_pandas(
+                conn,
+                df,
+                self.table,
+                auto_create_table=True,
+                quote_identifiers=False,
+            )
+        # auto_create_table created the table if it was missing.
+        metadata_cache.set(self.metadata_key, table_exists=True)
         logger.info("write_pandas complete.")
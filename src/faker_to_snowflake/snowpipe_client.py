@@ -0,0 +1,200 @@
+import os
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Callable, TYPE_CHECKING
+from logging_config import logger
+
+if TYPE_CHECKING:
+    import requests
+
+# Statuses worth retrying: throttling and transient server errors.
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+# insertReport statuses after which a file will not change anymore.
+FINAL_LOAD_STATUSES = ("LOADED", "LOAD_FAILED", "PARTIALLY_LOADED")
+
+_session = None
+
+
+def get_session(
+    max_retries: int = 5, backoff_factor: float = 0.5
+) -> "requests.Session":
+    """
+    Return the process-wide HTTP session. Keeping it at module level means warm
+    Lambda invocations reuse the pooled keep-alive connections to Snowflake.
+    Requests that fail with a status in RETRY_STATUS_CODES are retried with exponential backoff.
+    """
+    global _session
+    if _session is None:
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        retry = Retry(
+            total=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=RETRY_STATUS_CODES,
+            # insertFiles is safe to retry, Snowpipe skips files it has already loaded.
+            allowed_methods=frozenset({"GET", "POST"}),
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=retry)
+        _session = requests.Session()
+        _session.mount("https://", adapter)
+        _session.mount("http://", adapter)
+    return _session
+
+
+class SnowpipeClient:
+    """
+    Client for the Snowpipe REST API: insertFiles, insertReport and loadHistoryScan.
+    """
+
+    def __init__(
+        self,
+        account: str,
+        pipe: str,
+        get_token: Callable[[], str],
+        base_url: str | None = None,
+        timeout: float = 30,
+    ):
+        """
+        Args:
+            account (str): The Snowflake account identifier.
+            pipe (str): The fully qualified pipe name, database.schema.pipe.
+            get_token (Callable): Returns a valid key pair JWT, called before every request.
+            base_url (str, optional): Overrides https://<account>.snowflakecomputing.com, e.g. for a local stand-in.
+                Defaults to the SNOWPIPE_BASE_URL environment variable, if set.
+            timeout (float, optional): Timeout of every HTTP request in seconds. Defaults to 30.
+        """
+        self.pipe = pipe
+        self.get_token = get_token
+        self.base_url = (
+            base_url
+            or os.getenv("SNOWPIPE_BASE_URL")
+            or f"https://{account}.snowflakecomputing.com"
+        ).rstrip("/")
+        self.timeout = timeout
+        self.session = get_session()
+
+    def _url(self, endpoint: str) -> str:
+        return f"{self.base_url}/v1/data/pipes/{self.pipe}/{endpoint}"
+
+    def _headers(self) -> dict:
+        return {
+            "Content-Type": "application/json",
+            "Accept": "application/json",
+            "Authorization": f"Bearer {self.get_token()}",
+            "X-Snowflake-Authorization-Token-Type": "KEYPAIR_JWT",
+        }
+
+    def insert_files(self, file_names: list[str]) -> dict:
+        """
+        Register staged files with the pipe.
+
+        Returns:
+            dict: The response body.
+
+        Raises:
+            ValueError: If Snowpipe still answers with an error after the retries.
+        """
+        url = self._url("insertFiles")
+        logger.info(f"Triggering Snowpipe: {url}")
+        logger.info(f"Registering {len(file_names)} files")
+        response = self.session.post(
+            url,
+            params={"requestId": str(uuid.uuid4())},
+            headers=self._headers(),
+            json={"files": [{"path": file_name} for file_name in file_names]},
+            timeout=self.timeout,
+        )
+        if response.status_code != 200:
+            logger.info(
+                f"Failed to trigger Snowpipe. Status code: {response.status_code}, Response: {response.text}"
+            )
+            raise ValueError("Failed to trigger Snowpipe.")
+        logger.info(f"response: {response.text}")
+        return response.json()
+
+    def _get(self, endpoint: str, params: dict) -> dict:
+        response = self.session.get(
+            self._url(endpoint),
+            params=params,
+            headers=self._headers(),
+            timeout=self.timeout,
+        )
+        if response.status_code != 200:
+            raise ValueError(
+                f"Snowpipe {endpoint} failed. Status code: {response.status_code}, Response: {response.text}"
+            )
+        return response.json()
+
+    def insert_report(self, begin_mark: str | None = None) -> dict:
+        """
+        Return the load events of the pipe from roughly the last 10 minutes.
+        Pass the `nextBeginMark` of the previous report to only get newer events.
+        """
+        params = {"requestId": str(uuid.uuid4())}
+        if begin_mark:
+            params["beginMark"] = begin_mark
+        return self._get("insertReport", params)
+
+    def load_history_scan(
+        self, start_time: datetime, end_time: datetime | None = None
+    ) -> dict:
+        """
+        Return the load history of the pipe between two points in time.
+        Use this instead of insert_report for loads older than 10 minutes.
+        """
+        params = {
+            "requestId": str(uuid.uuid4()),
+            "startTimeInclusive": start_time.astimezone(timezone.utc).isoformat(),
+        }
+        if end_time:
+            params["endTimeExclusive"] = end_time.astimezone(timezone.utc).isoformat()
+        return self._get("loadHistoryScan", params)
+
+    def wait_for_load(
+        self,
+        file_names: list[str],
+        timeout: float = 300,
+        poll_interval: float = 2,
+        max_poll_interval: float = 30,
+    ) -> dict[str, str]:
+        """
+        Poll insertReport until every file reached a final status or `timeout` seconds passed.
+        The poll interval doubles after every poll that brings no news, up to `max_poll_interval`.
+
+        Returns:
+            dict: File name to final status (LOADED, LOAD_FAILED or PARTIALLY_LOADED),
+                for the files that reached one. Files still loading are left out.
+        """
+        pending = set(file_names)
+        statuses = {}
+        begin_mark = None
+        deadline = time.monotonic() + timeout
+        while pending and time.monotonic() < deadline:
+            report = self.insert_report(begin_mark)
+            begin_mark = report.get("nextBeginMark", begin_mark)
+            finished = {
+                file["path"]: file["status"]
+                for file in report.get("files", [])
+                if file.get("path") in pending
+                and file.get("status") in FINAL_LOAD_STATUSES
+            }
+            statuses.update(finished)
+            pending -= finished.keys()
+            if not pending:
+                break
+            poll_interval = (
+                poll_interval if finished else min(poll_interval * 2, max_poll_interval)
+            )
+            time.sleep(min(poll_interval, max(deadline - time.monotonic(), 0)))
+
+        failed = [name for name, status in statuses.items() if status != "LOADED"]
+        logger.info(
+            f"Snowpipe load report: {len(statuses) - len(failed)} loaded, "
+            f"{len(failed)} failed, {len(pending)} still pending"
+        )
+        return statuses
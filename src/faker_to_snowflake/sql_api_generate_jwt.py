@@ -82,6 +82,8 @@ class JWTGenerator(object):
         # self.private_key_file_path = private_key_file_path
         self.renew_time = datetime.now(timezone.utc)
         self.token = None
+        # Calculated on the first token, then reused for every renewal.
+        self.public_key_fp = None
 
         # # Load the private key from the specified file.
         # with open(self.private_key_file_path, "rb") as pem_in:
@@ -148,7 +150,11 @@ class JWTGenerator(object):
 
             # Prepare the fields for the payload.
             # Generate the public key fingerprint for the issuer in the payload.
-            public_key_fp = self.calculate_public_key_fingerprint(self.private_key)
+            if self.public_key_fp is None:
+                self.public_key_fp = self.calculate_public_key_fingerprint(
+                    self.private_key
+                )
+            public_key_fp = self.public_key_fp
 
             # Create our payload
             payload = {
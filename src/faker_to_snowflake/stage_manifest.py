@@ -0,0 +1,81 @@
+import os
+import time
+from json_state import locked_update, read_json
+
+# Where the staged files are recorded between warm invocations.
+STAGE_MANIFEST_PATH = os.getenv("STAGE_MANIFEST_PATH", "/tmp/stage_manifest.json")
+# Staged files not confirmed as loaded are removed once they are this old.
+STAGE_RETENTION_SECONDS = float(os.getenv("STAGE_RETENTION_SECONDS", 24 * 3600))
+
+
+class StageManifest:
+    """
+    The files the processes of this container staged and have not removed yet, per table
+    stage, with the time they were staged, their batch id and whether Snowpipe confirmed the load.
+
+    Cleanup removes only the files in the manifest that are loaded or past the retention
+    window, instead of emptying the whole stage before every load, which is slow on a full
+    stage and can remove files Snowpipe has not ingested yet.
+    The manifest is kept in a JSON file in /tmp, like the metadata cache, see json_state.py.
+    """
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path (str): The JSON file the manifest is persisted in.
+        """
+        self.path = path
+
+    def record(self, stage: str, file_names: list[str], batch_id: str) -> None:
+        """
+        Record files just staged to `stage` as one batch.
+        """
+        staged_at = time.time()
+        with locked_update(self.path, "stage manifest") as stages:
+            files = stages.setdefault(stage, {})
+            for file_name in file_names:
+                files[file_name] = {
+                    "staged_at": staged_at,
+                    "batch_id": batch_id,
+                    "loaded": False,
+                }
+
+    def mark_loaded(self, stage: str, file_names: list[str]) -> None:
+        with locked_update(self.path, "stage manifest") as stages:
+            files = stages.get(stage, {})
+            for file_name in file_names:
+                if file_name in files:
+                    files[file_name]["loaded"] = True
+
+    def files(self, stage: str) -> dict[str, dict]:
+        """
+        Return file name to entry for the files recorded for `stage`.
+        """
+        return read_json(self.path, "stage manifest").get(stage, {})
+
+    def due_for_removal(
+        self, stage: str, retention_seconds: float, now: float | None = None
+    ) -> list[str]:
+        """
+        Return the files of `stage` that are confirmed loaded or older than `retention_seconds`.
+        """
+        now = time.time() if now is None else now
+        return [
+            name
+            for name, entry in self.files(stage).items()
+            if entry["loaded"] or now - entry["staged_at"] > retention_seconds
+        ]
+
+    def forget(self, stage: str, file_names: list[str]) -> None:
+        """
+        Drop removed files from the manifest.
+        """
+        with locked_update(self.path, "stage manifest") as stages:
+            files = stages.get(stage, {})
+            for file_name in file_names:
+                files.pop(file_name, None)
+            if not files:
+                stages.pop(stage, None)
+
+
+stage_manifest = StageManifest(STAGE_MANIFEST_PATH)
@@ -0,0 +1,279 @@
+# Continuous streaming mode, run outside Lambda:
+#   python stream_daemon.py --rows_per_second 5000 --batch_rows 10000 --duration 3600
+
+import argparse
+import queue
+import threading
+import time
+from datetime import datetime
+from typing import Iterator
+import numpy as np
+import pyarrow as pa
+from logging_config import logger
+from metrics import metrics
+from parallel_generator import generate_shard
+from table_spec import get_plan, DEFAULT_SPEC
+from parquet_writer import ParquetSettings
+from fake_data_to_snowflake import data_chunks_to_snowflake, clean_up_stages
+
+# Marks the end of the stream in the batch queue.
+_END_OF_STREAM = None
+
+
+class StreamDaemon:
+    """
+    Produces micro-batches at a target rate and loads them with Snowpipe, continuously.
+
+    A producer thread generates batch N+1 while the main thread uploads and registers batch N.
+    The batches are handed over through a bounded queue: when uploads fall behind, the producer
+    blocks on the full queue instead of piling batches up in memory.
+    """
+
+    def __init__(
+        self,
+        rows_per_second: float,
+        batch_rows: int,
+        queue_size: int = 4,
+        seed: int | None = None,
+        spec: str = DEFAULT_SPEC,
+        duration: float | None = None,
+        report_interval: float = 10,
+        cleanup_interval: float = 600,
+    ):
+        """
+        Args:
+            rows_per_second (float): The target rate.
+            batch_rows (int): The number of rows per micro-batch, i.e. per staged file.
+            queue_size (int, optional): The number of generated batches that may wait for upload. Defaults to 4.
+            seed (int, optional): Makes the generated data reproducible. Defaults to None (random).
+            spec (str, optional): The name of the table spec to generate. Defaults to DEFAULT_SPEC.
+            duration (float, optional): Stop after this many seconds. Defaults to None (run until interrupted).
+            report_interval (float, optional): Seconds between rate reports. Defaults to 10.
+            cleanup_interval (float, optional): Seconds between removals of the loaded files from the stage.
+                Defaults to 600.
+        """
+        self.rows_per_second = rows_per_second
+        self.batch_rows = batch_rows
+        self.seed = np.random.SeedSequence().entropy if seed is None else seed
+        self.spec = spec
+        self.duration = duration
+        self.report_interval = report_interval
+        self.cleanup_interval = cleanup_interval
+        self.batches = queue.Queue(maxsize=queue_size)
+        self.stopping = threading.Event()
+        self.loader_done = threading.Event()
+        self.generated_rows = 0
+        self.uploaded_rows = 0
+        self.started = None
+        # The exception that stopped the producer, raised by run() once the loader is done.
+        self.error = None
+
+    def stop(self) -> None:
+        self.stopping.set()
+
+    def _produce(self) -> None:
+        """
+        Generate a batch every batch_rows / rows_per_second seconds. If generating or
+        waiting for queue space takes longer, the next batch starts right away and the
+        achieved rate drops below the target. If generating fails, the stream stops and
+        run() raises the exception.
+        """
+        batch_interval = self.batch_rows / self.rows_per_second
+        batch_index = 0
+        try:
+            while not self.stopping.is_set():
+                due = self.started + batch_index * batch_interval
+                if self.stopping.wait(max(0.0, due - time.monotonic())):
+                    break
+                # Batches are seeded like shards, the timestamps are those of the batch.
+                with metrics.span("generate"):
+                    table = generate_shard(
+                        batch_index,
+                        self.batch_rows,
+                        self.seed,
+                        datetime.now(),
+                        self.spec,
+                    )
+                self.generated_rows += table.num_rows
+                metrics.add("rows", table.num_rows)
+                if not self._hand_over(table):
+                    break
+                batch_index += 1
+        except Exception as e:
+            logger.error(f"Batch producer failed. Error: {e}")
+            self.error = e
+            self.stop()
+        finally:
+            self._hand_over(_END_OF_STREAM)
+
+    def _hand_over(self, item: pa.Table | None) -> bool:
+        """
+        Put `item` in the queue, waiting for space as long as the loader is running.
+        On stop the batches already generated are still loaded, the end of stream comes after them.
+
+        Returns:
+            bool: False if the loader is gone and the item was dropped.
+        """
+        while not self.loader_done.is_set():
+            try:
+                self.batches.put(item, timeout=1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _consume(self) -> Iterator[pa.Table]:
+        """
+        Yield the queued batches to the loader. A batch counts as uploaded once the
+        loader asks for the next one.
+        """
+        while True:
+            table = self.batches.get()
+            if table is _END_OF_STREAM:
+                return
+            rows = table.num_rows
+            yield table
+            del table
+            self.uploaded_rows += rows
+
+    def _report(self) -> None:
+        previous_rows, previous_time = 0, self.started
+        while not self.stopping.wait(self.report_interval):
+            now = time.monotonic()
+            uploaded = self.uploaded_rows
+            logger.info(
+                f"Streaming: {(uploaded - previous_rows) / (now - previous_time):.0f} rows/sec "
+                f"in the last {now - previous_time:.0f}s, "
+                f"{uploaded / (now - self.started):.0f} overall "
+                f"(target {self.rows_per_second:.0f}), "
+                f"queue depth {self.batches.qsize()}/{self.batches.maxsize}, "
+                f"{uploaded} rows uploaded"
+            )
+            previous_rows, previous_time = uploaded, now
+
+    def _clean_up(self, tables: dict[str, str], connection_args: dict) -> None:
+        # Runs beside the uploads, the stage is never emptied on the upload path.
+        while not self.stopping.wait(self.cleanup_interval):
+            clean_up_stages(tables, **connection_args)
+
+    def run(self, **connection_args) -> None:
+        """
+        Stream until `duration` has passed, stop() is called or the process is interrupted.
+        A batch that fails with Snowpipe is retried, then loaded with write_pandas on its own,
+        see fake_data_to_snowflake.load_chunk. If that fails too, the stream stops and raises.
+        If generating a batch fails, the batches generated before are loaded, then run() raises.
+
+        Args:
+            **connection_args: Snowflake connection arguments, as for data_chunks_to_snowflake.
+
+        Raises:
+            Exception: If a batch could not be loaded, or could not be generated.
+        """
+        plan = get_plan(self.spec)
+        metrics.reset(spec=self.spec)
+        self.started = time.monotonic()
+        threads = [
+            threading.Thread(target=self._produce, name="batch-producer", daemon=True),
+            threading.Thread(target=self._report, name="rate-reporter", daemon=True),
+            threading.Thread(
+                target=self._clean_up,
+                args=({plan.table: plan.pipe}, connection_args),
+                name="stage-cleanup",
+                daemon=True,
+            ),
+        ]
+        if self.duration:
+            timer = threading.Timer(self.duration, self.stop)
+            timer.daemon = True
+            threads.append(timer)
+        for thread in threads:
+            thread.start()
+        logger.info(
+            f"Streaming {self.spec} at {self.rows_per_second:.0f} rows/sec "
+            f"in batches of {self.batch_rows} rows"
+        )
+        try:
+            data_chunks_to_snowflake(
+                self._consume(), table=plan.table, pipe=plan.pipe, **connection_args
+            )
+        except KeyboardInterrupt:
+            logger.info("Interrupted, stopping")
+        except Exception as e:
+            # A batch that neither Snowpipe nor write_pandas could load ends the stream.
+            logger.error(f"Streaming stopped, a batch could not be loaded. Error: {e}")
+            raise
+        finally:
+            self.stop()
+            self.loader_done.set()
+            elapsed = time.monotonic() - self.started
+            logger.info(
+                f"Streamed {self.uploaded_rows} rows in {elapsed:.0f}s: "
+                f"{self.uploaded_rows / elapsed:.0f} rows/sec (target {self.rows_per_second:.0f})"
+            )
+            clean_up_stages({plan.table: plan.pipe}, **connection_args)
+            metrics.emit()
+        if self.error is not None:
+            raise self.error
+
+
+def main():
+    cli_parser = argparse.ArgumentParser(
+        description="Load fake data continuously with Snowpipe, at a target rate."
+    )
+    cli_parser.add_argument("--rows_per_second", type=float, default=1_000)
+    cli_parser.add_argument(
+        "--batch_rows",
+        type=int,
+        default=10_000,
+        help="Rows per micro-batch, each batch is one staged file.",
+    )
+    cli_parser.add_argument(
+        "--queue_size",
+        type=int,
+        default=4,
+        help="Generated batches that may wait for upload before generation blocks.",
+    )
+    cli_parser.add_argument(
+        "--duration", type=float, help="Seconds to run. Runs until Ctrl-C if not set."
+    )
+    cli_parser.add_argument("--report_interval", type=float, default=10)
+    cli_parser.add_argument(
+        "--cleanup_interval",
+        type=float,
+        default=600,
+        help="Seconds between removals of loaded files from the stage.",
+    )
+    cli_parser.add_argument("--seed", type=int)
+    cli_parser.add_argument("--spec", default=DEFAULT_SPEC)
+    cli_parser.add_argument("--compression", default="snappy")
+    cli_parser.add_argument("--compression_level", type=int)
+    args = cli_parser.parse_args()
+
+    from config import config
+
+    # The daemon is not frozen between batches like a Lambda, a thread can refresh the secret.
+    config.background_refresh = True
+    StreamDaemon(
+        rows_per_second=args.rows_per_second,
+        batch_rows=args.batch_rows,
+        queue_size=args.queue_size,
+        seed=args.seed,
+        spec=args.spec,
+        duration=args.duration,
+        report_interval=args.report_interval,
+        cleanup_interval=args.cleanup_interval,
+    ).run(
+        user=config.user,
+        password=config.password,
+        account=config.account,
+        warehouse=config.warehouse,
+        database=config.database,
+        schema=config.schema,
+        role=config.role,
+        rsa_key=config.rsa_key,
+        parquet_settings=ParquetSettings(args.compression, args.compression_level),
+    )
+
+
+if __name__ == "__main__":
+    main()
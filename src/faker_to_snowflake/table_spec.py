@@ -0,0 +1,410 @@
+from datetime import datetime
+import functools
+import json
+import pathlib
+from typing import Callable
+import zlib
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+from faker import Faker
+from logging_config import logger
+from column_generators import (
+    random_timestamps_before,
+    random_ulid_strings,
+    random_uuid4_strings,
+    shared_faker,
+    with_random_tags,
+    DEFAULT_POOL_SIZE,
+)
+from value_pools import value_pools
+from unique_keys import unique_keys
+
+# Table specs are looked up by name in this directory, as <name>.json (or .yaml / .yml).
+SPEC_DIRECTORY = pathlib.Path(__file__).parent / "table_specs"
+DEFAULT_SPEC = "fake_sales_orders"
+# Rounds of replacing the values of a unique column that were seen before, see ColumnPlan.make_unique.
+UNIQUE_MAX_ATTEMPTS = 5
+
+# A column generator is called with (number of rows, Faker, numpy generator, now).
+# It returns a numpy array, or an Arrow array when the values are Arrow already.
+ColumnGenerator = Callable[
+    [int, Faker, np.random.Generator, datetime], np.ndarray | pa.Array
+]
+
+
+def _faker_column(column: dict) -> ColumnGenerator:
+    provider = column["provider"]
+    kwargs = column.get("args", {})
+    if not hasattr(shared_faker, provider):
+        raise ValueError(
+            f"Column {column['name']}: unknown Faker provider {provider}. "
+            f"Add its provider module to column_generators.FAKER_PROVIDERS."
+        )
+
+    def generate(number_of_rows, fake, rng, now):
+        if value_pools.enabled:
+            # Sample from the cached pool instead of calling Faker, see value_pools.py.
+            # The pool is the dictionary, the rows are never materialized as Python objects.
+            pool = value_pools.get_pool(provider, kwargs)
+            indices = rng.integers(0, len(pool), size=number_of_rows, dtype=np.int32)
+            return pa.DictionaryArray.from_arrays(indices, pool)
+        provider_method = getattr(fake, provider)
+        return np.array(
+            [provider_method(**kwargs) for _ in range(number_of_rows)], dtype=object
+        )
+
+    return generate
+
+
+def _choice_column(column: dict) -> ColumnGenerator:
+    values = np.array(column["values"], dtype=object)
+    weights = column.get("weights")
+    probabilities = None
+    if weights is not None:
+        probabilities = np.asarray(weights, dtype=float)
+        probabilities = probabilities / probabilities.sum()
+    return lambda number_of_rows, fake, rng, now: rng.choice(
+        values, size=number_of_rows, p=probabilities
+    )
+
+
+def _integer_column(column: dict) -> ColumnGenerator:
+    low, high = column.get("min", 0), column.get("max", 100)
+    return lambda number_of_rows, fake, rng, now: rng.integers(
+        low, high + 1, size=number_of_rows
+    )
+
+
+def _float_column(column: dict) -> ColumnGenerator:
+    distribution = column.get("distribution", "uniform")
+    decimals = column.get("round")
+    if distribution == "uniform":
+        low, high = column.get("min", 0.0), column.get("max", 1.0)
+        sample = lambda rng, size: rng.uniform(low, high, size)
+    elif distribution == "normal":
+        mean, stddev = column.get("mean", 0.0), column.get("stddev", 1.0)
+        sample = lambda rng, size: rng.normal(mean, stddev, size)
+    elif distribution == "lognormal":
+        mean, sigma = column.get("mean", 0.0), column.get("sigma", 1.0)
+        sample = lambda rng, size: rng.lognormal(mean, sigma, size)
+    else:
+        raise ValueError(
+            f"Column {column['name']}: unknown distribution {distribution}"
+        )
+
+    def generate(number_of_rows, fake, rng, now):
+        values = sample(rng, number_of_rows)
+        return values if decimals is None else np.round(values, decimals)
+
+    return generate
+
+
+def _timestamp_before_now_column(column: dict) -> ColumnGenerator:
+    max_minutes = column.get("max_minutes", 120)
+    return lambda number_of_rows, fake, rng, now: random_timestamps_before(
+        now, number_of_rows, rng, max_minutes=max_minutes
+    )
+
+
+def _now_column(column: dict) -> ColumnGenerator:
+    return lambda number_of_rows, fake, rng, now: np.full(
+        number_of_rows, np.datetime64(now, "ns")
+    )
+
+
+def _uuid4_column(column: dict) -> ColumnGenerator:
+    return lambda number_of_rows, fake, rng, now: random_uuid4_strings(
+        number_of_rows, rng
+    )
+
+
+def _ulid_column(column: dict) -> ColumnGenerator:
+    return lambda number_of_rows, fake, rng, now: random_ulid_strings(
+        number_of_rows, rng, now
+    )
+
+
+def _sequence_column(column: dict) -> ColumnGenerator:
+    # Columns naming the same sequence draw from one counter, so they never share an ID.
+    sequence = column.get("sequence", column["name"])
+    start = column.get("start", 1)
+    return lambda number_of_rows, fake, rng, now: unique_keys.next_ids(
+        sequence, number_of_rows, start=start
+    )
+
+
+COLUMN_TYPES = {
+    "faker": _faker_column,
+    "choice": _choice_column,
+    "integer": _integer_column,
+    "float": _float_column,
+    "timestamp_before_now": _timestamp_before_now_column,
+    "now": _now_column,
+    "uuid4": _uuid4_column,
+    "ulid": _ulid_column,
+    "sequence": _sequence_column,
+}
+
+
+def _as_arrow(
+    values: np.ndarray | pa.Array, mask: np.ndarray | None = None
+) -> pa.Array:
+    """
+    Return generated values as an Arrow array, with nulls where `mask` is True.
+    """
+    if not isinstance(values, pa.Array):
+        return pa.array(values, mask=mask)
+    if mask is None:
+        return values
+    if pa.types.is_dictionary(values.type):
+        return pa.DictionaryArray.from_arrays(
+            pc.if_else(mask, pa.scalar(None, values.indices.type), values.indices),
+            values.dictionary,
+        )
+    return pc.if_else(mask, pa.scalar(None, values.type), values)
+
+
+def _decoded(values: pa.Array) -> pa.Array:
+    """
+    Return `values` with a dictionary array cast to its value type.
+    """
+    if pa.types.is_dictionary(values.type):
+        return values.cast(values.type.value_type)
+    return values
+
+
+class ColumnPlan:
+    """
+    A compiled column: the generator function plus the null rate, cardinality,
+    dictionary encoding and uniqueness from the spec.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        generator: ColumnGenerator,
+        null_rate: float = 0.0,
+        cardinality: int | None = None,
+        dictionary: bool = False,
+        unique_key: str | None = None,
+    ):
+        self.name = name
+        self.generator = generator
+        self.null_rate = null_rate
+        self.cardinality = cardinality
+        self.dictionary = dictionary
+        # Name of the column's uniqueness state in unique_keys, None if it need not be unique.
+        self.unique_key = unique_key
+
+    def generate(
+        self,
+        number_of_rows: int,
+        fake: Faker,
+        rng: np.random.Generator,
+        now: datetime,
+    ) -> pa.Array:
+        """
+        Generate the column as an Arrow array. A dictionary column comes out as a
+        DictionaryArray, which the parquet writer stores dictionary encoded.
+        """
+        if self.cardinality:
+            # Generate a pool of distinct-ish values once and sample the rows from it.
+            pool = self.generator(
+                max(1, min(self.cardinality, number_of_rows)), fake, rng, now
+            )
+            if isinstance(pool, pa.Array):
+                pool = _decoded(pool)
+            indices = rng.integers(0, len(pool), size=number_of_rows)
+            mask = self._null_mask(number_of_rows, rng)
+            if self.dictionary:
+                # The pool is the dictionary, the rows are never materialized as Python objects.
+                return pa.DictionaryArray.from_arrays(
+                    pa.array(indices, mask=mask, type=pa.int32()), _as_arrow(pool)
+                )
+            if isinstance(pool, pa.Array):
+                return _as_arrow(pool.take(indices), mask)
+            return pa.array(pool[indices], mask=mask)
+
+        values = _as_arrow(
+            self.generator(number_of_rows, fake, rng, now),
+            self._null_mask(number_of_rows, rng),
+        )
+        if self.unique_key:
+            values = self.make_unique(
+                _decoded(values), fake, self._unique_rng(rng), now
+            )
+        return values.dictionary_encode() if self.dictionary else _decoded(values)
+
+    def make_unique(
+        self,
+        values: pa.Array,
+        fake: Faker,
+        rng: np.random.Generator,
+        now: datetime,
+    ) -> pa.Array:
+        """
+        Replace the values that were generated before, in this batch or an earlier run,
+        until every value is new, see unique_keys.py. String values are tagged, e.g. an
+        e-mail address becomes jane.doe+K3F9QZ2M@example.org, because a Faker pool runs
+        out of new values. Other values are generated again.
+
+        How many values are replaced depends on the persisted state, so `rng` must not be
+        the generator of the other columns, see _unique_rng.
+
+        Raises:
+            ValueError: If values are still repeated after UNIQUE_MAX_ATTEMPTS rounds.
+        """
+        new = unique_keys.new_values(self.unique_key, values)
+        for _ in range(UNIQUE_MAX_ATTEMPTS):
+            if new.all():
+                return values
+            repeated = ~new
+            if pa.types.is_string(values.type) or pa.types.is_large_string(values.type):
+                replacements = with_random_tags(values.filter(repeated), rng).cast(
+                    values.type
+                )
+            else:
+                replacements = _as_arrow(
+                    self.generator(int(repeated.sum()), fake, rng, now)
+                )
+            values = pc.replace_with_mask(values, repeated, replacements)
+            new[repeated] = unique_keys.new_values(self.unique_key, replacements)
+        if not new.all():
+            raise ValueError(
+                f"Column {self.name}: {int((~new).sum())} values are still not unique "
+                f"after {UNIQUE_MAX_ATTEMPTS} attempts, its generator has too few distinct values"
+            )
+        return values
+
+    def _unique_rng(self, rng: np.random.Generator) -> np.random.Generator:
+        """
+        Return the generator of the replacements in make_unique, seeded from the seed of
+        `rng` (the run seed and shard) and the column. Nothing is drawn from `rng`, so the
+        other columns of a seeded batch are the same whatever values were seen before.
+        """
+        seed_sequence = rng.bit_generator.seed_seq
+        return np.random.default_rng(
+            np.random.SeedSequence(
+                seed_sequence.entropy,
+                spawn_key=seed_sequence.spawn_key
+                + (zlib.crc32(self.unique_key.encode()),),
+            )
+        )
+
+    def _null_mask(
+        self, number_of_rows: int, rng: np.random.Generator
+    ) -> np.ndarray | None:
+        if not self.null_rate:
+            return None
+        return rng.random(number_of_rows) < self.null_rate
+
+
+class TablePlan:
+    """
+    A compiled table spec: the target table and pipe, and one ColumnPlan per column.
+    """
+
+    def __init__(self, table: str, pipe: str, columns: list[ColumnPlan]):
+        self.table = table
+        self.pipe = pipe
+        self.columns = columns
+
+    def generate(
+        self,
+        number_of_rows: int,
+        fake: Faker | None = None,
+        rng: np.random.Generator | None = None,
+        now: datetime | None = None,
+    ) -> pa.Table:
+        """
+        Generate `number_of_rows` rows, each column as a whole array.
+
+        Args:
+            number_of_rows (int): The number of rows to generate.
+            fake (Faker, optional): The Faker instance for faker columns. Defaults to the shared instance.
+            rng (numpy.random.Generator, optional): The random generator. Defaults to an unseeded generator.
+            now (datetime, optional): The extraction timestamp. Defaults to the current time.
+
+        Returns:
+            pyarrow.Table: The generated rows, columns in spec order.
+        """
+        fake = shared_faker if fake is None else fake
+        rng = rng or np.random.default_rng()
+        now = now or datetime.now()
+        return pa.table(
+            {
+                column.name: column.generate(number_of_rows, fake, rng, now)
+                for column in self.columns
+            }
+        )
+
+
+def load_spec(name: str) -> dict:
+    """
+    Read the spec `name` from SPEC_DIRECTORY. JSON is always supported,
+    YAML only when PyYAML is installed.
+    """
+    for suffix in (".json", ".yaml", ".yml"):
+        path = SPEC_DIRECTORY / f"{name}{suffix}"
+        if not path.exists():
+            continue
+        with open(path, "r") as file:
+            if suffix == ".json":
+                return json.load(file)
+            import yaml
+
+            return yaml.safe_load(file)
+    raise ValueError(f"No table spec named {name} in {SPEC_DIRECTORY}")
+
+
+def compile_spec(spec: dict) -> TablePlan:
+    """
+    Compile a spec into a TablePlan. Providers, distributions and arguments are
+    resolved here, once, instead of for every row or batch.
+    """
+    table = spec["table"]
+    columns = []
+    for column in spec["columns"]:
+        column_type = column.get("type", "faker")
+        if column_type not in COLUMN_TYPES:
+            raise ValueError(f"Column {column['name']}: unknown type {column_type}")
+        unique = column.get("unique", False)
+        if unique and "cardinality" in column:
+            raise ValueError(
+                f"Column {column['name']}: a unique column cannot have a cardinality"
+            )
+        cardinality = column.get("cardinality")
+        pooled = column_type == "faker" and "cardinality" not in column and not unique
+        if pooled and not value_pools.enabled:
+            # One Faker call per row is far too slow: without the value pools, faker columns
+            # sample from DEFAULT_POOL_SIZE values generated per batch.
+            cardinality = DEFAULT_POOL_SIZE
+        # Low-cardinality columns are dictionary encoded unless the spec says otherwise.
+        # Faker columns sampled from a value pool are too, the pool is the dictionary.
+        dictionary = column.get(
+            "dictionary",
+            (bool(cardinality) or pooled or column_type == "choice") and not unique,
+        )
+        columns.append(
+            ColumnPlan(
+                name=column["name"],
+                generator=COLUMN_TYPES[column_type](column),
+                null_rate=column.get("null_rate", 0.0),
+                cardinality=cardinality,
+                dictionary=dictionary,
+                unique_key=f"{table}.{column['name']}" if unique else None,
+            )
+        )
+    return TablePlan(
+        table=table, pipe=spec.get("pipe", f"pipe_{table}"), columns=columns
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def get_plan(name: str = DEFAULT_SPEC) -> TablePlan:
+    """
+    Return the compiled plan for the spec `name`, compiling it on first use.
+    """
+    logger.info(f"Compiling table spec: {name}")
+    return compile_spec(load_spec(name))
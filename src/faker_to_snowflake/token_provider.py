@@ -0,0 +1,63 @@
+import hashlib
+import threading
+from logging_config import logger
+
+
+class TokenProvider:
+    """
+    Process-wide cache of JWTGenerator objects, keyed by (account, user, private key digest).
+    The generator holds the parsed private key, its public key fingerprint and the current token,
+    so warm Lambda invocations only re-sign once the generator's renew_time has passed.
+
+    Counters:
+        hits: tokens served from the cache without signing.
+        misses: tokens that had to be signed, because the key was new or the token was due for renewal.
+        key_loads: private keys parsed, i.e. generators created.
+    """
+
+    def __init__(self):
+        self._generators = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.key_loads = 0
+
+    def get_token(self, account: str, user: str, private_key: str) -> str:
+        """
+        Return a valid JWT for the user, signing a new one only when needed.
+
+        Args:
+            account (str): The Snowflake account identifier.
+            user (str): The Snowflake user name.
+            private_key (str): The PEM encoded private key.
+
+        Returns:
+            str: The JWT.
+        """
+        # The digest of the PEM text identifies the key without having to parse it.
+        key_digest = hashlib.sha256(private_key.encode()).hexdigest()
+        cache_key = (account, user, key_digest)
+        with self._lock:
+            generator = self._generators.get(cache_key)
+            if generator is None:
+                # jwt and cryptography are only imported once a key has to be loaded.
+                from sql_api_generate_jwt import JWTGenerator
+
+                generator = JWTGenerator(account, user, private_key)
+                self._generators[cache_key] = generator
+                self.key_loads += 1
+            previous_token = generator.token
+            token = generator.get_token()
+            if token is previous_token:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return token
+
+    def log_stats(self) -> None:
+        logger.info(
+            f"JWT cache: {self.hits} hits, {self.misses} misses, {self.key_loads} keys loaded"
+        )
+
+
+token_provider = TokenProvider()
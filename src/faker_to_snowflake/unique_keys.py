@@ -0,0 +1,429 @@
+import contextlib
+import fcntl
+import glob
+import math
+import os
+import re
+import threading
+import time
+import numpy as np
+import pyarrow as pa
+from logging_config import logger
+from json_state import locked_update, open_lock, write_atomically
+from batch_checkpoints import CHECKPOINT_RETENTION_SECONDS
+
+# Where the Bloom filters and ID sequences of the unique columns are kept between runs.
+UNIQUE_KEYS_DIRECTORY = os.getenv("UNIQUE_KEYS_DIRECTORY", "/tmp/unique_keys")
+# Values per filter generation. A column's values stay unique over at least this many of its latest values.
+UNIQUE_KEYS_CAPACITY = int(os.getenv("UNIQUE_KEYS_CAPACITY", 10_000_000))
+# False positive rate of a full generation. A false positive only replaces a value that was new.
+UNIQUE_KEYS_ERROR_RATE = float(os.getenv("UNIQUE_KEYS_ERROR_RATE", 0.001))
+
+# Odd 64-bit constants, one per bit a value sets in its word of the Bloom filter.
+_BIT_MULTIPLIERS = np.array(
+    [
+        0x9E3779B97F4A7C15,
+        0xBF58476D1CE4E5B9,
+        0x94D049BB133111EB,
+        0xD6E8FEB86659FD93,
+        0xA0761D6478BD642F,
+        0xE7037ED1A0B428DB,
+        0x8EBC6AF09C88C6E3,
+        0x589965CC75374CC3,
+    ],
+    dtype=np.uint64,
+)
+
+
+def _mix(hashes: np.ndarray) -> np.ndarray:
+    """
+    The splitmix64 finalizer: every input bit affects every output bit.
+    """
+    hashes = hashes ^ (hashes >> np.uint64(30))
+    hashes = hashes * np.uint64(0xBF58476D1CE4E5B9)
+    hashes = hashes ^ (hashes >> np.uint64(27))
+    hashes = hashes * np.uint64(0x94D049BB133111EB)
+    return hashes ^ (hashes >> np.uint64(31))
+
+
+def _hash_strings(values: pa.Array) -> np.ndarray:
+    """
+    Hash a string or binary array 8 bytes at a time, straight from its Arrow buffers:
+    one numpy step per 8 characters of the longest value, not one Python call per value.
+    """
+    large = pa.types.is_large_string(values.type) or pa.types.is_large_binary(
+        values.type
+    )
+    offsets = np.frombuffer(values.buffers()[1], dtype=np.int64 if large else np.int32)
+    offsets = offsets[values.offset : values.offset + len(values) + 1].astype(np.int64)
+    data = values.buffers()[2]
+    data = np.frombuffer(data, dtype=np.uint8) if data else np.zeros(0, np.uint8)
+    # Padded, so the last block of the last value can be read as a whole.
+    data = np.concatenate([data, np.zeros(8, np.uint8)])
+    starts, lengths = offsets[:-1], np.diff(offsets)
+    # The length goes in first, a value and the value padded with zero bytes differ.
+    hashes = _mix((lengths.astype(np.uint64) + np.uint64(1)) * _BIT_MULTIPLIERS[0])
+    block_bytes = np.arange(8)
+    for block_start in range(0, int(lengths.max(initial=0)), 8):
+        rows = np.flatnonzero(lengths > block_start)
+        blocks = data[(starts[rows] + block_start)[:, None] + block_bytes]
+        blocks[block_bytes >= (lengths[rows] - block_start)[:, None]] = 0
+        hashes[rows] = _mix(hashes[rows] ^ blocks.view("<u8").ravel())
+    return hashes
+
+
+def hash_values(values: pa.Array | np.ndarray) -> np.ndarray:
+    """
+    Return a 64-bit hash per value, the same in every process and run, so the hashes can be
+    persisted. A dictionary array's dictionary is hashed once: pool-sampled columns repeat a
+    few thousand values. Nulls get a hash too, the caller masks them.
+
+    Raises:
+        pyarrow.ArrowInvalid: For types that are neither strings, binary nor castable to int64.
+    """
+    if isinstance(values, np.ndarray):
+        values = pa.array(values)
+    if pa.types.is_dictionary(values.type):
+        dictionary_hashes = hash_values(values.dictionary)
+        return dictionary_hashes[values.indices.fill_null(0).to_numpy()]
+    if (
+        pa.types.is_string(values.type)
+        or pa.types.is_large_string(values.type)
+        or pa.types.is_binary(values.type)
+        or pa.types.is_large_binary(values.type)
+    ):
+        return _hash_strings(values)
+    if pa.types.is_floating(values.type):
+        bits = values.cast(pa.float64()).fill_null(0).to_numpy().view(np.uint64)
+    else:
+        bits = values.cast(pa.int64()).fill_null(0).to_numpy().view(np.uint64)
+    return _mix(bits ^ _BIT_MULTIPLIERS[1])
+
+
+def _blocked_false_positive_rate(values_per_word: float) -> float:
+    """
+    The false positive rate of a BloomFilter holding on average `values_per_word` values
+    per word: the number of values in a word is Poisson distributed, a value's 8 bits are
+    drawn with replacement.
+    """
+    rate = 0.0
+    for values in range(int(values_per_word + 12 * math.sqrt(values_per_word) + 20)):
+        probability = math.exp(
+            -values_per_word
+            + values * math.log(values_per_word)
+            - math.lgamma(values + 1)
+        )
+        rate += probability * (1 - (63 / 64) ** (8 * values)) ** 8
+    return rate
+
+
+class BloomFilter:
+    """
+    A blocked Bloom filter over 64-bit hashes, its words memory-mapped from a file.
+    A value sets up to 8 bits, one per _BIT_MULTIPLIERS, in a single 64-bit word, so checking or adding
+    it touches one word instead of one per bit. For the same false positive rate that
+    takes about 1.6 times the bits of a classic Bloom filter, 2.8 MB per million values at 0.1%.
+    Processes mapping the same file share the words, see UniqueValues for the locking.
+    """
+
+    def __init__(self, path: str, capacity: int, error_rate: float):
+        """
+        Args:
+            path (str): The file of the words. Created, or recreated empty if its size does not match:
+                hold a lock if other processes may open it at the same time, see UniqueValues.
+            capacity (int): The number of values at which the false positive rate reaches `error_rate`.
+            error_rate (float): The false positive rate at capacity.
+        """
+        # The most values per word that keep the false positive rate at `error_rate`, by bisection.
+        low, high = 0.0, 64.0
+        for _ in range(40):
+            middle = (low + high) / 2
+            if _blocked_false_positive_rate(middle) <= error_rate:
+                low = middle
+            else:
+                high = middle
+        self.word_count = max(1, math.ceil(capacity / max(low, 1e-3)))
+        if not os.path.exists(path) or os.path.getsize(path) != self.word_count * 8:
+            with open(path, "wb") as file:
+                file.truncate(self.word_count * 8)
+        self.words = np.memmap(
+            path, dtype=np.uint64, mode="r+", shape=(self.word_count,)
+        )
+
+    def _locate(self, hashes: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Return the word index and the bit mask of every hash.
+        """
+        word_indices = hashes % np.uint64(self.word_count)
+        # The top 6 bits of the hash times a different constant pick each bit in the word.
+        bits = (hashes[:, None] * _BIT_MULTIPLIERS) >> np.uint64(58)
+        masks = np.bitwise_or.reduce(np.left_shift(np.uint64(1), bits), axis=1)
+        return word_indices, masks
+
+    def contains(self, hashes: np.ndarray) -> np.ndarray:
+        """
+        Return per hash whether it was probably added before. False is always right.
+        """
+        word_indices, masks = self._locate(hashes)
+        return (self.words[word_indices] & masks) == masks
+
+    def add(self, hashes: np.ndarray) -> None:
+        word_indices, masks = self._locate(hashes)
+        np.bitwise_or.at(self.words, word_indices, masks)
+
+    def clear(self) -> None:
+        self.words[:] = 0
+
+
+class UniqueValues:
+    """
+    The values a unique column generated so far, in two generations of Bloom filters of
+    fixed size: new values go into the current one, both are checked. When the current one
+    holds `capacity` values, the older one is cleared and becomes the current one.
+    Memory stays at two filters however many values are generated, and a value is
+    guaranteed new among at least the latest `capacity` values.
+
+    The filters and their state are files, shared by the processes and the warm
+    invocations of a container. Creating the filters, every check and every update hold
+    the lock of the state file.
+
+    Values are added as they are generated, so that concurrent batches never generate the
+    same value. A batch that is generated again after a failed load would then find its
+    own values seen and replace them: values added for a batch id are also appended to a
+    journal of the batch, see UniqueKeys.start_batch, and a new attempt of the batch takes
+    the values of the earlier attempts as new, once each, so it generates the same data.
+    """
+
+    def __init__(self, path: str, capacity: int, error_rate: float):
+        """
+        Args:
+            path (str): The path prefix of the filter and state files.
+            capacity (int): Values per generation.
+            error_rate (float): False positive rate of a full generation.
+        """
+        self.path = path
+        self.capacity = capacity
+        self.state_path = f"{path}.json"
+        # Processes starting together must not recreate each other's filters.
+        with open_lock(self.state_path):
+            self.filters = [
+                BloomFilter(f"{path}.{generation}.bloom", capacity, error_rate)
+                for generation in (0, 1)
+            ]
+
+    def _journal_path(self, batch_id: str, attempts: str) -> str:
+        """
+        Return the file of the hashes added by the `attempts` ("current" or "earlier") of the batch.
+        """
+        return f"{self.path}.{_file_name(batch_id)}.{attempts}"
+
+    def new_values(
+        self, values: pa.Array | np.ndarray, batch_id: str | None = None
+    ) -> np.ndarray:
+        """
+        Return per value whether it is new: not seen before, in an earlier batch or earlier
+        in this one. The new values are added. Nulls count as new and are not added.
+
+        Args:
+            values (pyarrow.Array | numpy.ndarray): The values to check.
+            batch_id (str, optional): The batch the values are generated for: they are
+                journaled, and those added by its earlier attempts are new. Defaults to None.
+
+        Returns:
+            numpy.ndarray: A boolean mask, False for the values to replace.
+        """
+        hashes = hash_values(values)
+        # Only the first occurrence of a value within the batch can be new.
+        _, first_index = np.unique(hashes, return_index=True)
+        candidates = np.zeros(len(hashes), dtype=bool)
+        candidates[first_index] = True
+        if isinstance(values, pa.Array) and values.null_count:
+            nulls = values.is_null().to_numpy(zero_copy_only=False)
+            candidates &= ~nulls
+        indices = np.flatnonzero(candidates)
+
+        # The filter words are changed under the lock of the state file, see json_state.py.
+        # They need no flush, processes mapping a file share its pages.
+        with locked_update(self.state_path, "unique key state") as state:
+            state.setdefault("current", 0)
+            state.setdefault("count", 0)
+            candidate_hashes = hashes[indices]
+            in_filters = self.filters[0].contains(candidate_hashes)
+            in_filters |= self.filters[1].contains(candidate_hashes)
+            seen = in_filters
+            if batch_id:
+                seen = in_filters & ~self._added_earlier(candidate_hashes, batch_id)
+            added = indices[~seen]
+            self.filters[state["current"]].add(hashes[added])
+            state["count"] += int((~in_filters).sum())
+            if batch_id:
+                with open(self._journal_path(batch_id, "current"), "ab") as journal:
+                    hashes[added].tofile(journal)
+            if state["count"] >= self.capacity:
+                state["current"] = 1 - state["current"]
+                state["count"] = 0
+                self.filters[state["current"]].clear()
+                logger.info(f"Started a new generation of {self.state_path}")
+
+        new = np.zeros(len(hashes), dtype=bool)
+        new[added] = True
+        if isinstance(values, pa.Array) and values.null_count:
+            new |= nulls
+        return new
+
+    def _added_earlier(self, hashes: np.ndarray, batch_id: str) -> np.ndarray:
+        """
+        Return per hash whether an earlier attempt of the batch added it and the current
+        attempt has not yet. Call with the state lock held.
+        """
+        earlier_path = self._journal_path(batch_id, "earlier")
+        if not os.path.exists(earlier_path):
+            return np.zeros(len(hashes), dtype=bool)
+        earlier = np.isin(hashes, np.fromfile(earlier_path, dtype=np.uint64))
+        current_path = self._journal_path(batch_id, "current")
+        if earlier.any() and os.path.exists(current_path):
+            earlier &= ~np.isin(hashes, np.fromfile(current_path, dtype=np.uint64))
+        return earlier
+
+    def start_attempt(self, batch_id: str) -> None:
+        """
+        Make the values journaled for the batch so far those of its earlier attempts.
+        """
+        current_path = self._journal_path(batch_id, "current")
+        earlier_path = self._journal_path(batch_id, "earlier")
+        with open_lock(self.state_path):
+            if not os.path.exists(current_path):
+                return
+            hashes = np.fromfile(current_path, dtype=np.uint64)
+            if os.path.exists(earlier_path):
+                hashes = np.union1d(hashes, np.fromfile(earlier_path, dtype=np.uint64))
+            write_atomically(earlier_path, hashes.tobytes())
+            os.remove(current_path)
+
+    def forget_batch(self, batch_id: str) -> None:
+        with open_lock(self.state_path):
+            for attempts in ("current", "earlier"):
+                if os.path.exists(self._journal_path(batch_id, attempts)):
+                    os.remove(self._journal_path(batch_id, attempts))
+
+
+def _file_name(name: str) -> str:
+    # Column and batch names come from specs and events, keep them to characters safe in a file name.
+    return re.sub(r"[^\w.-]", "_", name)
+
+
+class UniqueKeys:
+    """
+    The uniqueness state of every unique column and the ID sequences, by name, in UNIQUE_KEYS_DIRECTORY.
+    Like the value pools, the files live in the container's /tmp and are reused by warm
+    invocations. Put the directory on shared storage such as EFS to extend the guarantees
+    across containers, e.g. to the workers of a fan-out.
+    """
+
+    def __init__(self, directory: str, capacity: int, error_rate: float):
+        """
+        Args:
+            directory (str): Where the files are kept. Created on first use.
+            capacity (int): Values per filter generation of a unique column.
+            error_rate (float): False positive rate of a full generation.
+        """
+        self.directory = directory
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self._columns = {}
+        self._lock = threading.Lock()
+        # The batch being generated, see start_batch.
+        self.batch_id = None
+
+    def _path(self, name: str) -> str:
+        os.makedirs(self.directory, exist_ok=True)
+        return os.path.join(self.directory, _file_name(name))
+
+    def column(self, name: str) -> UniqueValues:
+        """
+        Return the uniqueness state of the column `name`, e.g. "fake_sales_orders.email".
+        """
+        with self._lock:
+            path = self._path(name)
+            if path not in self._columns:
+                self._columns[path] = UniqueValues(path, self.capacity, self.error_rate)
+            return self._columns[path]
+
+    def new_values(self, name: str, values: pa.Array | np.ndarray) -> np.ndarray:
+        """
+        UniqueValues.new_values of the column `name`, for the batch being generated.
+        """
+        return self.column(name).new_values(values, self.batch_id)
+
+    def _journals(self) -> list[str]:
+        directory = glob.escape(self.directory)
+        return glob.glob(os.path.join(directory, "*.current")) + glob.glob(
+            os.path.join(directory, "*.earlier")
+        )
+
+    def _journaled_columns(self, batch_id: str) -> list[UniqueValues]:
+        """
+        Return the columns that have a journal of `batch_id`.
+        """
+        columns = set()
+        for path in self._journals():
+            # <column>.<batch id>.<attempts>, either name can contain dots.
+            name = os.path.basename(path).rsplit(".", 1)[0]
+            if name.endswith(f".{_file_name(batch_id)}"):
+                columns.add(name[: -len(_file_name(batch_id)) - 1])
+        return [self.column(name) for name in sorted(columns)]
+
+    def start_batch(self, batch_id: str) -> None:
+        """
+        Generate the values of the unique columns for `batch_id` until finish_batch, in this
+        process and the processes it forks. If an earlier attempt of the batch failed, its
+        values are taken as new once more, see UniqueValues. Call before the batch is
+        generated, not when it is resumed from saved data.
+        Also drops the journals of batches older than CHECKPOINT_RETENTION_SECONDS.
+        """
+        cutoff = time.time() - CHECKPOINT_RETENTION_SECONDS
+        for path in self._journals():
+            # Another process may have dropped it already.
+            with contextlib.suppress(FileNotFoundError):
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+        for column in self._journaled_columns(batch_id):
+            column.start_attempt(batch_id)
+        self.batch_id = batch_id
+
+    def finish_batch(self, batch_id: str, loaded: bool) -> None:
+        """
+        Stop generating for `batch_id`. Once it is loaded its journals are dropped, its
+        values stay seen. Otherwise they are kept for the next attempt.
+        """
+        self.batch_id = None
+        if loaded:
+            for column in self._journaled_columns(batch_id):
+                column.forget_batch(batch_id)
+
+    def next_ids(self, sequence: str, count: int, start: int = 1) -> np.ndarray:
+        """
+        Reserve `count` consecutive IDs of the sequence `sequence`, under a file lock, so
+        processes and invocations sharing the directory never get the same ID.
+
+        Returns:
+            numpy.ndarray: The IDs, as int64.
+        """
+        path = f"{self._path(sequence)}.sequence"
+        with open(path, "a+") as file:
+            fcntl.flock(file, fcntl.LOCK_EX)
+            try:
+                file.seek(0)
+                first = int(file.read().strip() or start)
+                file.seek(0)
+                file.truncate()
+                file.write(str(first + count))
+                file.flush()
+            finally:
+                fcntl.flock(file, fcntl.LOCK_UN)
+        return np.arange(first, first + count, dtype=np.int64)
+
+
+unique_keys = UniqueKeys(
+    UNIQUE_KEYS_DIRECTORY, UNIQUE_KEYS_CAPACITY, UNIQUE_KEYS_ERROR_RATE
+)
@@ -0,0 +1,207 @@
+# Pools are built on first use. To bake them into the image instead, run:
+#   python value_pools.py --directory faker_pools
+
+import argparse
+import fcntl
+import hashlib
+import json
+import os
+import pathlib
+import threading
+import time
+import pyarrow as pa
+from logging_config import logger
+
+# Pools bundled with the code (read only in Lambda) are used first, then those in /tmp.
+IMAGE_POOL_DIRECTORY = os.getenv(
+    "FAKER_POOL_IMAGE_DIRECTORY", str(pathlib.Path(__file__).parent / "faker_pools")
+)
+POOL_DIRECTORY = os.getenv("FAKER_POOL_DIRECTORY", "/tmp/faker_pools")
+# Values per pool. 0 disables the cache, faker columns then call Faker for every batch.
+POOL_SIZE = int(os.getenv("FAKER_POOL_SIZE", 10_000))
+POOL_LOCALE = os.getenv("FAKER_LOCALE", "en_US")
+# Pools older than this are rebuilt with new values. Unset: pools are kept until Faker changes.
+POOL_MAX_AGE_SECONDS = (
+    float(os.getenv("FAKER_POOL_MAX_AGE_SECONDS"))
+    if os.getenv("FAKER_POOL_MAX_AGE_SECONDS")
+    else None
+)
+
+
+class ValuePoolCache:
+    """
+    Pools of Faker values, one per provider and arguments, stored as Arrow IPC files and memory-mapped.
+
+    Faker calls are by far the slowest part of generation. A pool is built once per container
+    (or once per image, see the module comment) and every batch samples from it with numpy
+    indices. The mapped pages are shared by all worker processes and reused by warm invocations.
+
+    The file name contains the Faker version, locale and pool size, so a Faker upgrade or a
+    new setting leads to a new pool. Pools of other Faker versions are deleted when one is built.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        image_directory: str | None = None,
+        pool_size: int = 10_000,
+        locale: str = "en_US",
+        max_age_seconds: float | None = None,
+    ):
+        """
+        Args:
+            directory (str): Where pools are built, e.g. /tmp/faker_pools.
+            image_directory (str, optional): Read-only directory with prebuilt pools, checked first.
+            pool_size (int, optional): The number of values per pool. Defaults to 10,000.
+            locale (str, optional): The Faker locale. Defaults to "en_US".
+            max_age_seconds (float, optional): Rebuild pools older than this, with new values.
+                Defaults to None: pools are built from a fixed seed and never expire, so output
+                for a given seed is the same in every container with the same Faker version.
+        """
+        self.directory = pathlib.Path(directory)
+        self.image_directory = (
+            pathlib.Path(image_directory) if image_directory else None
+        )
+        self.pool_size = pool_size
+        self.locale = locale
+        self.max_age_seconds = max_age_seconds
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.pool_size > 0
+
+    def file_name(self, provider: str, kwargs: dict) -> str:
+        from faker import VERSION
+
+        arguments = hashlib.sha256(
+            json.dumps(kwargs, sort_keys=True).encode()
+        ).hexdigest()[:12]
+        return f"{provider}-{arguments}-{self.locale}-{self.pool_size}-faker{VERSION}.arrow"
+
+    def get_pool(self, provider: str, kwargs: dict | None = None) -> pa.Array:
+        """
+        Return the pool of values of a Faker provider, building it if there is no fresh one.
+
+        Args:
+            provider (str): The Faker method, e.g. "email".
+            kwargs (dict, optional): Arguments for the method.
+
+        Returns:
+            pyarrow.Array: The pool, backed by the memory-mapped file. Its type is inferred
+                from the values, e.g. int64 for "pyint".
+
+        Raises:
+            ValueError: If Arrow cannot store the provider's values, e.g. of mixed types.
+        """
+        kwargs = kwargs or {}
+        name = self.file_name(provider, kwargs)
+        with self._lock:
+            pool, loaded_at = self._pools.get(name, (None, 0.0))
+            if pool is not None and not self._expired(loaded_at):
+                return pool
+            path = self._find(name)
+            if path is None:
+                path = self._build(provider, kwargs, name)
+            pool = self._map(path)
+            self._pools[name] = (pool, path.stat().st_mtime)
+            return pool
+
+    def _expired(self, created_at: float) -> bool:
+        return (
+            self.max_age_seconds is not None
+            and time.time() - created_at > self.max_age_seconds
+        )
+
+    def _find(self, name: str) -> pathlib.Path | None:
+        for directory in (self.image_directory, self.directory):
+            if directory is None:
+                continue
+            path = directory / name
+            if path.exists() and not self._expired(path.stat().st_mtime):
+                return path
+        return None
+
+    def _map(self, path: pathlib.Path) -> pa.Array:
+        # The arrays reference the mapped file, nothing is read until a page is touched.
+        with pa.memory_map(str(path), "r") as source:
+            return pa.ipc.open_file(source).read_all().column("value").chunk(0)
+
+    def _build(self, provider: str, kwargs: dict, name: str) -> pathlib.Path:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.directory / name
+        # A file lock, so that worker processes starting together build a pool only once.
+        with open(self.directory / f"{name}.lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if path.exists() and not self._expired(path.stat().st_mtime):
+                return path
+            from faker import Faker
+            from column_generators import FAKER_PROVIDERS
+
+            start = time.perf_counter()
+            fake = Faker(self.locale, providers=FAKER_PROVIDERS)
+            # A fixed seed keeps pools identical across containers, unless pools are refreshed.
+            fake.seed_instance(0 if self.max_age_seconds is None else time.time_ns())
+            method = getattr(fake, provider)
+            values = [method(**kwargs) for _ in range(self.pool_size)]
+            try:
+                # The type follows the provider: strings, integers, dates, decimals...
+                values = pa.array(values)
+            except (pa.ArrowInvalid, pa.ArrowTypeError) as e:
+                raise ValueError(
+                    f"Faker provider {provider} returns values that cannot be stored "
+                    f"in an Arrow column. Error: {e}"
+                ) from e
+            table = pa.table({"value": values})
+            temp_path = path.with_suffix(".tmp")
+            with pa.OSFile(str(temp_path), "wb") as sink:
+                with pa.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+            os.replace(temp_path, path)
+            logger.info(
+                f"Built Faker pool {name} in {time.perf_counter() - start:.1f}s"
+            )
+        self._remove_other_versions(provider)
+        return path
+
+    def _remove_other_versions(self, provider: str) -> None:
+        from faker import VERSION
+
+        for path in self.directory.glob(f"{provider}-*.arrow"):
+            if not path.name.endswith(f"-faker{VERSION}.arrow"):
+                path.unlink(missing_ok=True)
+
+
+value_pools = ValuePoolCache(
+    directory=POOL_DIRECTORY,
+    image_directory=IMAGE_POOL_DIRECTORY,
+    pool_size=POOL_SIZE,
+    locale=POOL_LOCALE,
+    max_age_seconds=POOL_MAX_AGE_SECONDS,
+)
+
+
+def main():
+    cli_parser = argparse.ArgumentParser(
+        description="Build the Faker pools of every table spec, e.g. into the container image."
+    )
+    cli_parser.add_argument("--directory", default=IMAGE_POOL_DIRECTORY)
+    args = cli_parser.parse_args()
+
+    from table_spec import load_spec, SPEC_DIRECTORY
+
+    cache = ValuePoolCache(
+        directory=args.directory, pool_size=POOL_SIZE, locale=POOL_LOCALE
+    )
+    for spec_path in sorted(SPEC_DIRECTORY.iterdir()):
+        spec = load_spec(spec_path.stem)
+        # A dataset spec lists several table specs.
+        for table_spec in spec.get("tables", [spec]):
+            for column in table_spec["columns"]:
+                if column.get("type", "faker") == "faker":
+                    cache.get_pool(column["provider"], column.get("args"))
+
+
+if __name__ == "__main__":
+    main()
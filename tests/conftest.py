@@ -0,0 +1,144 @@
+import pathlib
+import sys
+
+import pytest
+
+# The lambda modules import each other as top-level modules.
+sys.path.insert(
+    0, str(pathlib.Path(__file__).parents[1] / "src" / "faker_to_snowflake")
+)
+
+from tests.stand_ins import (  # noqa: E402
+    FakeBoto3Session,
+    FakeSecretsManagerClient,
+    FakeSnowflakeConnection,
+    SnowpipeStandIn,
+)
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_configure(config):
+    """
+    Every run is saved (--benchmark-autosave in pyproject.toml). Once a run was saved on
+    this machine, the report compares against the latest one. A regression only fails the
+    suite when asked for, e.g. `pytest --benchmark-compare-fail=min:25%`: the benchmarks
+    run few rounds, on a shared machine a useful margin fails on noise. This is done here
+    rather than in addopts, because pytest-benchmark errors when there is nothing to compare with.
+    """
+    if not config.pluginmanager.hasplugin("benchmark"):
+        return
+    from pytest_benchmark.utils import get_machine_id
+
+    storage = config.option.benchmark_storage
+    if "://" not in storage:
+        storage = f"file://{storage}"
+    if config.option.benchmark_compare or not storage.startswith("file://"):
+        return
+    # --benchmark-storage, relative to the directory pytest was started in.
+    directory = config.invocation_params.dir / storage.removeprefix("file://")
+    if any((directory / get_machine_id()).glob("*.json")):
+        config.option.benchmark_compare = True
+
+
+@pytest.fixture(scope="session")
+def rsa_key() -> str:
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    return key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption(),
+    ).decode()
+
+
+@pytest.fixture(autouse=True)
+def unique_key_state(monkeypatch, tmp_path):
+    """
+    Keep the Bloom filters and ID sequences of the unique columns in a temporary directory,
+    so every test starts with no values seen.
+    """
+    from unique_keys import unique_keys
+
+    monkeypatch.setattr(unique_keys, "directory", str(tmp_path / "unique_keys"))
+    monkeypatch.setattr(unique_keys, "_columns", {})
+
+
+@pytest.fixture(scope="session", autouse=True)
+def value_pool_directory(tmp_path_factory):
+    """
+    Build the Faker pools of the test run in a temporary directory instead of /tmp/faker_pools.
+    The directory is shared by the session, every pool is built once.
+    """
+    from value_pools import value_pools
+
+    directory, pools = value_pools.directory, value_pools._pools
+    value_pools.directory = tmp_path_factory.mktemp("faker_pools")
+    value_pools._pools = {}
+    yield value_pools.directory
+    value_pools.directory, value_pools._pools = directory, pools
+
+
+@pytest.fixture
+def fake_connector(monkeypatch, tmp_path):
+    """
+    Replace snowflake.connector.connect. Returns the list of connections opened.
+    The table and pipe metadata, the stage manifest and the batch checkpoints are kept in temporary files.
+    """
+    import snowflake.connector
+    from connection_manager import connection_manager
+    from metadata_cache import metadata_cache
+    from stage_manifest import stage_manifest
+    from batch_checkpoints import batch_checkpoints
+
+    monkeypatch.setattr(metadata_cache, "path", str(tmp_path / "metadata.json"))
+    monkeypatch.setattr(stage_manifest, "path", str(tmp_path / "stage_manifest.json"))
+    monkeypatch.setattr(batch_checkpoints, "directory", str(tmp_path / "checkpoints"))
+
+    connections = []
+
+    def connect(**connect_args):
+        connection = FakeSnowflakeConnection(**connect_args)
+        connections.append(connection)
+        return connection
+
+    connection_manager.close()
+    monkeypatch.setattr(snowflake.connector, "connect", connect)
+    yield connections
+    connection_manager.close()
+
+
+@pytest.fixture
+def snowpipe():
+    with SnowpipeStandIn() as stand_in:
+        yield stand_in
+
+
+@pytest.fixture
+def secrets_manager(monkeypatch, rsa_key):
+    """
+    Serve a Snowflake secret from a fake Secrets Manager and point config at it.
+    """
+    import boto3
+    import config
+
+    client = FakeSecretsManagerClient(
+        {
+            "SNOWFLAKE_USER": "bench_user",
+            "SNOWFLAKE_PASSWORD": "password",
+            "SNOWFLAKE_ACCOUNT": "bench_account",
+            "SNOWFLAKE_WAREHOUSE": "bench_wh",
+            "SNOWFLAKE_DATABASE": "bench_db",
+            "SNOWFLAKE_SCHEMA": "bench_schema",
+            "SNOWFLAKE_ROLE": "bench_role",
+            "rsa_key": rsa_key,
+        }
+    )
+    monkeypatch.setattr(FakeBoto3Session, "client_instance", client)
+    monkeypatch.setattr(boto3, "Session", FakeBoto3Session)
+    monkeypatch.setattr(config, "secret_name", "bench-secret")
+    monkeypatch.setattr(config, "secret_cache_key", None)
+    monkeypatch.setattr(config.config, "_secret_cache", None)
+    yield client
+    config.config._secret_cache = None
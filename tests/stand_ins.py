@@ -0,0 +1,200 @@
+"""
+Local stand-ins for Snowflake, the Snowpipe REST API and AWS Secrets Manager,
+so the whole flow can run offline.
+"""
+
+import json
+import re
+import threading
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+
+class FakeCursor:
+    def __init__(self, connection: "FakeSnowflakeConnection"):
+        self.connection = connection
+        self.rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        pass
+
+    def execute(self, command: str, file_stream=None, **kwargs):
+        self.connection.statements.append(command)
+        put = re.match(r"PUT file://(\S+) @(\S+)", command)
+        remove = re.match(r"REMOVE @(\S+)(?: PATTERN='((?:[^'\\]|\\.)*)')?", command)
+        show = re.match(r"SHOW (TABLES|PIPES) LIKE '(\w+)'", command)
+        create_pipe = re.match(r"CREATE PIPE IF NOT EXISTS \S+\.(\w+) ", command)
+        list_stage = re.match(r"LIST @(\S+)", command)
+        self.rows = []
+        if put:
+            file_name, stage = put.groups()
+            data = file_stream.read() if file_stream else open(file_name, "rb").read()
+            self.connection.stages.setdefault(stage, {})[file_name] = data
+            self.connection.staged_at[file_name] = formatdate(usegmt=True)
+        elif remove:
+            stage, literal = remove.groups()
+            # Like Snowflake, read the pattern as a string literal: a backslash escapes the next character.
+            pattern = None if literal is None else re.sub(r"\\(.)", r"\1", literal)
+            files = self.connection.stages.setdefault(stage, {})
+            for file_name in list(files):
+                if pattern is None or re.fullmatch(pattern, file_name):
+                    del files[file_name]
+        elif show:
+            kind, name = show.groups()
+            objects = (
+                self.connection.tables if kind == "TABLES" else self.connection.pipes
+            )
+            self.rows = (
+                [("created_on", name.upper())] if name.upper() in objects else []
+            )
+        elif create_pipe:
+            self.connection.pipes.add(create_pipe.group(1).upper())
+        elif list_stage:
+            files = self.connection.stages.get(list_stage.group(1), {})
+            self.rows = [
+                (name, len(data), "", self.connection.staged_at[name])
+                for name, data in files.items()
+            ]
+        return self
+
+    def fetchall(self):
+        return self.rows
+
+
+class FakeSnowflakeConnection:
+    """
+    Records every statement. PUT stores the file bytes per stage, REMOVE deletes them, LIST lists them.
+    SHOW TABLES / SHOW PIPES answer from `tables` and `pipes`, CREATE PIPE adds to `pipes`.
+    """
+
+    # Objects every new connection starts with.
+    existing_tables = {"FAKE_SALES_ORDERS"}
+    existing_pipes = {"PIPE_FAKE_SALES_ORDERS"}
+
+    def __init__(self, **connect_args):
+        self.connect_args = connect_args
+        self.statements = []
+        self.stages = {}
+        self.staged_at = {}
+        self.tables = set(self.existing_tables)
+        self.pipes = set(self.existing_pipes)
+        self.closed = False
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def is_closed(self):
+        return self.closed
+
+    def close(self):
+        self.closed = True
+
+
+class SnowpipeStandIn:
+    """
+    A local HTTP server that mimics insertFiles, insertReport and loadHistoryScan.
+    Every registered file is reported as LOADED. The first `fail_first` requests get
+    `fail_status`: 429 (throttled) by default, or e.g. 503 for a transient server error.
+    """
+
+    def __init__(self, fail_first: int = 0, fail_status: int = 429):
+        self.registered = []
+        self.requests = []
+        self.fail_first = fail_first
+        self.fail_status = fail_status
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status: int, body: dict):
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _fails(self) -> bool:
+                stand_in.requests.append((self.command, self.path))
+                if stand_in.fail_first > 0:
+                    stand_in.fail_first -= 1
+                    self._reply(stand_in.fail_status, {"message": "try again"})
+                    return True
+                return False
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                if self._fails():
+                    return
+                if not urlparse(self.path).path.endswith("/insertFiles"):
+                    return self._reply(404, {})
+                files = [file["path"] for file in json.loads(body)["files"]]
+                stand_in.registered.extend(files)
+                self._reply(200, {"responseCode": "SUCCESS"})
+
+            def do_GET(self):
+                if self._fails():
+                    return
+                report = {
+                    "files": [
+                        {"path": path, "status": "LOADED"}
+                        for path in stand_in.registered
+                    ],
+                    "nextBeginMark": str(len(stand_in.registered)),
+                }
+                self._reply(200, report)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.base_url = f"http://127.0.0.1:{self.server.server_port}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class FakeSecretsManagerClient:
+    def __init__(self, secret: dict):
+        self.secret = secret
+        self.calls = 0
+
+    def get_secret_value(self, SecretId: str) -> dict:
+        self.calls += 1
+        return {"SecretString": json.dumps(self.secret)}
+
+
+class FakeLambdaClient:
+    """
+    Accepts every asynchronous invocation and records its arguments in `invocations`.
+    """
+
+    def __init__(self):
+        self.invocations = []
+
+    def invoke(self, **invoke_args) -> dict:
+        self.invocations.append(invoke_args)
+        return {"StatusCode": 202}
+
+
+class FakeBoto3Session:
+    """
+    Replaces boto3.Session, every client it creates is `client_instance`.
+    """
+
+    client_instance = None
+
+    def client(self, service_name: str, region_name=None, config=None):
+        return self.client_instance
@@ -0,0 +1,288 @@
+"""
+Performance benchmarks, run with pytest-benchmark.
+
+Every run is saved as a JSON baseline in .benchmarks/ (or --benchmark-storage) and compared
+with the previous run of the same machine. Regressions fail the suite only when asked for,
+e.g. with --benchmark-compare-fail=min:25% (see conftest.py).
+"""
+
+import io
+import re
+import shutil
+
+import pytest
+
+from fake_data_to_snowflake import generate_arrow, generate_data, generate_dataset
+from parquet_writer import ParquetSettings, write_parquet
+
+
+@pytest.mark.parametrize("rows", [1_000, 10_000, 100_000])
+def test_generate_data(benchmark, rows):
+    df = benchmark.pedantic(
+        generate_data, args=(rows,), kwargs={"seed": 1}, rounds=3, iterations=1
+    )
+    assert abs(len(df) - rows) <= 100
+    assert list(df.columns) == [
+        "name",
+        "email",
+        "address",
+        "ordered_at_utc",
+        "extracted_at_utc",
+        "sales_order_id",
+    ]
+
+
+def test_generate_dataset(benchmark):
+    import pyarrow.compute as pc
+
+    tables = benchmark.pedantic(
+        generate_dataset, args=(10_000,), kwargs={"seed": 1}, rounds=3, iterations=1
+    )
+    customers = tables["fake_customers"]
+    orders = tables["fake_orders"]
+    line_items = tables["fake_order_line_items"]
+    assert pc.all(pc.is_in(orders["customer_id"], customers["customer_id"])).as_py()
+    assert pc.all(pc.is_in(line_items["order_id"], orders["order_id"])).as_py()
+    assert set(pc.unique(line_items["order_id"]).to_pylist()) == set(
+        orders["order_id"].to_pylist()
+    )
+
+
+@pytest.mark.parametrize(
+    "settings",
+    [
+        ParquetSettings("snappy"),
+        ParquetSettings("zstd", 3),
+        ParquetSettings("snappy", use_dictionary=False),
+    ],
+    ids=repr,
+)
+def test_parquet_serialization(benchmark, settings):
+    table = generate_arrow(100_000, seed=1)
+
+    def serialize():
+        buffer = io.BytesIO()
+        write_parquet(table, buffer, settings)
+        return buffer.getbuffer().nbytes
+
+    size = benchmark.pedantic(serialize, rounds=5, iterations=1)
+    # Saved with the timings, so file sizes can be compared between runs too.
+    benchmark.extra_info["bytes"] = size
+    assert size > 0
+
+
+@pytest.mark.parametrize("sink", ["null", "parquet", "csv", "ndjson"])
+def test_generate_to_sink(benchmark, sink, tmp_path):
+    from sinks import generate_to_sinks, open_local_sink
+
+    opened = []
+
+    def open_sink(table):
+        opened.append(open_local_sink(sink, table, tmp_path))
+        return opened[-1]
+
+    def new_round():
+        shutil.rmtree(tmp_path / "fake_sales_orders", ignore_errors=True)
+        return (100_000, open_sink), {"chunk_size": 50_000, "seed": 1}
+
+    summary = benchmark.pedantic(
+        generate_to_sinks, setup=new_round, rounds=3, iterations=1
+    )
+    assert summary["rows"] == 100_000
+    if sink == "null":
+        assert opened[-1].rows == 100_000
+    else:
+        # The files of the last round, one per chunk.
+        assert len(list((tmp_path / "fake_sales_orders").glob(f"*.{sink}"))) == 2
+
+
+def test_jwt_generation(benchmark, rsa_key):
+    from sql_api_generate_jwt import JWTGenerator
+
+    # A new generator per call: key parsing, fingerprint and signature every time.
+    token = benchmark(
+        lambda: JWTGenerator("bench_account", "user", rsa_key).get_token()
+    )
+    assert token.count(".") == 2
+
+
+def test_jwt_generation_cached(benchmark, rsa_key):
+    from token_provider import token_provider
+
+    # The first call signs the token, every benchmarked call is a cache hit.
+    token_provider.get_token("bench_account", "user", rsa_key)
+    misses = token_provider.misses
+    # A cache hit takes microseconds, many calls per round keep timer noise out of the comparison.
+    token = benchmark.pedantic(
+        token_provider.get_token,
+        args=("bench_account", "user", rsa_key),
+        rounds=20,
+        iterations=1000,
+        warmup_rounds=1,
+    )
+    assert token.count(".") == 2
+    assert token_provider.misses == misses
+
+
+def test_main_flow(benchmark, fake_connector, snowpipe, secrets_manager, monkeypatch):
+    """
+    lambda_handler end to end: secret, generation, PUT, insertFiles and the cleanup
+    of the loaded files, against the local stand-ins.
+    """
+    monkeypatch.setenv("SNOWPIPE_BASE_URL", snowpipe.base_url)
+    import app
+
+    # Where the statements of each round start.
+    round_starts = []
+
+    def new_round():
+        round_starts.append(len(fake_connector[0].statements) if fake_connector else 0)
+        return ({"rows": 10_000, "seed": 1, "file_count": 2}, None), {}
+
+    result = benchmark.pedantic(
+        app.lambda_handler, setup=new_round, rounds=3, iterations=1
+    )
+
+    assert result["statusCode"] == 200
+    assert secrets_manager.calls == 1
+    # One session for all rounds.
+    assert len(fake_connector) == 1
+    statements = fake_connector[0].statements
+    # The table and pipe are looked up once, later rounds use the metadata cache.
+    assert sum(statement.startswith("SHOW") for statement in statements) == 2
+    last_round = statements[round_starts[-1] :]
+    assert sum(statement.startswith("PUT") for statement in last_round) == 2
+    # The stand-in reports every file as loaded, so each round removes its own two files.
+    removes = [statement for statement in last_round if statement.startswith("REMOVE")]
+    assert len(removes) == 1
+    assert " PATTERN=" in removes[-1]
+    # The regex escapes are doubled in the string literal.
+    assert all(
+        re.escape(name).replace("\\", "\\\\") in removes[-1]
+        for name in snowpipe.registered[-2:]
+    )
+    assert fake_connector[0].stages["%fake_sales_orders"] == {}
+
+    # The metrics of the last round.
+    from metrics import metrics
+
+    document = metrics.to_emf()
+    assert document["spec"] == "fake_sales_orders"
+    assert document["staged_files"] == 2
+    assert document["staged_bytes"] > 0
+    assert document["removed_files"] == 2
+    assert document["span_calls"]["put"] == 2
+    # The login and lookups ran in the background while the rows were generated.
+    assert document["span_calls"]["wait_for_setup"] == 1
+    assert 0 <= document["overlapped_setup_seconds"] <= document["setup_seconds"]
+    assert {"generate_seconds", "put_seconds", "insert_files_seconds"} <= {
+        metric["Name"] for metric in document["_aws"]["CloudWatchMetrics"][0]["Metrics"]
+    }
+
+
+def test_fan_out(benchmark, fake_connector, snowpipe, rsa_key, monkeypatch):
+    """
+    The coordinator splits the rows over a local process pool and registers
+    the files staged by all workers with one insertFiles request.
+    """
+    monkeypatch.setenv("SNOWPIPE_BASE_URL", snowpipe.base_url)
+    from orchestrator import fan_out, LocalDispatcher
+
+    dispatcher = LocalDispatcher(processes=2)
+    job_args = dict(
+        rows_per_job=50_000,
+        seed=1,
+        file_count=1,
+        database="bench_db",
+        schema="bench_schema",
+        user="bench_user",
+        password="password",
+        account="bench_account",
+        role="bench_role",
+        warehouse="bench_wh",
+        rsa_key=rsa_key,
+    )
+
+    def new_round():
+        snowpipe.registered.clear()
+        snowpipe.requests.clear()
+        return (200_000, dispatcher), job_args
+
+    summary = benchmark.pedantic(fan_out, setup=new_round, rounds=3, iterations=1)
+
+    assert summary == {"jobs": 4, "rows": 200_000, "files": 4}
+    assert len(snowpipe.registered) == 4
+    assert len(set(snowpipe.registered)) == 4
+    insert_requests = [path for method, path in snowpipe.requests if method == "POST"]
+    assert len(insert_requests) == 1
+
+
+def test_resume_batch(benchmark, fake_connector, snowpipe, rsa_key, monkeypatch):
+    """
+    Retry of a batch whose insertFiles and write_pandas fallback both failed: the files
+    staged by the failed attempt are registered, nothing is generated or uploaded again.
+    """
+    monkeypatch.setenv("SNOWPIPE_BASE_URL", snowpipe.base_url)
+    from fake_data_to_snowflake import main
+    from snowflake_loader import SnowflakeDataLoader
+    from snowpipe_client import SnowpipeClient
+
+    def fail(*args, **kwargs):
+        raise ValueError("Failed to trigger Snowpipe.")
+
+    load_args = dict(
+        seed=1,
+        file_count=2,
+        stage_cleanup=False,
+        database="bench_db",
+        schema="bench_schema",
+        user="bench_user",
+        password="password",
+        account="bench_account",
+        role="bench_role",
+        warehouse="bench_wh",
+        rsa_key=rsa_key,
+    )
+    batch_ids = iter(range(100))
+    # Where the statements of each round start.
+    round_starts = []
+
+    def failed_attempt():
+        round_starts.append(len(fake_connector[0].statements) if fake_connector else 0)
+        snowpipe.registered.clear()
+        batch_id = f"batch-{next(batch_ids)}"
+        with monkeypatch.context() as patch:
+            patch.setattr(SnowpipeClient, "insert_files", fail)
+            patch.setattr(SnowflakeDataLoader, "load_using_write_pandas", fail)
+            with pytest.raises(ValueError):
+                main(10_000, batch_id=batch_id, **load_args)
+        return (10_000,), dict(batch_id=batch_id, **load_args)
+
+    benchmark.pedantic(main, setup=failed_attempt, rounds=3, iterations=1)
+
+    last_round = fake_connector[0].statements[round_starts[-1] :]
+    staged = [
+        re.match(r"PUT file://(\S+)", s).group(1)
+        for s in last_round
+        if s.startswith("PUT")
+    ]
+    # Only the failed attempt uploaded files, the retry registered exactly those.
+    assert len(staged) == 2
+    assert sorted(snowpipe.registered) == sorted(staged)
+
+    from metrics import metrics
+
+    document = metrics.to_emf()
+    assert document["resumed_batches"] == 1
+    assert document["reused_files"] == 2
+    assert "generate_seconds" not in document
+
+
+def test_import_time():
+    """
+    The cold start check of `benchmark.py import-time`: `import app` stays within its
+    budget and imports none of the deferred modules, pandas included.
+    """
+    from benchmark import check_import_time, IMPORT_TIME_BUDGET_MS
+
+    assert check_import_time("app", IMPORT_TIME_BUDGET_MS)
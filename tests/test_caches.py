@@ -0,0 +1,251 @@
+"""
+Behaviour of the process-wide caches and state files: secret, value pools, file sizes,
+metadata, stage manifest and batch checkpoints.
+"""
+
+import time
+
+import pytest
+
+
+def test_secret_cache_refreshes_on_access(secrets_manager):
+    from SecretsManager import SecretCache
+
+    cache = SecretCache("bench-secret", "us-east-1", ttl_seconds=60)
+    assert cache.get()["SNOWFLAKE_USER"] == "bench_user"
+    assert cache.get()["SNOWFLAKE_USER"] == "bench_user"
+    assert secrets_manager.calls == 1
+
+    # Expired: the access itself fetches the rotated secret, no thread is involved.
+    secrets_manager.secret = dict(secrets_manager.secret, SNOWFLAKE_USER="rotated")
+    cache._fetched_at -= 61
+    assert cache.get()["SNOWFLAKE_USER"] == "rotated"
+    assert secrets_manager.calls == 2
+    assert cache._refresh_thread is None
+
+
+def test_secret_cache_keeps_values_when_refresh_fails(secrets_manager, monkeypatch):
+    from SecretsManager import SecretCache
+
+    cache = SecretCache("bench-secret", "us-east-1", ttl_seconds=60)
+    cache.get()
+
+    def unavailable(SecretId):
+        raise ConnectionError("Secrets Manager is unavailable")
+
+    monkeypatch.setattr(secrets_manager, "get_secret_value", unavailable)
+    cache._fetched_at -= 61
+    assert cache.get()["SNOWFLAKE_USER"] == "bench_user"
+
+
+def test_secret_cache_background_refresh(secrets_manager, monkeypatch):
+    import threading
+    from SecretsManager import SecretCache
+
+    cache = SecretCache(
+        "bench-secret", "us-east-1", ttl_seconds=60, background_refresh=True
+    )
+    cache.get()
+    secrets_manager.secret = dict(secrets_manager.secret, SNOWFLAKE_USER="rotated")
+    cache._fetched_at -= 61
+    # Hold the fetch of the thread, or it may finish before the expired values are returned.
+    served = threading.Event()
+    get_secret_value = secrets_manager.get_secret_value
+
+    def slow_get_secret_value(SecretId):
+        served.wait(timeout=5)
+        return get_secret_value(SecretId=SecretId)
+
+    monkeypatch.setattr(secrets_manager, "get_secret_value", slow_get_secret_value)
+    # The expired values are served while the thread fetches the new ones.
+    assert cache.get()["SNOWFLAKE_USER"] == "bench_user"
+    served.set()
+    cache._refresh_thread.join(timeout=5)
+    assert cache.get()["SNOWFLAKE_USER"] == "rotated"
+    assert time.time() - cache._fetched_at < 60
+
+
+def test_value_pool_rebuilt_for_a_new_faker_version(tmp_path):
+    from faker import VERSION
+    from value_pools import ValuePoolCache
+
+    cache = ValuePoolCache(str(tmp_path), pool_size=100)
+    stale = tmp_path / "email-0123456789ab-en_US-100-faker1.0.0.arrow"
+    stale.write_bytes(b"")
+
+    pool = cache.get_pool("email")
+    assert len(pool) == 100
+    assert [path.name for path in tmp_path.glob("*.arrow")] == [
+        cache.file_name("email", {})
+    ]
+    assert cache.file_name("email", {}).endswith(f"-faker{VERSION}.arrow")
+    # Another cache of the same directory maps the built pool, with the same values.
+    assert ValuePoolCache(str(tmp_path), pool_size=100).get_pool("email") == pool
+
+
+def test_value_pool_expires(tmp_path):
+    import os
+    from value_pools import ValuePoolCache
+
+    cache = ValuePoolCache(str(tmp_path), pool_size=100, max_age_seconds=60)
+    pool = cache.get_pool("email")
+    path = tmp_path / cache.file_name("email", {})
+    old = time.time() - 120
+    os.utime(path, (old, old))
+    cache._pools = {}
+
+    assert cache.get_pool("email") != pool
+    assert path.stat().st_mtime > old
+
+
+def test_value_pool_image_directory_first(tmp_path):
+    from value_pools import ValuePoolCache
+
+    image = ValuePoolCache(str(tmp_path / "image"), pool_size=100)
+    pool = image.get_pool("email")
+    cache = ValuePoolCache(
+        str(tmp_path / "tmp"), image_directory=str(tmp_path / "image"), pool_size=100
+    )
+
+    assert cache.get_pool("email") == pool
+    assert not (tmp_path / "tmp").exists()
+
+
+def test_value_pool_types(tmp_path):
+    import pyarrow as pa
+    from value_pools import ValuePoolCache
+
+    cache = ValuePoolCache(str(tmp_path), pool_size=100)
+
+    assert cache.get_pool("pyint").type == pa.int64()
+    assert cache.get_pool("date_object").type == pa.date32()
+    assert cache.get_pool(
+        "pydecimal", {"left_digits": 4, "right_digits": 2}
+    ).type == pa.decimal128(6, 2)
+    with pytest.raises(ValueError, match="pytuple"):
+        cache.get_pool("pytuple")
+
+
+def test_pooled_columns_use_the_whole_pool():
+    """Only a cardinality set in the spec limits the distinct values of a pooled column."""
+    from datetime import datetime
+
+    import numpy as np
+    import pyarrow as pa
+    from table_spec import compile_spec
+    from value_pools import value_pools
+
+    plan = compile_spec(
+        {
+            "table": "fake_customers",
+            "columns": [
+                {"name": "name", "provider": "name"},
+                {"name": "email", "provider": "email", "cardinality": 50},
+                {"name": "score", "provider": "pyint", "null_rate": 0.5},
+            ],
+        }
+    )
+    table = plan.generate(
+        20_000, rng=np.random.default_rng(1), now=datetime(2026, 1, 1)
+    )
+
+    assert len(table["name"].unique()) > 5_000
+    assert len(table["name"].unique()) <= value_pools.pool_size
+    assert len(table["email"].unique()) == 50
+    assert table["score"].type.value_type == pa.int64()
+    assert 9_000 < table["score"].null_count < 11_000
+
+
+def test_file_sizer():
+    from file_sizing import FileSizer
+
+    sizer = FileSizer(target_bytes=1_000, smoothing=0.5)
+    # Without an estimate every batch is one file.
+    assert sizer.file_count("orders", 10_000) == 1
+
+    sizer.observe("orders", rows=1_000, size=500)
+    assert sizer.file_count("orders", 10_000) == 5
+    # Later files move the estimate by `smoothing` of the difference.
+    sizer.observe("orders", rows=1_000, size=1_500)
+    assert sizer.bytes_per_row("orders") == 1.0
+    assert sizer.file_count("orders", 10_000) == 10
+    # Never more files than rows, estimates are per table.
+    assert sizer.file_count("orders", 3) == 1
+    sizer.observe("orders", rows=1, size=10_000)
+    assert sizer.file_count("orders", 3) == 3
+    assert sizer.file_count("customers", 10_000) == 1
+
+
+def increment(path: str, times: int) -> None:
+    from json_state import locked_update
+
+    for _ in range(times):
+        with locked_update(path, "counter") as state:
+            state["count"] = state.get("count", 0) + 1
+
+
+def test_locked_update_across_processes(tmp_path):
+    import multiprocessing
+    from json_state import read_json
+
+    path = str(tmp_path / "state" / "counter.json")
+    processes = [
+        multiprocessing.get_context("fork").Process(target=increment, args=(path, 50))
+        for _ in range(4)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+    # No process overwrote the increments of another.
+    assert read_json(path, "counter") == {"count": 200}
+
+
+def test_metadata_cache_shared_by_processes(tmp_path):
+    from metadata_cache import MetadataCache
+
+    path = str(tmp_path / "metadata.json")
+    first, second = MetadataCache(path), MetadataCache(path)
+    first.set("db.schema.orders", table_exists=True)
+    second.set("db.schema.customers", table_exists=False)
+
+    assert first.get("db.schema.customers") == second.get("db.schema.customers")
+    assert second.get("db.schema.orders")["table_exists"]
+    first.invalidate("db.schema.orders")
+    assert second.get("db.schema.orders") is None
+
+
+def test_stage_manifest_shared_by_processes(tmp_path):
+    from stage_manifest import StageManifest
+
+    path = str(tmp_path / "stage_manifest.json")
+    first, second = StageManifest(path), StageManifest(path)
+    first.record("orders", ["a.parquet"], "batch-1")
+    second.record("orders", ["b.parquet"], "batch-2")
+    second.mark_loaded("orders", ["a.parquet"])
+
+    assert first.due_for_removal("orders", retention_seconds=3600) == ["a.parquet"]
+    first.forget("orders", ["a.parquet", "b.parquet"])
+    assert second.files("orders") == {}
+
+
+def test_batch_checkpoints_shared_by_processes(tmp_path):
+    from batch_checkpoints import BatchCheckpoints, STAGED
+
+    first, second = BatchCheckpoints(str(tmp_path)), BatchCheckpoints(str(tmp_path))
+    seed = first.start("request-1", seed=7)
+    assert second.start("request-1") == seed == 7
+
+    first.mark_staged("request-1", "orders", ["a.parquet", "b.parquet"])
+    second.mark_registered("request-1", "orders", ["a.parquet"])
+    first.mark_registered("request-1", "orders", ["b.parquet"])
+    assert second.get("request-1", "orders") == {
+        "step": STAGED,
+        "files": ["a.parquet", "b.parquet"],
+        "registered": ["a.parquet", "b.parquet"],
+    }
+    # A batch that was not started records nothing.
+    first.mark_staged("request-2", "orders", ["c.parquet"])
+    assert second.get("request-2", "orders") == {}
+    assert not (tmp_path / "request-2.json").exists()
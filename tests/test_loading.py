@@ -0,0 +1,469 @@
+"""
+Behaviour of the load paths against the local stand-ins: retries, fallbacks and cleanup.
+Unlike test_benchmarks.py these are not timed.
+"""
+
+import pytest
+
+from fake_data_to_snowflake import generate_arrow
+
+CONNECTION_ARGS = dict(
+    database="bench_db",
+    schema="bench_schema",
+    user="bench_user",
+    password="password",
+    account="bench_account",
+    role="bench_role",
+    warehouse="bench_wh",
+)
+
+
+@pytest.fixture
+def loading(fake_connector, snowpipe, rsa_key, monkeypatch):
+    """
+    Point the loader at the stand-ins, without waits between retries.
+    Returns the connection arguments.
+    """
+    import snowflake_loader
+    from metrics import metrics
+
+    monkeypatch.setenv("SNOWPIPE_BASE_URL", snowpipe.base_url)
+    monkeypatch.setattr(snowflake_loader, "CHUNK_RETRY_SECONDS", 0)
+    metrics.reset(spec="fake_sales_orders")
+    return dict(CONNECTION_ARGS, rsa_key=rsa_key)
+
+
+def failing_calls(real, failures: int, calls: list):
+    """
+    Wrap the method `real` so that its first `failures` calls raise. Every call is appended to `calls`.
+    """
+
+    def method(self, *args, **kwargs):
+        calls.append(args)
+        if len(calls) <= failures:
+            raise ValueError("Failed to trigger Snowpipe.")
+        return real(self, *args, **kwargs)
+
+    return method
+
+
+def test_stream_falls_back_per_chunk(loading, snowpipe, monkeypatch):
+    """
+    A chunk that fails every Snowpipe attempt is loaded with write_pandas on its own,
+    the next chunks go through Snowpipe again.
+    """
+    from fake_data_to_snowflake import data_chunks_to_snowflake
+    from metrics import metrics
+    from snowflake_loader import SnowflakeDataLoader, CHUNK_LOAD_ATTEMPTS
+    from snowpipe_client import SnowpipeClient
+
+    calls, written = [], []
+    monkeypatch.setattr(
+        SnowpipeClient,
+        "insert_files",
+        failing_calls(SnowpipeClient.insert_files, CHUNK_LOAD_ATTEMPTS, calls),
+    )
+    monkeypatch.setattr(
+        SnowflakeDataLoader,
+        "load_using_write_pandas",
+        lambda self, warehouse, df=None: written.append(len(df)),
+    )
+    chunks = [generate_arrow(1_000, seed=seed) for seed in range(3)]
+
+    data_chunks_to_snowflake(iter(chunks), **loading)
+
+    # The retries registered the files staged by the first attempt, nothing was uploaded twice.
+    assert calls[0] == calls[1] == calls[2]
+    assert written == [len(chunks[0])]
+    assert len(snowpipe.registered) == 2
+    document = metrics.to_emf()
+    assert document["chunk_retries"] == CHUNK_LOAD_ATTEMPTS - 1
+    assert document["write_pandas_fallbacks"] == 1
+    assert document["staged_files"] == 3
+
+
+def test_stream_stops_on_a_lost_chunk(loading, snowpipe, monkeypatch):
+    """
+    A chunk that write_pandas cannot load either stops the stream instead of being dropped.
+    """
+    from fake_data_to_snowflake import data_chunks_to_snowflake
+    from metrics import metrics
+    from snowflake_loader import SnowflakeDataLoader
+    from snowpipe_client import SnowpipeClient
+
+    def fail(*args, **kwargs):
+        raise ValueError("Failed to trigger Snowpipe.")
+
+    monkeypatch.setattr(SnowpipeClient, "insert_files", fail)
+    monkeypatch.setattr(SnowflakeDataLoader, "load_using_write_pandas", fail)
+    chunks = iter([generate_arrow(1_000, seed=seed) for seed in range(3)])
+
+    with pytest.raises(ValueError):
+        data_chunks_to_snowflake(chunks, **loading)
+
+    assert metrics.to_emf()["failed_chunks"] == 1
+    # The remaining chunks were not pulled.
+    assert len(list(chunks)) == 2
+
+
+def test_stream_retry_resumes_per_chunk(loading, snowpipe, fake_connector, monkeypatch):
+    """
+    A retried streaming batch skips the chunks the failed attempt loaded and registers
+    the files it staged, instead of loading them twice.
+    """
+    from batch_checkpoints import batch_checkpoints
+    from fake_data_to_snowflake import data_chunks_to_snowflake
+    from snowflake_loader import SnowflakeDataLoader
+    from snowpipe_client import SnowpipeClient
+
+    insert_files = SnowpipeClient.insert_files
+    attempts = []
+
+    def fail_second_chunk(self, file_names, *args, **kwargs):
+        attempts.append(list(file_names))
+        if len(attempts) > 1:
+            raise ValueError("Failed to trigger Snowpipe.")
+        return insert_files(self, file_names, *args, **kwargs)
+
+    def fail(*args, **kwargs):
+        raise ValueError("Failed to load.")
+
+    def puts():
+        return sum(
+            statement.startswith("PUT")
+            for connection in fake_connector
+            for statement in connection.statements
+        )
+
+    chunks = [generate_arrow(1_000, seed=seed) for seed in range(3)]
+    batch_checkpoints.start("stream-batch", seed=1)
+    with monkeypatch.context() as failing:
+        failing.setattr(SnowpipeClient, "insert_files", fail_second_chunk)
+        failing.setattr(SnowflakeDataLoader, "load_using_write_pandas", fail)
+        with pytest.raises(ValueError):
+            data_chunks_to_snowflake(iter(chunks), batch_id="stream-batch", **loading)
+    assert puts() == 2
+
+    data_chunks_to_snowflake(iter(chunks), batch_id="stream-batch", **loading)
+
+    # Only the third chunk was uploaded, the second one's staged file was registered.
+    assert puts() == 3
+    assert snowpipe.registered[:2] == [attempts[0][0], attempts[1][0]]
+    assert len(snowpipe.registered) == len(set(snowpipe.registered)) == 3
+
+
+@pytest.fixture
+def fast_retries(monkeypatch):
+    """
+    A Snowpipe session that retries twice without waiting, instead of the backoff of get_session.
+    """
+    import snowpipe_client
+
+    monkeypatch.setattr(snowpipe_client, "_session", None)
+    return snowpipe_client.get_session(max_retries=2, backoff_factor=0)
+
+
+def snowpipe_client_for(snowpipe):
+    from snowpipe_client import SnowpipeClient
+
+    return SnowpipeClient(
+        "bench_account",
+        "bench_db.bench_schema.pipe",
+        lambda: "token",
+        snowpipe.base_url,
+    )
+
+
+@pytest.mark.parametrize("status", [429, 503])
+def test_snowpipe_retries(snowpipe, fast_retries, status):
+    """
+    Throttled and failed requests are retried by the session, until the retries run out.
+    """
+    client = snowpipe_client_for(snowpipe)
+    snowpipe.fail_status = status
+    snowpipe.fail_first = 2
+    client.insert_files(["a.parquet"])
+    assert snowpipe.registered == ["a.parquet"]
+    assert len(snowpipe.requests) == 3
+
+    snowpipe.fail_first = 3
+    with pytest.raises(ValueError):
+        client.insert_files(["b.parquet"])
+    assert snowpipe.registered == ["a.parquet"]
+
+
+def test_wait_for_load(snowpipe):
+    """
+    Files reported with a final status are returned, files still loading are left out at the timeout.
+    """
+    client = snowpipe_client_for(snowpipe)
+    client.insert_files(["a.parquet", "b.parquet"])
+
+    statuses = client.wait_for_load(
+        ["a.parquet", "b.parquet", "loading.parquet"], timeout=0.3, poll_interval=0.05
+    )
+    assert statuses == {"a.parquet": "LOADED", "b.parquet": "LOADED"}
+
+
+def test_confirm_load(loading, fake_connector, snowpipe):
+    """
+    With confirm_load the files are removed from the stage and the manifest once Snowpipe reports them loaded.
+    """
+    from fake_data_to_snowflake import data_to_snowflake
+    from stage_manifest import stage_manifest
+
+    data_to_snowflake(
+        generate_arrow(1_000, seed=1), file_count=2, confirm_load=True, **loading
+    )
+
+    assert len(snowpipe.registered) == 2
+    assert fake_connector[0].stages["%fake_sales_orders"] == {}
+    assert stage_manifest.files("bench_db.bench_schema.fake_sales_orders") == {}
+
+
+def stage_loader(loading: dict, data=None):
+    from snowflake_loader import SnowflakeDataLoader
+
+    return SnowflakeDataLoader(
+        data,
+        table="fake_sales_orders",
+        file_count=2,
+        **{name: value for name, value in loading.items() if name != "warehouse"},
+    )
+
+
+def test_remove_staged_files(loading, fake_connector):
+    """
+    REMOVE matches exactly the given names: the regex escapes survive the string literal.
+    """
+    loader = stage_loader(loading)
+    loader.get_connection()
+    stage = fake_connector[0].stages.setdefault("%fake_sales_orders", {})
+    for name in ("batch-1.parquet", "batch-1xparquet", "it's.parquet"):
+        stage[f"/tmp/staged/{name}"] = b""
+
+    loader.remove_staged_files(["batch-1.parquet", "it's.parquet"])
+    assert list(stage) == ["/tmp/staged/batch-1xparquet"]
+
+
+def test_sweep_stage(loading, fake_connector):
+    """
+    sweep_stage removes the expired files of the table stage, also those another container staged.
+    """
+
+    loader = stage_loader(loading, generate_arrow(1_000, seed=1))
+    staged = loader.upload_files_to_stage()
+    stage = fake_connector[0].stages["%fake_sales_orders"]
+    stage["/tmp/other_container/lost.parquet"] = b""
+    fake_connector[0].staged_at[
+        "/tmp/other_container/lost.parquet"
+    ] = "Thu, 01 Jan 2026 00:00:00 GMT"
+
+    assert loader.sweep_stage(retention_seconds=3600) == ["lost.parquet"]
+    assert len(stage) == 2
+    assert sorted(loader.sweep_stage(retention_seconds=-60)) == sorted(staged)
+    assert stage == {}
+
+
+def test_stream_daemon(loading, snowpipe):
+    """
+    The daemon loads every batch it generated, then stops at the end of its duration.
+    """
+    from stream_daemon import StreamDaemon
+
+    daemon = StreamDaemon(
+        rows_per_second=20_000,
+        batch_rows=1_000,
+        seed=1,
+        duration=0.5,
+        report_interval=0.1,
+    )
+    daemon.run(**loading)
+
+    assert daemon.generated_rows > 0
+    assert daemon.uploaded_rows == daemon.generated_rows
+    assert len(snowpipe.registered) == daemon.generated_rows // 1_000
+
+
+def test_stream_daemon_stops_on_a_lost_batch(loading, monkeypatch):
+    """
+    A batch that can be loaded neither with Snowpipe nor with write_pandas stops the daemon.
+    """
+    from snowflake_loader import SnowflakeDataLoader
+    from snowpipe_client import SnowpipeClient
+    from stream_daemon import StreamDaemon
+
+    def fail(*args, **kwargs):
+        raise ValueError("Failed to trigger Snowpipe.")
+
+    monkeypatch.setattr(SnowpipeClient, "insert_files", fail)
+    monkeypatch.setattr(SnowflakeDataLoader, "load_using_write_pandas", fail)
+    daemon = StreamDaemon(rows_per_second=20_000, batch_rows=1_000, seed=1)
+
+    with pytest.raises(ValueError):
+        daemon.run(**loading)
+    assert daemon.stopping.is_set()
+    assert daemon.uploaded_rows == 0
+
+
+def test_stream_daemon_raises_a_generation_failure(loading, snowpipe, monkeypatch):
+    """
+    A batch that cannot be generated stops the daemon, which raises once the batches
+    generated before are loaded.
+    """
+    import stream_daemon
+    from stream_daemon import StreamDaemon
+
+    generate_shard = stream_daemon.generate_shard
+
+    def fail_third_batch(batch_index, *args):
+        if batch_index == 2:
+            raise ValueError("Column n: unknown Faker provider.")
+        return generate_shard(batch_index, *args)
+
+    monkeypatch.setattr(stream_daemon, "generate_shard", fail_third_batch)
+    daemon = StreamDaemon(rows_per_second=20_000, batch_rows=1_000, seed=1)
+
+    with pytest.raises(ValueError, match="unknown Faker provider"):
+        daemon.run(**loading)
+    assert daemon.stopping.is_set()
+    assert daemon.uploaded_rows == daemon.generated_rows == 2_000
+    assert len(snowpipe.registered) == 2
+
+
+def test_fan_out_failed_sub_job(loading, snowpipe, monkeypatch):
+    """
+    The files of the sub-jobs that succeeded are registered before the failure is raised.
+    """
+    import orchestrator
+    from orchestrator import fan_out, LocalDispatcher
+
+    run_sub_job = orchestrator.run_sub_job
+
+    def fail_second_job(job, **connection_args):
+        if job["job_id"].endswith("-1"):
+            raise ValueError("Worker out of memory")
+        return run_sub_job(job, **connection_args)
+
+    # Forked workers see the patched function.
+    monkeypatch.setattr(orchestrator, "run_sub_job", fail_second_job)
+    with pytest.raises(RuntimeError, match="1 of 3 sub-jobs failed"):
+        fan_out(
+            30_000,
+            LocalDispatcher(processes=2),
+            rows_per_job=10_000,
+            seed=1,
+            file_count=1,
+            **loading,
+        )
+    assert len(snowpipe.registered) == 2
+
+
+def test_fan_out_rejects_datasets(loading):
+    from orchestrator import fan_out, LocalDispatcher
+
+    with pytest.raises(ValueError, match="dataset"):
+        fan_out(1_000, LocalDispatcher(processes=1), spec="fake_sales", **loading)
+
+
+def test_fan_out_counts_the_write_pandas_job(loading, snowpipe, monkeypatch):
+    """
+    Without the table, the coordinator loads the first sub-job with write_pandas and the
+    workers stage the others once the pipe exists.
+    """
+    from snowflake.connector import pandas_tools
+    from orchestrator import fan_out, LocalDispatcher
+    from tests.stand_ins import FakeSnowflakeConnection
+
+    monkeypatch.setattr(FakeSnowflakeConnection, "existing_tables", set())
+    monkeypatch.setattr(FakeSnowflakeConnection, "existing_pipes", set())
+    written = []
+
+    def write_pandas(connection, df, table_name, **kwargs):
+        written.append(len(df))
+        connection.tables.add(table_name.upper())
+
+    monkeypatch.setattr(pandas_tools, "write_pandas", write_pandas)
+
+    summary = fan_out(
+        30_000,
+        LocalDispatcher(processes=2),
+        rows_per_job=10_000,
+        seed=1,
+        file_count=1,
+        **loading,
+    )
+
+    assert summary == {"jobs": 3, "rows": 30_000, "files": 2}
+    assert written == [10_000]
+    assert len(snowpipe.registered) == 2
+
+
+def test_lambda_dispatcher_queues_workers(
+    loading, snowpipe, fake_connector, monkeypatch
+):
+    """
+    Sub-jobs are invoked asynchronously and the workers register their own files, then
+    clean up the stage. A retried worker neither stages nor registers its files again.
+    """
+    import json
+    import boto3
+    from datetime import datetime
+    from orchestrator import plan_sub_jobs, run_sub_job, LambdaDispatcher
+    from tests.stand_ins import FakeBoto3Session, FakeLambdaClient
+
+    client = FakeLambdaClient()
+    monkeypatch.setattr(FakeBoto3Session, "client_instance", client)
+    monkeypatch.setattr(boto3, "Session", FakeBoto3Session)
+    jobs = plan_sub_jobs(30_000, 10_000, seed=1, now=datetime(2026, 1, 1), file_count=1)
+
+    results = LambdaDispatcher("worker", concurrency=2).dispatch(jobs)
+
+    assert [result["rows"] for result in results] == [10_000] * 3
+    assert all(result["files"] == [] for result in results)
+    assert {invocation["InvocationType"] for invocation in client.invocations} == {
+        "Event"
+    }
+    sub_jobs = [json.loads(call["Payload"])["sub_job"] for call in client.invocations]
+    assert all(sub_job["register"] for sub_job in sub_jobs)
+
+    connection_args = {k: v for k, v in loading.items() if k != "warehouse"}
+    worker_results = [run_sub_job(sub_job, **connection_args) for sub_job in sub_jobs]
+    assert sorted(snowpipe.registered) == sorted(
+        file for result in worker_results for file in result["files"]
+    )
+    # The stand-in reports every registered file as loaded, the cleanup removed them all.
+    stages = [
+        connection.stages["%fake_sales_orders"]
+        for connection in fake_connector
+        if "%fake_sales_orders" in connection.stages
+    ]
+    assert stages and not any(stages)
+    puts = sum(
+        statement.startswith("PUT")
+        for connection in fake_connector
+        for statement in connection.statements
+    )
+
+    retried = run_sub_job(sub_jobs[0], **connection_args)
+    assert retried == worker_results[0]
+    assert len(snowpipe.registered) == 3
+    assert puts == sum(
+        statement.startswith("PUT")
+        for connection in fake_connector
+        for statement in connection.statements
+    )
+
+
+def test_fan_out_without_rows(loading, snowpipe, monkeypatch):
+    """
+    Without the table the coordinator would load the first sub-job itself, there is none.
+    """
+    from orchestrator import fan_out, LocalDispatcher
+    from tests.stand_ins import FakeSnowflakeConnection
+
+    monkeypatch.setattr(FakeSnowflakeConnection, "existing_tables", set())
+    summary = fan_out(0, LocalDispatcher(processes=1), seed=1, **loading)
+
+    assert summary == {"jobs": 0, "rows": 0, "files": 0}
+    assert snowpipe.registered == []
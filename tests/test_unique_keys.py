@@ -0,0 +1,182 @@
+"""
+Behaviour of the uniqueness layer: the Bloom filter, its generations, ULIDs and sequences.
+"""
+
+from datetime import datetime, timedelta
+
+import numpy as np
+import pyarrow as pa
+
+from unique_keys import (
+    BloomFilter,
+    UniqueKeys,
+    UniqueValues,
+    hash_values,
+    UNIQUE_KEYS_CAPACITY,
+    UNIQUE_KEYS_ERROR_RATE,
+)
+
+
+def random_hashes(count: int, seed: int) -> np.ndarray:
+    return np.random.default_rng(seed).integers(0, 2**64, size=count, dtype=np.uint64)
+
+
+def test_bloom_filter_error_rate(tmp_path):
+    bloom = BloomFilter(str(tmp_path / "test.bloom"), capacity=100_000, error_rate=0.01)
+    added = random_hashes(100_000, seed=1)
+    bloom.add(added)
+
+    # No false negatives, and false positives close to the rate it was sized for.
+    assert bloom.contains(added).all()
+    false_positive_rate = bloom.contains(random_hashes(200_000, seed=2)).mean()
+    assert false_positive_rate < 0.01 * 1.3
+
+
+def test_bloom_filter_default_size(tmp_path):
+    bloom = BloomFilter(
+        str(tmp_path / "test.bloom"), UNIQUE_KEYS_CAPACITY, UNIQUE_KEYS_ERROR_RATE
+    )
+    # About 2.8 MB per million values at 0.1%: 28 MB for the default 10 million.
+    assert 25 < bloom.words.nbytes / 2**20 < 31
+
+
+def test_bloom_filter_persists(tmp_path):
+    path = str(tmp_path / "test.bloom")
+    hashes = random_hashes(1_000, seed=1)
+    BloomFilter(path, capacity=1_000, error_rate=0.01).add(hashes)
+
+    assert BloomFilter(path, capacity=1_000, error_rate=0.01).contains(hashes).all()
+    # Another size does not fit the file, it starts empty.
+    assert not BloomFilter(path, capacity=5_000, error_rate=0.01).contains(hashes).any()
+
+
+def test_hash_values():
+    values = pa.array(["jane@example.org", "", None, "jane@example.org\0", "jane"])
+    hashes = hash_values(values)
+    assert len(set(hashes[[0, 1, 3, 4]])) == 4
+    # The same hash however the values are stored.
+    assert (
+        hash_values(values.dictionary_encode())[[0, 1, 3, 4]] == hashes[[0, 1, 3, 4]]
+    ).all()
+    assert (hash_values(values.slice(3)) == hashes[3:]).all()
+    assert (hash_values(values.cast(pa.large_string()))[[0, 1]] == hashes[[0, 1]]).all()
+    assert (hash_values(np.array([1, 2])) == hash_values(pa.array([1, 2]))).all()
+
+
+def test_unique_values(tmp_path):
+    seen = UniqueValues(str(tmp_path / "email"), capacity=1_000, error_rate=0.001)
+    values = pa.array(["a", "b", "a", None, None, "c"])
+
+    # Repeats within the batch are not new, nulls always are.
+    assert seen.new_values(values).tolist() == [True, True, False, True, True, True]
+    assert seen.new_values(pa.array(["c", "d"])).tolist() == [False, True]
+    # Another process sharing the files sees the same values.
+    shared = UniqueValues(str(tmp_path / "email"), capacity=1_000, error_rate=0.001)
+    assert shared.new_values(pa.array(["a", "e"])).tolist() == [False, True]
+
+
+def test_unique_values_rotation(tmp_path):
+    seen = UniqueValues(str(tmp_path / "id"), capacity=1_000, error_rate=0.001)
+    batches = [
+        pa.array(np.arange(start, start + 500)) for start in range(0, 5_000, 500)
+    ]
+    for batch in batches:
+        # Up to the false positive rate of the filters, new values are taken as new.
+        assert seen.new_values(batch).mean() > 0.98
+
+    # The latest `capacity` values are always remembered.
+    assert not seen.new_values(pa.array(np.arange(4_000, 5_000))).any()
+    # The older generations were cleared: memory stays at two filters.
+    assert seen.new_values(batches[0]).mean() > 0.98
+
+
+def test_retried_batch_gets_its_values_again(tmp_path):
+    keys = UniqueKeys(str(tmp_path), capacity=1_000, error_rate=0.001)
+    keys.new_values("email", pa.array(["old"]))
+
+    keys.start_batch("batch")
+    first = keys.new_values("email", pa.array(["a", "b", "a", "old"]))
+    keys.finish_batch("batch", loaded=False)
+    # Another batch sees the values of the failed one.
+    assert keys.new_values("email", pa.array(["a"])).tolist() == [False]
+
+    keys.start_batch("batch")
+    assert keys.new_values("email", pa.array(["a", "b", "a", "old"])).tolist() == (
+        first.tolist()
+    )
+    # Once each: within the attempt the values are seen again.
+    assert keys.new_values("email", pa.array(["a", "c"])).tolist() == [False, True]
+    keys.finish_batch("batch", loaded=True)
+    assert list(tmp_path.glob("*.batch.*")) == []
+
+    # The batch is loaded, its values are seen by a new attempt too.
+    keys.start_batch("batch")
+    assert keys.new_values("email", pa.array(["a", "c"])).tolist() == [False, False]
+
+
+def test_ulids_sort_by_time():
+    from column_generators import random_ulid_strings, _CROCKFORD_DIGITS
+
+    rng = np.random.default_rng(1)
+    now = datetime(2026, 1, 1, 12, 0, 0)
+    earlier = random_ulid_strings(1_000, rng, now)
+    later = random_ulid_strings(1_000, rng, now + timedelta(milliseconds=1))
+
+    assert max(earlier) < min(later)
+    assert len(set(earlier) | set(later)) == 2_000
+    assert all(len(ulid) == 26 for ulid in earlier)
+    assert set("".join(earlier)) <= set(_CROCKFORD_DIGITS.tobytes().decode())
+    # The first 10 characters are the millisecond timestamp.
+    alphabet = _CROCKFORD_DIGITS.tobytes().decode()
+    milliseconds = 0
+    for char in earlier[0][:10]:
+        milliseconds = milliseconds * 32 + alphabet.index(char)
+    assert milliseconds == int(now.timestamp() * 1000)
+
+
+def test_sequences(tmp_path):
+    keys = UniqueKeys(str(tmp_path), capacity=1_000, error_rate=0.001)
+    assert keys.next_ids("order_id", 3, start=100).tolist() == [100, 101, 102]
+    assert keys.next_ids("order_id", 2, start=100).tolist() == [103, 104]
+    assert keys.next_ids("customer_id", 1).tolist() == [1]
+
+
+def test_unique_column_keeps_batches_reproducible():
+    """
+    A seeded batch is the same in every run but for the replaced values of its unique
+    columns: the replacements are not drawn from the generator of the other columns.
+    """
+    from table_spec import compile_spec
+
+    plan = compile_spec(
+        {
+            "table": "fake_customers",
+            "columns": [
+                {"name": "email", "provider": "email", "unique": True},
+                {"name": "customer_id", "type": "uuid4"},
+                {"name": "score", "type": "integer", "unique": True, "max": 10**9},
+                {"name": "segment", "type": "choice", "values": ["a", "b", "c"]},
+            ],
+        }
+    )
+    now = datetime(2026, 1, 1)
+    first = plan.generate(1_000, rng=np.random.default_rng(1), now=now)
+    second = plan.generate(1_000, rng=np.random.default_rng(1), now=now)
+
+    assert first.select(["customer_id", "segment"]) == second.select(
+        ["customer_id", "segment"]
+    )
+    # Every value of the second run was seen in the first one and was replaced.
+    assert not set(first["email"].to_pylist()) & set(second["email"].to_pylist())
+    assert not set(first["score"].to_pylist()) & set(second["score"].to_pylist())
+
+    # A retry of a failed batch generates it again as it was.
+    from unique_keys import unique_keys
+
+    unique_keys.start_batch("batch")
+    attempt = plan.generate(1_000, rng=np.random.default_rng(2), now=now)
+    unique_keys.finish_batch("batch", loaded=False)
+    unique_keys.start_batch("batch")
+    retry = plan.generate(1_000, rng=np.random.default_rng(2), now=now)
+    unique_keys.finish_batch("batch", loaded=True)
+    assert retry == attempt